@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+__doc__ = """
+Deterministic generator of Serbo-Croatian-like text and EPUB documents.
+
+The same seed always gives the same corpus, so benchmark results and
+output checksums can be compared between versions of the program.
+"""
+
+import random
+
+
+# Syllables from which Serbian-looking words are built
+SYLLABLES = (
+    'ba', 'be', 'bi', 'bo', 'bu', 'da', 'de', 'di', 'do', 'du', 'đa', 'đe', 'đu',
+    'ga', 'go', 'gu', 'ja', 'je', 'ju', 'ka', 'ke', 'ki', 'ko', 'ku', 'la', 'le',
+    'li', 'lo', 'lu', 'lja', 'lje', 'lju', 'ma', 'me', 'mi', 'mo', 'na', 'ne', 'ni',
+    'no', 'nja', 'nje', 'nju', 'pa', 'pe', 'pi', 'po', 'ra', 're', 'ri', 'ro', 'ru',
+    'sa', 'se', 'si', 'so', 'ta', 'te', 'ti', 'to', 'tu', 'va', 've', 'vi', 'vo',
+    'za', 'ze', 'zi', 'ža', 'že', 'ži', 'ča', 'če', 'či', 'ća', 'će', 'ći', 'ša',
+    'še', 'ši', 'dža', 'dže', 'ca', 'ce', 'ci', 'ha', 'he', 'fa', 'fi', 'kra',
+    'pra', 'sta', 'stra', 'gra', 'dra', 'tr', 'vr', 'sr', 'kr', 'ob', 'od', 'iz',
+)
+# Short words which are frequent in running text
+FUNCTION_WORDS = (
+    'i', 'u', 'je', 'da', 'se', 'na', 'za', 'ne', 'od', 'sa', 'to', 'što', 'kao',
+    'ali', 'iz', 'po', 'o', 'a', 'još', 'bi', 'su', 'će', 'li', 'ga', 'ih', 'mu',
+)
+FOREIGN_WORDS = (
+    'the', 'of', 'and', 'New', 'York', 'Shakespeare', 'Washington', 'quiz',
+    'xerox', 'Müller', 'García', 'Łódź', 'Thomas', 'Smith', 'weekend', 'show',
+    'Facebook', 'Google', 'Windows', 'iPhone', 'www.knjige.rs', 'info@izdavac.com',
+)
+UNITS = ('5kg', '10km', '3m²', '20°C', '100MB', '5,5l', 'km/h', 'm/s', '12V', '3.5GHz', '250g', '2cm')
+# Words where Latin letter pairs must not become Cyrillic digraphs
+DIGRAPH_EXCEPTIONS = (
+    'injekcija', 'injekcije', 'konjugacija', 'konjunkcija', 'odjek', 'odjeka',
+    'odjaviti', 'nadjačati', 'podjednako', 'nadživeti', 'podžanr', 'adjektiv',
+)
+WHOLE_FOREIGN_PREFIXED = ('DJ-a', 'DJ-em', 'PC-ja', 'CD-om', 'DVD-a', 'OK-ej')
+PUNCTUATION = (',', ',', '.', '.', '!', '?', ';', ':', '...')
+QUOTES = (('„', '“'), ('"', '"'), ('«', '»'), ('(', ')'))
+
+
+class CorpusGenerator:
+
+    def __init__(self, seed=2023):
+        self._random = random.Random(seed)
+        # Limited vocabulary makes word frequencies resemble real books
+        self._vocabulary = [self._make_word() for _ in range(4000)]
+
+
+    def _make_word(self):
+        rnd = self._random
+        word = ''.join(rnd.choice(SYLLABLES) for _ in range(rnd.randint(1, 4)))
+        if rnd.random() < 0.12:
+            word = word.capitalize()
+        elif rnd.random() < 0.01:
+            word = word.upper()
+        return word
+
+
+    def word(self):
+        rnd = self._random
+        roll = rnd.random()
+        if roll < 0.30:
+            return rnd.choice(FUNCTION_WORDS)
+        if roll < 0.33:
+            return rnd.choice(FOREIGN_WORDS)
+        if roll < 0.345:
+            return rnd.choice(UNITS)
+        if roll < 0.36:
+            return rnd.choice(DIGRAPH_EXCEPTIONS)
+        if roll < 0.365:
+            return rnd.choice(WHOLE_FOREIGN_PREFIXED)
+        # Zipf-like choice from vocabulary
+        index = int(len(self._vocabulary) * rnd.random() ** 3)
+        return self._vocabulary[index]
+
+
+    def sentence(self):
+        rnd = self._random
+        words = [self.word() for _ in range(rnd.randint(3, 18))]
+        words[0] = words[0][:1].upper() + words[0][1:]
+        if rnd.random() < 0.1:
+            opening, closing = rnd.choice(QUOTES)
+            words[0] = opening + words[0]
+            words[-1] = words[-1] + closing
+        return ' '.join(words) + rnd.choice(PUNCTUATION)
+
+
+    def paragraph(self):
+        return ' '.join(self.sentence() for _ in range(self._random.randint(1, 8)))
+
+
+    # Plain text with roughly given number of words
+    def text(self, words):
+        paragraphs = []
+        count = 0
+        while count < words:
+            paragraph = self.paragraph()
+            count += len(paragraph.split())
+            paragraphs.append(paragraph)
+        return '\n'.join(paragraphs)
+
+
+    # Paragraph with inline markup
+    def html_paragraph(self):
+        rnd = self._random
+        sentences = [self.sentence() for _ in range(rnd.randint(1, 6))]
+        for i in range(len(sentences)):
+            roll = rnd.random()
+            if roll < 0.10:
+                sentences[i] = '<i>%s</i>' % (sentences[i])
+            elif roll < 0.15:
+                sentences[i] = '<b>%s</b>' % (sentences[i])
+            elif roll < 0.18:
+                sentences[i] = '<span class="naglasak">%s</span>' % (sentences[i])
+            elif roll < 0.20:
+                sentences[i] = '<a href="napomene.xhtml#n%d">%s</a>' % (rnd.randint(1, 99), sentences[i])
+        return '<p class="tekst">%s</p>' % (' '.join(sentences))
+
+
+    def xhtml_chapter(self, number, paragraphs):
+        rnd = self._random
+        body = ['<h2 id="glava%d">%s</h2>' % (number, self.sentence())]
+        for _ in range(paragraphs):
+            roll = rnd.random()
+            if roll < 0.02:
+                body.append('<div class="slika"><img src="../Images/slika%d.jpg"/></div>' % (rnd.randint(1, 9)))
+            elif roll < 0.03:
+                body.append('<table border="1"><tr><td>%s</td><td>%s</td></tr></table>' % (self.word(), self.word()))
+            elif roll < 0.05:
+                body.append('<p>* * *</p>')
+            else:
+                body.append(self.html_paragraph())
+        return ('<?xml version="1.0" encoding="utf-8"?>\n'
+            '<!DOCTYPE html PUBLIC "-//W3C//DTD XHTML 1.1//EN"\n'
+            '  "http://www.w3.org/TR/xhtml11/DTD/xhtml11.dtd">\n\n'
+            '<html xmlns="http://www.w3.org/1999/xhtml" lang="hr" xml:lang="hr">\n'
+            '<head>\n  <title>Glava %d</title>\n'
+            '  <link href="../Styles/stil.css" type="text/css" rel="stylesheet"/>\n</head>\n'
+            '<body>\n%s\n</body>\n</html>\n') % (number, '\n'.join(body))
+
+
+    def ncx(self, chapters):
+        points = []
+        for i in range(chapters):
+            points.append('<navPoint id="navPoint-%d" playOrder="%d"><navLabel><text>%s</text></navLabel>'
+                '<content src="Text/glava%03d.xhtml"/></navPoint>' % (i + 1, i + 1, self.sentence(), i + 1))
+        return ('<?xml version="1.0" encoding="utf-8"?>\n'
+            '<!DOCTYPE ncx PUBLIC "-//NISO//DTD ncx 2005-1//EN"\n'
+            '   "http://www.daisy.org/z3986/2005/ncx-2005-1.dtd">\n'
+            '<ncx xmlns="http://www.daisy.org/z3986/2005/ncx/" version="2005-1">\n'
+            '<head><meta name="dtb:uid" content="urn:uuid:benchmark"/></head>\n'
+            '<docTitle><text>%s</text></docTitle>\n<navMap>%s</navMap>\n</ncx>\n') % (self.sentence(), ''.join(points))
+
+
+    def metadata(self):
+        return ('<metadata xmlns="http://www.idpf.org/2007/opf" xmlns:dc="http://purl.org/dc/elements/1.1/"'
+            ' xmlns:opf="http://www.idpf.org/2007/opf">\n'
+            '  <dc:title>%s</dc:title>\n  <dc:creator opf:role="aut">%s %s</dc:creator>\n'
+            '  <dc:language>hr</dc:language>\n  <dc:description>%s</dc:description>\n'
+            '  <dc:publisher>%s</dc:publisher>\n  <dc:identifier id="uid">urn:uuid:benchmark</dc:identifier>\n'
+            '  <meta name="calibre:series" content="%s"/>\n</metadata>\n') % (self.sentence(),
+            self.word().capitalize(), self.word().capitalize(), self.paragraph(),
+            self.word().capitalize(), self.sentence())
+
+
+    # Returns dictionary with 'ncx', 'metadata' and list of (id, href, xhtml) chapters
+    def book(self, chapters, paragraphs_per_chapter=60):
+        pages = []
+        for i in range(chapters):
+            pages.append(('glava%03d' % (i + 1), 'Text/glava%03d.xhtml' % (i + 1),
+                self.xhtml_chapter(i + 1, paragraphs_per_chapter)))
+        return {
+            'ncx' : self.ncx(chapters),
+            'metadata' : self.metadata(),
+            'pages' : pages,
+        }
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+__doc__ = """
+In-memory stand-in for the book container object (bk) which Sigil passes to run().
+
+Only the part of Sigil's API used by the plugin is implemented.
+"""
+
+
+class FakeBook:
+
+    def __init__(self, book, prefs=None):
+        self._files = dict()
+        self._hrefs = []
+        for (id, href, xhtml) in book['pages']:
+            self._files[id] = xhtml
+            self._hrefs.append((id, href))
+        self._ncx_id = 'ncx'
+        self._files[self._ncx_id] = book['ncx']
+        self._metadata = book['metadata']
+        self._prefs = dict(prefs or {})
+        # Everything written by the plugin, by manifest id
+        self.written = dict()
+
+
+    def text_iter(self):
+        for (id, href) in self._hrefs:
+            yield (id, href)
+
+
+    def readfile(self, id):
+        return self._files[id]
+
+
+    def writefile(self, id, data):
+        if isinstance(data, bytes):
+            data = data.decode('utf-8')
+        self._files[id] = data
+        self.written[id] = data
+
+
+    def gettocid(self):
+        return self._ncx_id
+
+
+    def getmetadataxml(self):
+        return self._metadata
+
+
+    def setmetadataxml(self, data):
+        if isinstance(data, bytes):
+            data = data.decode('utf-8')
+        self._metadata = data
+        self.written['metadata'] = data
+
+
+    def getPrefs(self):
+        return self._prefs
+
+
+    def savePrefs(self, prefs):
+        self._prefs = dict(prefs)
+
+
+    def launcher_version(self):
+        return 'benchmark'
+
+
+    def epub_version(self):
+        return '2.0'
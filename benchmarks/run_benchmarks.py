@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+__doc__ = """
+Benchmarks of transliteration throughput.
+
+Run from the plugin directory:
+
+    python3 -m benchmarks.run_benchmarks [--sizes small,medium] [--json results.json]
+
+Every benchmark reports words/s, MB/s, peak memory allocated by Python
+and checksum of produced output. Document benchmarks also report peak
+memory per file, i.e. the largest memory allocated while converting one
+file, which counts whole-document copies made around parse and serialize. Saving results with --json and passing
+them later with --compare shows whether an optimization changed output.
+"""
+
+from   benchmarks.corpus   import CorpusGenerator
+from   benchmarks.fakebook import FakeBook
+import argparse
+import contextlib
+import hashlib
+import io
+import json
+import lib.py2srbcyr as pycir
+import plugin
+import re
+import sys
+import time
+import tracemalloc
+
+
+# Number of chapters and paragraphs per chapter of generated books
+BOOK_SIZES = {
+    'small' : (10, 40),
+    'medium' : (50, 60),
+    'large' : (200, 60),
+}
+TIMESTAMP_REGEX = re.compile(r'\d{4}-\d\d-\d\d \d\d:\d\d')
+
+
+# Time of transliteration differs between runs, so it is removed from checksum
+def checksum(outputs):
+    digest = hashlib.sha256()
+    for output in outputs:
+        if isinstance(output, bytes):
+            output = output.decode('utf-8')
+        digest.update(TIMESTAMP_REGEX.sub('', output).encode('utf-8'))
+    return digest.hexdigest()[:16]
+
+
+# Runs func() repeat times and returns (best time, result of the last run)
+def timed(func, repeat):
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, result
+
+
+# Previous implementation of SerbCyr.text_to_latin: regex alternation with
+# a Python callback per matched letter, kept as a baseline for comparison
+def regex_text_to_latin():
+    mapping = dict(pycir.SerbCyr._cyrillic_to_latin)
+    for letter in 'ЉЊЏ':
+        for vowel in 'аеиоу':
+            mapping[letter + vowel] = mapping[letter][0] + mapping[letter][1:].lower() + mapping[vowel]
+    regex = re.compile('|'.join(map(re.escape, sorted(mapping, key=len, reverse=True))))
+    return lambda text: regex.sub(lambda match: mapping[match.group(0)], text)
+
+
+def peak_memory(func):
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+# Largest memory allocated above the baseline while func(item) runs for one of items
+def file_peak_memory(func, items):
+    tracemalloc.start()
+    try:
+        peak = 0
+        for item in items:
+            base = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            func(item)
+            peak = max(peak, tracemalloc.get_traced_memory()[1] - base)
+        return peak
+    finally:
+        tracemalloc.stop()
+
+
+def count_words(texts):
+    return sum(len(text.split()) for text in texts)
+
+
+def count_bytes(texts):
+    return sum(len(text.encode('utf-8')) for text in texts)
+
+
+class Benchmarks:
+
+    def __init__(self, sizes, repeat=3, memory=True, workers=1, html_mode='tree', direction='lat2cyr'):
+        self.sizes = sizes
+        self.repeat = repeat
+        self.memory = memory
+        self.prefs = {'workers' : workers, 'html_mode' : html_mode, 'direction' : direction}
+        self.results = []
+
+
+    # per_file is (function converting one file, files) for memory per file
+    def measure(self, name, size, func, words, size_bytes, per_file=None):
+        seconds, outputs = timed(func, self.repeat)
+        result = {
+            'name' : name,
+            'size' : size,
+            'seconds' : round(seconds, 4),
+            'words_per_sec' : round(words / seconds),
+            'mb_per_sec' : round(size_bytes / seconds / 1e6, 3),
+            'peak_memory_mb' : round(peak_memory(func) / 1e6, 2) if self.memory else None,
+            'file_peak_kb' : round(file_peak_memory(*per_file) / 1e3, 1) if self.memory and per_file else None,
+            'checksum' : checksum(outputs),
+        }
+        self.results.append(result)
+        print_result(result)
+
+
+    def run(self):
+        for size in self.sizes:
+            chapters, paragraphs = BOOK_SIZES[size]
+            book = CorpusGenerator().book(chapters, paragraphs)
+            pages = [xhtml for (id, href, xhtml) in book['pages']]
+            texts = CorpusGenerator().text(count_words(pages) // 2).split('\n')
+            words = count_words(texts)
+            size_bytes = count_bytes(texts)
+
+            cyr = pycir.SerbCyr()
+            self.measure('text_to_cyrillic', size,
+                lambda: [cyr.text_to_cyrillic(text) for text in texts], words, size_bytes)
+            # New instance per run, so that the word cache starts cold
+            self.measure('transliterate_many', size,
+                lambda: pycir.SerbCyr(cache_size=plugin.WORD_CACHE_SIZE).transliterate_many(texts),
+                words, size_bytes)
+
+            cyrillic = [cyr.text_to_cyrillic(text) for text in texts]
+            size_bytes = count_bytes(cyrillic)
+            to_latin = regex_text_to_latin()
+            self.measure('text_to_latin[regex]', size,
+                lambda: [to_latin(text) for text in cyrillic], words, size_bytes)
+            self.measure('text_to_latin', size,
+                lambda: [cyr.text_to_latin(text) for text in cyrillic], words, size_bytes)
+
+            html_parser = plugin.create_html_parser()
+            xml_parser = plugin.create_xml_parser()
+            words = count_words(pages)
+            size_bytes = count_bytes(pages)
+            for html_mode in ('tree', 'stream'):
+                convert_page = lambda page: plugin.translit_html(page, cyr, html_parser, html_mode)
+                self.measure('html_lat2cyr[%s]' % (html_mode), size,
+                    lambda: [convert_page(page) for page in pages],
+                    words, size_bytes, (convert_page, pages))
+            # Classification only, as in analyze-only mode of the plugin
+            analyze_page = lambda page: json.dumps(sorted(plugin.analyze_html(page, cyr, html_parser)[0].items()))
+            self.measure('analyze_html', size,
+                lambda: [analyze_page(page) for page in pages],
+                words, size_bytes, (analyze_page, pages))
+            # Latin pages have nothing for SerbLat to convert, which leaves
+            # only parsing, walking and serializing of the document
+            lat = pycir.SerbLat()
+            convert_tree = lambda page: plugin.html_lat2cyr(page, lat, plugin.HTML_DOCTYPE, html_parser)
+            self.measure('html_lat2cyr[no text]', size,
+                lambda: [convert_tree(page) for page in pages],
+                words, size_bytes, (convert_tree, pages))
+            convert_ncx = lambda ncx: plugin.xml_lat2cyr(ncx, cyr, doctype=plugin.NCX_DOCTYPE, xml_parser=xml_parser)
+            self.measure('xml_lat2cyr[ncx]', size,
+                lambda: [convert_ncx(book['ncx'])],
+                count_words([book['ncx']]), count_bytes([book['ncx']]), (convert_ncx, [book['ncx']]))
+            self.measure('plugin.run', size, lambda: run_plugin(book, self.prefs),
+                words, size_bytes + count_bytes([book['ncx'], book['metadata']]))
+
+
+# Runs the whole plugin on in-memory book, returning written files
+def run_plugin(book, prefs):
+    bk = FakeBook(book, prefs)
+    with contextlib.redirect_stdout(io.StringIO()):
+        plugin.run(bk)
+    return [bk.written[id] for id in sorted(bk.written)]
+
+
+def print_result(result):
+    memory = '-' if result['peak_memory_mb'] is None else '%.2f' % (result['peak_memory_mb'])
+    file_memory = '-' if result['file_peak_kb'] is None else '%.1f' % (result['file_peak_kb'])
+    print('%-24s %-7s %9.3f s %12d w/s %9.3f MB/s %9s MB %9s kB  %s' % (result['name'], result['size'],
+        result['seconds'], result['words_per_sec'], result['mb_per_sec'], memory, file_memory, result['checksum']))
+
+
+# Returns list of benchmarks whose output differs from previous results
+def compare(results, previous):
+    checksums = dict(((r['name'], r['size']), r['checksum']) for r in previous)
+    changed = []
+    for result in results:
+        key = (result['name'], result['size'])
+        if key in checksums and checksums[key] != result['checksum']:
+            changed.append(key)
+    return changed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Transliteration benchmarks')
+    parser.add_argument('--sizes', default='small,medium,large',
+        help='comma separated book sizes: %s' % (', '.join(BOOK_SIZES)))
+    parser.add_argument('--repeat', type=int, default=3, help='runs per benchmark, best time is reported')
+    parser.add_argument('--no-memory', action='store_true', help='skip peak memory measurement')
+    parser.add_argument('--workers', type=int, default=1, help='worker processes for plugin.run')
+    parser.add_argument('--html-mode', choices=('tree', 'stream'), default='tree', help='html_mode for plugin.run')
+    parser.add_argument('--direction', choices=('lat2cyr', 'cyr2lat'), default='lat2cyr', help='direction for plugin.run')
+    parser.add_argument('--json', help='save results into JSON file')
+    parser.add_argument('--compare', help='compare checksums with results saved earlier')
+    args = parser.parse_args(argv)
+
+    sizes = [size.strip() for size in args.sizes.split(',') if size.strip()]
+    for size in sizes:
+        if size not in BOOK_SIZES:
+            parser.error("unknown size '%s'" % (size))
+    benchmarks = Benchmarks(sizes, args.repeat, not args.no_memory, args.workers, args.html_mode, args.direction)
+    print('%-24s %-7s %11s %16s %14s %12s %12s  %s' % ('benchmark', 'size', 'time', 'words', 'throughput', 'peak mem',
+        'file peak', 'checksum'))
+    benchmarks.run()
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(benchmarks.results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            changed = compare(benchmarks.results, json.load(f))
+        for (name, size) in changed:
+            print("Output of '%s' (%s) differs from '%s'" % (name, size, args.compare))
+        if changed:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# vim:ts=4:sw=4:softtabstop=4:smarttab:expandtab
+
+# Command line interface, for use outside of Sigil
+
+from   datetime  import datetime
+from   lib.analysis import Analysis
+import argparse
+import io
+import lib.batch as batch
+import lib.daemon as daemon
+import lib.epub as epub
+import lib.py2srbcyr as pycir
+import lib.spool as spool
+import multiprocessing
+import os
+import plugin
+import signal
+import sys
+
+
+# Transliterates EPUB file without unpacking it
+def cmd_epub(args):
+    cyr = plugin.create_converter(args.direction, args.disk_cache, args.overlay)
+    rules = plugin.create_html_rules(args.rules)
+    html_parser = plugin.create_html_parser()
+    xml_parser = plugin.create_xml_parser()
+    start = datetime.now()
+    plugin.convert_epub_file(args.input, args.output, cyr, html_parser, xml_parser, args.html_mode, rules,
+        log=None if args.quiet else lambda path: print("Пресловљена датотека '%s'" % (path)))
+    end = datetime.now()
+    if not args.quiet:
+        print("Трајање пресловљавања: %f секунди" % (end - start).total_seconds())
+    return 0
+
+
+# Prints result of one book converted by cmd_batch
+def log_book(record):
+    if record['status'] == batch.STATUS_DONE:
+        print("Пресловљена књига '%s' (%.2f s)" % (record['input'], record['seconds']))
+    else:
+        print("ГРЕШКА: Књига '%s' није пресловљена (%s)" % (record['input'], record['error']))
+
+
+# Transliterates many EPUB files in a pool of processes. Journal records
+# every finished book, so that running the same command again converts
+# only books which are not done yet.
+def cmd_batch(args):
+    try:
+        jobs = batch.load_books(args.source, args.output_dir)
+    except (OSError, ValueError) as e:
+        print("Грешка: %s" % (e), file=sys.stderr)
+        return 1
+    journal = batch.Journal(args.journal or os.path.join(args.output_dir, batch.DEFAULT_JOURNAL_NAME))
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+    try:
+        summary = batch.run_batch(jobs, plugin.worker_convert_epub, journal, args.workers,
+            initializer=plugin.init_worker, initargs=(args.html_mode, args.direction, args.rules, args.disk_cache, args.overlay),
+            largest_first=args.order == 'largest', log=None if args.quiet else log_book)
+    finally:
+        journal.close()
+    print("*** Статистика пресловљавања књига ***")
+    for line in summary.lines():
+        print(line)
+    return 1 if summary.failed else 0
+
+
+# Adds books from directory tree or list to the spool queue
+def cmd_enqueue(args):
+    try:
+        jobs = batch.load_books(args.source, args.output_dir)
+    except (OSError, ValueError) as e:
+        print("Грешка: %s" % (e), file=sys.stderr)
+        return 1
+    if args.order == 'largest':
+        jobs.sort(key=lambda job: job.size, reverse=True)
+    ids = spool.enqueue(args.spool, jobs)
+    if not args.quiet:
+        print("Број додатих књига: %d" % (len(ids)))
+        for (name, count) in sorted(spool.spool_status(args.spool).items()):
+            print('%-28s %8d' % (name, count))
+    return 0
+
+
+# Prints result of one job converted by cmd_worker
+def log_job(record):
+    if record['status'] == batch.STATUS_DONE:
+        print("Пресловљена књига '%s' (%.2f s, %s)" % (record['input'], record['seconds'], record['worker']))
+    elif record['status'] == batch.STATUS_FAILED:
+        print("ГРЕШКА: Књига '%s' није пресловљена (%s)" % (record['input'], record['error']))
+    else:
+        print("ПАЖЊА: Књигу '%s' је преузео други процес, резултат није објављен" % (record['input']))
+
+
+# Converts books from spool directory shared with other workers
+def cmd_worker(args):
+    initargs = (args.html_mode, args.direction, args.rules, args.disk_cache, args.overlay)
+    options = {'lease_timeout' : args.lease_timeout, 'poll_interval' : args.poll_interval,
+        'log' : None if args.quiet else log_job}
+    # Job being converted goes back to the queue when worker is stopped
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    if args.processes <= 1:
+        try:
+            worker = spool.SpoolWorker(args.spool, plugin.worker_convert_epub, plugin.init_worker, initargs, **options)
+            worker.run(args.max_jobs, args.drain)
+        except KeyboardInterrupt:
+            pass
+        return 0
+    processes = [multiprocessing.Process(target=spool.run_worker, args=(args.spool, plugin.worker_convert_epub,
+        plugin.init_worker, initargs, options, args.max_jobs, args.drain)) for _ in range(args.processes)]
+    for process in processes:
+        process.start()
+    try:
+        for process in processes:
+            process.join()
+    except (KeyboardInterrupt, SystemExit):
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.join()
+    return 0
+
+
+# Reports what transliteration of EPUB file would change, without writing anything
+def cmd_analyze(args):
+    cyr = plugin.create_converter(args.direction, overlays=args.overlay)
+    rules = plugin.create_html_rules(args.rules)
+    html_parser = plugin.create_html_parser()
+    xml_parser = plugin.create_xml_parser()
+    start = datetime.now()
+    analysis = Analysis(cyr.C_ANALYSIS_COUNTERS, cyr.C_ANALYSIS_COUNTERS[1])
+    memo = dict()
+    for (kind, path, source) in epub.read_documents(args.input):
+        if kind == 'xhtml':
+            analysis.add_file(path, *plugin.analyze_html(source, cyr, html_parser, rules=rules, memo=memo))
+        else:
+            analysis.add_file(path, *plugin.analyze_xml(source, cyr, xml_parser, memo=memo))
+    end = datetime.now()
+    print("Трајање анализе: %f секунди" % (end - start).total_seconds())
+    plugin.report_analysis(analysis, args.top, args.json)
+    return 0
+
+
+# Transliterates plain text file of any size, by default from standard input to standard output
+def cmd_text(args):
+    cyr = plugin.create_converter(args.direction, args.disk_cache, args.overlay)
+    # newline='' keeps line endings exactly as they are
+    infile = open(args.input, 'r', encoding='utf-8', newline='') if args.input != '-' else \
+        io.TextIOWrapper(sys.stdin.buffer, encoding='utf-8', newline='')
+    outfile = open(args.output, 'w', encoding='utf-8', newline='') if args.output != '-' else \
+        io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8', newline='')
+    with infile, outfile:
+        cyr.transliterate_stream(infile, outfile, args.chunk_size)
+    return 0
+
+
+# Runs server keeping converters in memory between requests
+def cmd_serve(args):
+    server = daemon.TransliterationServer(args.socket, plugin.worker_convert, workers=args.workers,
+        initializer=plugin.init_worker, initargs=(args.html_mode, args.direction, args.rules, args.disk_cache, args.overlay))
+    # Stop the same way as on Ctrl+C
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    if not args.quiet:
+        print("Сервер ослушкује на '%s' (%d процеса)" % (args.socket, args.workers))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+# Sends one document to the server, writing converted document to output
+def cmd_client(args):
+    if args.input == '-':
+        data = sys.stdin.buffer.read()
+    else:
+        with open(args.input, 'rb') as f:
+            data = f.read()
+    try:
+        with daemon.Client(args.socket) as client:
+            result = client.request(args.kind, data)
+    except (OSError, daemon.ProtocolError, daemon.ServerError) as e:
+        print("Грешка: %s" % (e), file=sys.stderr)
+        return 1
+    if args.output == '-':
+        sys.stdout.buffer.write(result)
+        sys.stdout.buffer.flush()
+    else:
+        with open(args.output, 'wb') as f:
+            f.write(result)
+    return 0
+
+
+# Argument type for counts and sizes which must be greater than zero
+def positive_int(value):
+    number = int(value)
+    if number <= 0:
+        raise argparse.ArgumentTypeError("вредност мора бити већа од нуле: '%s'" % (value))
+    return number
+
+
+# Adds options choosing how text is converted, shared by all commands
+# which convert (see plugin.create_converter and plugin.init_worker)
+def add_conversion_options(cmd, html_mode=True, rules=True, disk_cache=True):
+    if html_mode:
+        cmd.add_argument('--html-mode', choices=('tree', 'stream'), default=plugin.DEFAULT_PREFS['html_mode'],
+            help='начин обраде XHTML датотека')
+    cmd.add_argument('--direction', choices=('lat2cyr', 'cyr2lat'), default=plugin.DEFAULT_PREFS['direction'],
+        help='смер пресловљавања: латиница у ћирилицу или ћирилица у латиницу')
+    if rules:
+        cmd.add_argument('--rules', default='', help='JSON датотека са правилима за HTML елементе (lib/rules.py)')
+    if disk_cache:
+        cmd.add_argument('--disk-cache', default='', help='SQLite датотека са речима пресловљеним у ранијим покретањима')
+    cmd.add_argument('--overlay', action='append', default=[],
+        help='датотека са речима корисника које се додају списковима (lib/overlay.py); може се навести више пута')
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='lat2cyr',
+        description='Пресловљавање са латинице на српску ћирилицу и обрнуто')
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    cmd = commands.add_parser('epub', help='пресловљавање ЕПУБ датотеке')
+    cmd.add_argument('input', help='улазна ЕПУБ датотека')
+    cmd.add_argument('output', help='излазна ЕПУБ датотека')
+    add_conversion_options(cmd)
+    cmd.add_argument('-q', '--quiet', action='store_true', help='без исписа')
+    cmd.set_defaults(func=cmd_epub)
+
+    cmd = commands.add_parser('batch', help='пресловљавање много ЕПУБ датотека, са наставком прекинутог посла')
+    cmd.add_argument('source', help='директоријум са ЕПУБ датотекама или списак датотека (lib/batch.py)')
+    cmd.add_argument('--output-dir', help='директоријум у који се пишу пресловљене датотеке')
+    cmd.add_argument('--journal', help='JSON Lines датотека са записом о свакој књизи (подразумевано %s у излазном директоријуму)'
+        % (batch.DEFAULT_JOURNAL_NAME))
+    cmd.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='број процеса који пресловљавају')
+    cmd.add_argument('--order', choices=('largest', 'list'), default='largest',
+        help='редослед књига: највеће прве или редом из списка')
+    add_conversion_options(cmd)
+    cmd.add_argument('-q', '--quiet', action='store_true', help='без исписа појединачних књига')
+    cmd.set_defaults(func=cmd_batch)
+
+    cmd = commands.add_parser('enqueue', help='додавање књига у ред за обраду у директоријуму (lib/spool.py)')
+    cmd.add_argument('source', help='директоријум са ЕПУБ датотекама или списак датотека (lib/batch.py)')
+    cmd.add_argument('--spool', required=True, help='директоријум реда за обраду, заједнички за све процесе')
+    cmd.add_argument('--output-dir', help='директоријум у који се пишу пресловљене датотеке')
+    cmd.add_argument('--order', choices=('largest', 'list'), default='largest',
+        help='редослед књига: највеће прве или редом из списка')
+    cmd.add_argument('-q', '--quiet', action='store_true', help='без исписа')
+    cmd.set_defaults(func=cmd_enqueue)
+
+    cmd = commands.add_parser('worker', help='пресловљавање књига из реда за обраду у директоријуму (lib/spool.py)')
+    cmd.add_argument('--spool', required=True, help='директоријум реда за обраду, заједнички за све процесе')
+    cmd.add_argument('--processes', type=int, default=1, help='број процеса који пресловљавају на овом рачунару')
+    cmd.add_argument('--lease-timeout', type=float, default=spool.DEFAULT_LEASE_TIMEOUT,
+        help='број секунди после којег се посао процеса који се не јавља враћа у ред')
+    cmd.add_argument('--poll-interval', type=float, default=spool.DEFAULT_POLL_INTERVAL,
+        help='број секунди између провера празног реда')
+    cmd.add_argument('--max-jobs', type=int, help='број књига после којег процес завршава рад')
+    cmd.add_argument('--drain', action='store_true', help='завршетак рада када у реду и у обради више нема књига')
+    add_conversion_options(cmd)
+    cmd.add_argument('-q', '--quiet', action='store_true', help='без исписа појединачних књига')
+    cmd.set_defaults(func=cmd_worker)
+
+    cmd = commands.add_parser('analyze', help='анализа ЕПУБ датотеке без пресловљавања')
+    cmd.add_argument('input', help='улазна ЕПУБ датотека')
+    add_conversion_options(cmd, html_mode=False, disk_cache=False)
+    cmd.add_argument('--top', type=int, default=plugin.DEFAULT_PREFS['top_hits'],
+        help='број најчешћих страних речи и изузетака у извештају')
+    cmd.add_argument('--json', default='', help='JSON датотека у коју се чува извештај')
+    cmd.set_defaults(func=cmd_analyze)
+
+    cmd = commands.add_parser('text', help='пресловљавање текстуалне датотеке произвољне величине')
+    cmd.add_argument('input', nargs='?', default='-', help='улазна датотека (подразумевано стандардни улаз)')
+    cmd.add_argument('output', nargs='?', default='-', help='излазна датотека (подразумевано стандардни излаз)')
+    add_conversion_options(cmd, html_mode=False, rules=False)
+    cmd.add_argument('--chunk-size', type=positive_int, default=pycir.DEFAULT_CHUNK_SIZE,
+        help='број знакова који се чита одједном')
+    cmd.set_defaults(func=cmd_text)
+
+    cmd = commands.add_parser('serve', help='сервер за пресловљавање на Unix утичници (lib/daemon.py)')
+    cmd.add_argument('--socket', default=daemon.DEFAULT_SOCKET_PATH, help='путања Unix утичнице')
+    cmd.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='број процеса који пресловљавају')
+    add_conversion_options(cmd)
+    cmd.add_argument('-q', '--quiet', action='store_true', help='без исписа')
+    cmd.set_defaults(func=cmd_serve)
+
+    cmd = commands.add_parser('client', help='пресловљавање датотеке помоћу покренутог сервера')
+    cmd.add_argument('input', nargs='?', default='-', help='улазна датотека (подразумевано стандардни улаз)')
+    cmd.add_argument('output', nargs='?', default='-', help='излазна датотека (подразумевано стандардни излаз)')
+    cmd.add_argument('--socket', default=daemon.DEFAULT_SOCKET_PATH, help='путања Unix утичнице')
+    cmd.add_argument('--kind', choices=daemon.KINDS, default='text', help='врста датотеке')
+    cmd.set_defaults(func=cmd_client)
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.command == 'batch' and not args.output_dir and not args.journal:
+        parser.error('batch: --output-dir or --journal is required')
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
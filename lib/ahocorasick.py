@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+__doc__ = """
+Aho-Corasick multi-pattern matcher.
+
+All patterns are compiled into one deterministic automaton, so a text is
+checked against every pattern in a single left-to-right scan. Each pattern
+carries a label and a scan reports the set of labels that matched.
+"""
+
+
+class AhoCorasick:
+
+    def __init__(self, patterns):
+        # patterns is an iterable of (pattern, label) pairs
+        goto = [dict()]
+        outputs = [set()]
+        for pattern, label in patterns:
+            if pattern == '':
+                continue
+            state = 0
+            for ch in pattern:
+                nxt = goto[state].get(ch)
+                if nxt is None:
+                    nxt = len(goto)
+                    goto[state][ch] = nxt
+                    goto.append(dict())
+                    outputs.append(set())
+                state = nxt
+            outputs[state].add(label)
+        self._transitions, self._outputs = self._build(goto, outputs)
+
+
+    # Resolves failure links breadth-first and turns the trie into a full
+    # transition table, so scanning never has to follow failure links.
+    # Only transitions that do not lead back to the root are stored.
+    def _build(self, goto, outputs):
+        alphabet = set()
+        for edges in goto:
+            alphabet.update(edges)
+        fail = [0] * len(goto)
+        transitions = [dict() for _ in goto]
+        order = []
+        for ch, child in goto[0].items():
+            transitions[0][ch] = child
+            order.append(child)
+        head = 0
+        while head < len(order):
+            state = order[head]
+            head += 1
+            outputs[state] |= outputs[fail[state]]
+            for ch in alphabet:
+                child = goto[state].get(ch)
+                if child is not None:
+                    fail[child] = transitions[fail[state]].get(ch, 0)
+                    transitions[state][ch] = child
+                    order.append(child)
+                else:
+                    target = transitions[fail[state]].get(ch, 0)
+                    if target:
+                        transitions[state][ch] = target
+        return transitions, [frozenset(out) for out in outputs]
+
+
+    # Returns set of labels of all patterns found in text
+    def scan(self, text):
+        transitions = self._transitions
+        outputs = self._outputs
+        found = set()
+        state = 0
+        for ch in text:
+            state = transitions[state].get(ch, 0)
+            if outputs[state]:
+                found |= outputs[state]
+        return found
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+__doc__ = """
+Asyncio interface for transliteration inside async services.
+
+Conversions run in a pool of threads or processes, so large documents
+do not block the event loop. Number of conversions running at once is
+limited; callers over the limit wait for a free slot, which slows down
+whoever produces the work. Cancelling a task stops chunked conversion
+before the next chunk (the chunk being converted is finished by its
+worker and dropped).
+
+    import plugin
+    from   lib.aio import AsyncTransliterator
+
+    async with AsyncTransliterator(plugin.worker_convert_document,
+            plugin.init_worker, ('tree', 'lat2cyr', '')) as translit:
+        cyrillic = await translit.transliterate('Dobar dan')
+        xhtml = await translit.convert('xhtml', source)
+        async for piece in translit.transliterate_chunks(request.content.iter_chunked(65536)):
+            await response.write(piece.encode('utf-8'))
+"""
+
+from   concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from   .py2srbcyr import split_chunk
+import asyncio
+import codecs
+
+
+# Yields items of asynchronous or ordinary iterable
+async def iterate(items):
+    if hasattr(items, '__aiter__'):
+        async for item in items:
+            yield item
+    else:
+        for item in items:
+            yield item
+
+
+class AsyncTransliterator:
+
+    # convert(kind, source) is called in worker thread or process, after
+    # initializer(*initargs) has prepared it (plugin.worker_convert_document
+    # and plugin.init_worker). Processes need module-level functions.
+    # Executor given by caller is used as it is and is not shut down.
+    def __init__(self, convert, initializer=None, initargs=(), workers=4, processes=False,
+            max_concurrency=None, executor=None):
+        self._convert = convert
+        self._own_executor = executor is None
+        if executor is None:
+            pool = ProcessPoolExecutor if processes else ThreadPoolExecutor
+            executor = pool(workers, initializer=initializer, initargs=initargs)
+        self._executor = executor
+        self._max_concurrency = max_concurrency or workers
+        # Created on first use, inside running event loop
+        self._semaphore = None
+
+
+    async def __aenter__(self):
+        return self
+
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+
+    async def close(self):
+        if self._own_executor:
+            await asyncio.get_running_loop().run_in_executor(None, self._executor.shutdown)
+
+
+    # Returns converted document: str for 'text', bytes for 'xhtml', 'ncx' and 'opf'
+    async def convert(self, kind, source):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self._max_concurrency)
+        async with self._semaphore:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, self._convert, kind, source)
+
+
+    async def transliterate(self, text):
+        return await self.convert('text', text)
+
+
+    # Transliterates text arriving in chunks (str, or bytes in given
+    # encoding), yielding converted pieces. Word split between chunks is
+    # carried over to the next one, so the output equals transliteration
+    # of the whole text.
+    async def transliterate_chunks(self, chunks, encoding='utf-8'):
+        decoder = codecs.getincrementaldecoder(encoding)()
+        carry = ''
+        async for chunk in iterate(chunks):
+            if isinstance(chunk, (bytes, bytearray, memoryview)):
+                chunk = decoder.decode(chunk)
+            (text, carry) = split_chunk(carry + chunk)
+            if text:
+                yield await self.transliterate(text)
+        text = carry + decoder.decode(b'', final=True)
+        if text:
+            yield await self.transliterate(text)
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+__doc__ = """
+Report of what transliteration of a book would change, collected without
+converting or writing any file (analyze-only mode).
+
+Words of every file are classified by converter's analyze_many(): how
+many of them are in the script being converted, and how many of those
+would be left as foreign words, split at digraph exceptions or skipped
+as measurement units. Words and list entries behind these decisions are
+counted for the whole book, and the most frequent ones are reported.
+"""
+
+from   collections import Counter, OrderedDict
+import json
+
+
+class Analysis:
+
+    # columns are names of counters shown per file and for the book
+    # (converter's C_ANALYSIS_COUNTERS); file needs transliteration when
+    # its counter script_column is not zero
+    def __init__(self, columns, script_column):
+        self.columns = tuple(columns)
+        self.script_column = script_column
+        self.files = []
+        self.totals = Counter()
+        self.hits = Counter()
+
+
+    # decisions and hits are results of converter's analyze_many()
+    def add_file(self, name, decisions, hits):
+        row = OrderedDict(file=name)
+        for column in self.columns:
+            row[column] = decisions[column]
+        self.files.append(row)
+        self.totals.update(decisions)
+        self.hits.update(hits)
+
+
+    # Names of files containing words to convert
+    def files_to_convert(self):
+        return [row['file'] for row in self.files if row[self.script_column]]
+
+
+    # Returns [(word or list entry, count)] of the n most frequent hits
+    # of given decision, ties in alphabetical order
+    def top(self, decision, n):
+        hits = [(entry, count) for (name, entry), count in self.hits.items() if name == decision]
+        hits.sort(key=lambda hit: (-hit[1], hit[0]))
+        return hits[:n]
+
+
+    # Decisions having hits, in the order of columns
+    def decisions(self):
+        found = set(name for (name, entry) in self.hits)
+        return [column for column in self.columns if column in found]
+
+
+    def as_dict(self, top_n):
+        return {
+            'files' : list(self.files),
+            'files_to_convert' : len(self.files_to_convert()),
+            'totals' : OrderedDict((column, self.totals[column]) for column in self.columns),
+            'top' : OrderedDict((decision, self.top(decision, top_n)) for decision in self.decisions()),
+        }
+
+
+    def save_json(self, path, top_n):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.as_dict(top_n), f, ensure_ascii=False, indent=2)
+
+
+    # Returns lines of tables with files, book totals and top_n hits of each decision
+    def summary(self, top_n):
+        widths = [max(8, len(column)) for column in self.columns]
+        lines = ['%-40s' % ('file') + ''.join(' %*s' % (width, column) for width, column in zip(widths, self.columns))]
+        for row in self.files:
+            lines.append('%-40s' % (row['file']) + ''.join(' %*d' % (width, row[column])
+                for width, column in zip(widths, self.columns)))
+        lines.append('')
+        lines.append('%-28s %8d' % ('files', len(self.files)))
+        lines.append('%-28s %8d' % ('files_to_convert', len(self.files_to_convert())))
+        for column in self.columns:
+            lines.append('%-28s %8d' % (column, self.totals[column]))
+        for decision in self.decisions():
+            lines.append('')
+            lines.append('%s (top %d)' % (decision, top_n))
+            for entry, count in self.top(decision, top_n):
+                lines.append('  %-26s %8d' % (entry, count))
+        return lines
@@ -0,0 +1,343 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+__doc__ = """
+Conversion of many EPUB files in a pool of processes, with a journal
+which lets an interrupted batch continue where it stopped.
+
+Books are all *.epub files found in a directory tree, or are listed in
+a text file, one per line: input path, optionally followed by a tab and
+output path. Relative paths are relative to the directory of the list;
+lines starting with '#' are skipped. Book without output path is written
+under output directory, at the same relative path as the input.
+
+Journal is a JSON Lines file, to which one record is appended for every
+finished book:
+
+    {"input" : "...", "output" : "...", "status" : "done" or "failed",
+     "input_size" : ..., "input_mtime_ns" : ..., "input_sha256" : "...",
+     "output_size" : ..., "output_sha256" : "...", "seconds" : ...,
+     "worker" : pid, "finished" : "2024-01-31T12:00:00", "error" : "..."}
+
+When a batch is run again with the same journal, books whose last
+record says they are done are skipped, unless their input has changed
+(size or time of modification) or their output is missing. Output is
+written to a temporary file and renamed when complete, so a crash never
+leaves a partial book looking converted.
+"""
+
+from   collections import namedtuple
+from   concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from   concurrent.futures.process import BrokenProcessPool
+from   datetime import datetime
+from   .daemon import init_pool_worker
+import hashlib
+import json
+import multiprocessing
+import os
+import time
+import uuid
+
+
+EPUB_EXTENSION = '.epub'
+DEFAULT_JOURNAL_NAME = 'lat2cyr-journal.jsonl'
+STATUS_DONE = 'done'
+STATUS_FAILED = 'failed'
+# Books waiting in the pool per worker, so that workers never wait for the next book
+JOBS_PER_WORKER = 2
+HASH_BLOCK_SIZE = 1024 * 1024
+
+Job = namedtuple('Job', ['input', 'output', 'size'])
+
+# In worker processes of run_batch, queue to which inputs of books are
+# put when their conversion starts
+_started = None
+
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def make_job(input, output):
+    if os.path.abspath(input) == os.path.abspath(output):
+        raise ValueError("'%s': output would replace input" % (input))
+    return Job(input, output, os.path.getsize(input))
+
+
+# Returns jobs for all EPUB files under root, in sorted order. Output
+# directory is skipped when it is inside root.
+def find_books(root, output_dir):
+    skipped = os.path.realpath(output_dir)
+    jobs = []
+    for (dirpath, dirnames, filenames) in os.walk(root):
+        dirnames[:] = sorted(name for name in dirnames if os.path.realpath(os.path.join(dirpath, name)) != skipped)
+        for name in sorted(filenames):
+            if name.lower().endswith(EPUB_EXTENSION):
+                input = os.path.join(dirpath, name)
+                jobs.append(make_job(input, os.path.join(output_dir, os.path.relpath(input, root))))
+    return jobs
+
+
+# Returns jobs listed in text file, in the order of the list
+def read_book_list(path, output_dir=None):
+    base = os.path.dirname(os.path.abspath(path))
+    jobs = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for number, line in enumerate(f.read().splitlines(), 1):
+            if line.strip() == '' or line.lstrip().startswith('#'):
+                continue
+            fields = line.split('\t')
+            input = os.path.join(base, fields[0].strip())
+            if len(fields) > 1 and fields[1].strip():
+                output = os.path.join(base, fields[1].strip())
+            elif output_dir is not None:
+                output = os.path.join(output_dir, fields[0].strip().lstrip(os.sep))
+            else:
+                raise ValueError("'%s', line %d: output path is missing and there is no output directory" % (path, number))
+            jobs.append(make_job(input, output))
+    return jobs
+
+
+# Returns jobs from directory tree or list of books
+def load_books(source, output_dir=None):
+    if os.path.isdir(source):
+        if output_dir is None:
+            raise ValueError("output directory is required for directory '%s'" % (source))
+        return find_books(source, output_dir)
+    return read_book_list(source, output_dir)
+
+
+class Journal:
+
+    def __init__(self, path):
+        self.path = path
+        self._fd = None
+
+
+    # Returns the last record of every input, skipping damaged lines
+    # (e.g. the last one, if the batch was killed while writing it)
+    def read(self):
+        records = dict()
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue
+                    if isinstance(record, dict) and 'input' in record:
+                        records[record['input']] = record
+        except FileNotFoundError:
+            pass
+        return records
+
+
+    # Record is written by single write to file opened for appending,
+    # and is on disk before the next book is reported
+    def append(self, record):
+        if self._fd is None:
+            self._fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            # Damaged last line must not swallow the first new record
+            size = os.fstat(self._fd).st_size
+            if size > 0:
+                with open(self.path, 'rb') as f:
+                    f.seek(size - 1)
+                    if f.read(1) != b'\n':
+                        os.write(self._fd, b'\n')
+        os.write(self._fd, (json.dumps(record, ensure_ascii=False) + '\n').encode('utf-8'))
+        os.fsync(self._fd)
+
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+
+# True if record of the journal says that job is done and neither its
+# input nor its output has changed since
+def is_completed(record, job):
+    if record is None or record.get('status') != STATUS_DONE or record.get('output') != job.output:
+        return False
+    try:
+        input_stat = os.stat(job.input)
+        output_size = os.path.getsize(job.output)
+    except OSError:
+        return False
+    return record.get('input_size') == input_stat.st_size and \
+        record.get('input_mtime_ns') == input_stat.st_mtime_ns and \
+        record.get('output_size') == output_size
+
+
+def new_record(job, status):
+    return {'input' : job.input, 'output' : job.output, 'status' : status, 'worker' : os.getpid(),
+        'finished' : datetime.now().isoformat(timespec='seconds')}
+
+
+# Runs in worker process: converts one book with convert(input, output)
+# and returns its journal record. Errors are recorded as text, since
+# exceptions (e.g. from lxml) may not be picklable.
+def run_job(convert, job):
+    start = time.perf_counter()
+    # Unique even for workers with the same pid on other hosts or containers
+    temporary = '%s.%s.tmp' % (job.output, uuid.uuid4().hex)
+    if _started is not None:
+        _started.put(job.input)
+    try:
+        stat = os.stat(job.input)
+        input_sha256 = file_digest(job.input)
+        directory = os.path.dirname(job.output)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        convert(job.input, temporary)
+        os.replace(temporary, job.output)
+        record = new_record(job, STATUS_DONE)
+        record.update(input_size=stat.st_size, input_mtime_ns=stat.st_mtime_ns, input_sha256=input_sha256,
+            output_size=os.path.getsize(job.output), output_sha256=file_digest(job.output))
+    except BaseException as e:
+        try:
+            os.remove(temporary)
+        except OSError:
+            pass
+        # Worker being stopped is not a failure of the book
+        if not isinstance(e, Exception):
+            raise
+        record = new_record(job, STATUS_FAILED)
+        record['error'] = '%s: %s' % (type(e).__name__, e)
+    record['seconds'] = round(time.perf_counter() - start, 4)
+    return record
+
+
+# Totals of a batch
+class Summary:
+
+    def __init__(self, books):
+        self.books = books
+        self.done = 0
+        self.failed = 0
+        self.skipped = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        # Sum of conversion times of books, larger than elapsed time when workers run in parallel
+        self.book_seconds = 0.0
+        self.seconds = 0.0
+
+
+    def add(self, record):
+        if record['status'] == STATUS_DONE:
+            self.done += 1
+            self.bytes_in += record['input_size']
+            self.bytes_out += record['output_size']
+        else:
+            self.failed += 1
+        self.book_seconds += record.get('seconds', 0.0)
+
+
+    def as_dict(self):
+        return dict(self.__dict__)
+
+
+    # Returns lines of table with counts and throughput
+    def lines(self):
+        seconds = max(self.seconds, 1e-9)
+        return [
+            '%-28s %12d' % ('books', self.books),
+            '%-28s %12d' % ('done', self.done),
+            '%-28s %12d' % ('failed', self.failed),
+            '%-28s %12d' % ('skipped', self.skipped),
+            '%-28s %12.3f' % ('seconds', self.seconds),
+            '%-28s %12.3f' % ('book_seconds', self.book_seconds),
+            '%-28s %12.3f' % ('books_per_sec', self.done / seconds),
+            '%-28s %12.3f' % ('mb_in_per_sec', self.bytes_in / seconds / 1e6),
+            '%-28s %12.3f' % ('mb_out_per_sec', self.bytes_out / seconds / 1e6),
+        ]
+
+
+def init_batch_worker(started, initializer, initargs):
+    global _started
+    _started = started
+    init_pool_worker(initializer, initargs)
+
+
+# Converts books which are not done yet according to journal, in
+# workers processes prepared by initializer(*initargs); convert(input,
+# output) must be picklable (module-level function). Largest books go
+# first, so that the last books to finish are small ones. log(record)
+# is called for every finished book. If a worker process dies, books
+# whose conversion had started are recorded as failed, and the pool is
+# started again for the others, which were waiting for a worker.
+# Returns Summary.
+def run_batch(jobs, convert, journal, workers=1, initializer=None, initargs=(), largest_first=True, log=None):
+    jobs = list(jobs)
+    summary = Summary(len(jobs))
+    records = journal.read()
+    pending = [job for job in jobs if not is_completed(records.get(job.input), job)]
+    summary.skipped = len(jobs) - len(pending)
+    if largest_first:
+        pending.sort(key=lambda job: job.size, reverse=True)
+    pending.reverse()
+    workers = max(1, workers)
+    start = time.perf_counter()
+    # Futures can not tell books being converted from ones waiting in
+    # the queue of the pool, so workers report books they start
+    started_queue = multiprocessing.SimpleQueue()
+
+    def finish(record):
+        journal.append(record)
+        summary.add(record)
+        if log is not None:
+            log(record)
+
+    def drain(started):
+        while not started_queue.empty():
+            started.add(started_queue.get())
+
+    while pending:
+        in_flight = dict()
+        started = set()
+        executor = ProcessPoolExecutor(workers, initializer=init_batch_worker,
+            initargs=(started_queue, initializer, initargs))
+        try:
+            while pending or in_flight:
+                while pending and len(in_flight) < workers * JOBS_PER_WORKER:
+                    job = pending.pop()
+                    in_flight[executor.submit(run_job, convert, job)] = job
+                (finished, _) = wait(in_flight, return_when=FIRST_COMPLETED)
+                # Keeps the pipe from filling up
+                drain(started)
+                for future in finished:
+                    record = future.result()
+                    del in_flight[future]
+                    finish(record)
+        except BrokenProcessPool:
+            drain(started)
+            # Books finished before the pool broke are kept
+            broken = []
+            for future, job in in_flight.items():
+                try:
+                    finish(future.result())
+                except BrokenProcessPool as e:
+                    broken.append((job, e))
+            # If no book had started, the pool broke on its own (e.g. in
+            # initializer) and would break again, so all books fail
+            requeue = any(job.input in started for (job, _) in broken)
+            waiting = []
+            for (job, e) in broken:
+                if requeue and job.input not in started:
+                    waiting.append(job)
+                    continue
+                record = new_record(job, STATUS_FAILED)
+                record['error'] = '%s: %s' % (type(e).__name__, e)
+                finish(record)
+            # They go first in the next pool, in the same order
+            pending.extend(reversed(waiting))
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    started_queue.close()
+    summary.seconds = time.perf_counter() - start
+    return summary
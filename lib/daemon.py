@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+__doc__ = """
+Local transliteration server listening on Unix domain socket, and its client.
+
+Converters are created once in worker processes of the server and kept
+between requests, so a request costs only its own conversion, not the
+start of Python, loading of word lists and compiling of regexes.
+
+Every message is sent as a frame: 4-byte big-endian length followed by
+that many bytes. Request is two frames, JSON header and document:
+
+    {"kind" : "text"}     plain text
+    {"kind" : "xhtml"}    XHTML file
+    {"kind" : "ncx"}      table of contents (toc.ncx)
+    {"kind" : "opf"}      package document (content.opf)
+    {"kind" : "ping"}     empty document, checks that server is running
+
+Documents are encoded as UTF-8. Response is JSON header {"ok" : true}
+followed by converted document, or {"ok" : false, "error" : "..."}
+followed by empty frame. Any number of requests may be sent over one
+connection, each waiting for its response.
+"""
+
+from   concurrent.futures import ProcessPoolExecutor
+from   concurrent.futures.process import BrokenProcessPool
+import errno
+import getpass
+import json
+import os
+import signal
+import socket
+import socketserver
+import struct
+import tempfile
+import threading
+
+
+DEFAULT_SOCKET_PATH = os.path.join(tempfile.gettempdir(), 'lat2cyr-%s.sock' % (getpass.getuser()))
+FRAME_LENGTH = struct.Struct('>I')
+MAX_FRAME_SIZE = 256 * 1024 * 1024
+KINDS = ('text', 'xhtml', 'ncx', 'opf')
+PING = 'ping'
+# Converted by each worker when server starts
+WARMUP_TEXT = 'Dobar dan, добар дан'.encode('utf-8')
+
+
+class ProtocolError(Exception):
+    pass
+
+
+# Error reported by server for a request
+class ServerError(Exception):
+    pass
+
+
+# Returns size bytes, None if connection is closed before the first of them
+def recv_exactly(sock, size):
+    buf = bytearray(size)
+    view = memoryview(buf)
+    pos = 0
+    while pos < size:
+        n = sock.recv_into(view[pos:])
+        if n == 0:
+            if pos == 0:
+                return None
+            raise ProtocolError('connection closed in the middle of a frame')
+        pos += n
+    return buf
+
+
+def send_frame(sock, data):
+    sock.sendall(FRAME_LENGTH.pack(len(data)))
+    sock.sendall(data)
+
+
+# Returns frame data, None if connection is closed between frames
+def recv_frame(sock):
+    prefix = recv_exactly(sock, FRAME_LENGTH.size)
+    if prefix is None:
+        return None
+    (size,) = FRAME_LENGTH.unpack(prefix)
+    if size > MAX_FRAME_SIZE:
+        raise ProtocolError('frame of %d bytes is too large' % (size))
+    data = recv_exactly(sock, size)
+    if data is None:
+        raise ProtocolError('connection closed in the middle of a frame')
+    return data
+
+
+def send_message(sock, header, body=b''):
+    send_frame(sock, json.dumps(header).encode('utf-8'))
+    send_frame(sock, body)
+
+
+# Returns (header, body), None if connection is closed between messages
+def recv_message(sock):
+    header = recv_frame(sock)
+    if header is None:
+        return None
+    body = recv_frame(sock)
+    if body is None:
+        raise ProtocolError('connection closed before message body')
+    try:
+        header = json.loads(header.decode('utf-8'))
+    except ValueError as e:
+        raise ProtocolError('invalid message header: %s' % (e))
+    if not isinstance(header, dict):
+        raise ProtocolError('message header is not JSON object')
+    return (header, body)
+
+
+# Removes socket file left by server which is not running any more
+def remove_stale_socket(path):
+    if not os.path.exists(path):
+        return
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(path)
+    except (ConnectionRefusedError, FileNotFoundError):
+        os.remove(path)
+        return
+    finally:
+        probe.close()
+    raise OSError(errno.EADDRINUSE, "server is already listening on '%s'" % (path))
+
+
+# Worker processes leave Ctrl+C to the server, which shuts them down
+def init_pool_worker(initializer, initargs):
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if initializer is not None:
+        initializer(*initargs)
+
+
+# Runs in worker process. Exceptions (e.g. from lxml) may not be
+# picklable, so only their message is sent back to the server.
+def call_convert(convert, kind, data):
+    try:
+        return (True, convert(kind, data))
+    except Exception as e:
+        return (False, str(e) or e.__class__.__name__)
+
+
+# Serves requests of one connection until client closes it
+class RequestHandler(socketserver.BaseRequestHandler):
+
+    def handle(self):
+        while True:
+            try:
+                message = recv_message(self.request)
+            except (ProtocolError, OSError):
+                return
+            if message is None:
+                return
+            (header, body) = message
+            try:
+                result = self.server.convert(header.get('kind'), body)
+            except Exception as e:
+                send_message(self.request, {'ok' : False, 'error' : str(e) or e.__class__.__name__})
+            else:
+                send_message(self.request, {'ok' : True}, result)
+
+
+class TransliterationServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+
+    daemon_threads = True
+
+    # convert(kind, data) is called in one of worker processes, after
+    # initializer(*initargs) has prepared converters there; it takes
+    # and returns bytes and must be picklable (module-level function).
+    def __init__(self, path, convert, workers=1, initializer=None, initargs=()):
+        remove_stale_socket(path)
+        self._convert = convert
+        self._workers = max(1, workers)
+        self._initargs = (initializer, initargs)
+        self._executor_lock = threading.Lock()
+        self._executor = self._create_executor()
+        try:
+            # Start all workers now, so that the first requests do not wait for them
+            warmup = [self._executor.submit(call_convert, convert, 'text', WARMUP_TEXT) for _ in range(self._workers)]
+            for future in warmup:
+                future.result()
+            socketserver.UnixStreamServer.__init__(self, path, RequestHandler)
+        except:
+            self._executor.shutdown()
+            raise
+
+
+    def _create_executor(self):
+        return ProcessPoolExecutor(self._workers, initializer=init_pool_worker, initargs=self._initargs)
+
+
+    # Pool in which a worker process died can not be used any more; the
+    # first request which finds it broken replaces it
+    def _replace_broken_executor(self, executor):
+        with self._executor_lock:
+            if self._executor is executor:
+                self._executor = self._create_executor()
+        executor.shutdown(wait=False)
+
+
+    # Socket is created accessible to its owner only, so that documents
+    # of one user are not readable by others even for a moment
+    def server_bind(self):
+        mask = os.umask(0o177)
+        try:
+            socketserver.UnixStreamServer.server_bind(self)
+        finally:
+            os.umask(mask)
+
+
+    # Returns converted document
+    def convert(self, kind, data):
+        if kind == PING:
+            return b''
+        if kind not in KINDS:
+            raise ValueError("unknown kind of request '%s'" % (kind))
+        executor = self._executor
+        try:
+            (ok, result) = executor.submit(call_convert, self._convert, kind, bytes(data)).result()
+        except BrokenProcessPool:
+            # Any of the documents being converted may have killed the
+            # worker, so they fail and are not converted again
+            self._replace_broken_executor(executor)
+            raise ServerError('worker process died while converting the document')
+        if not ok:
+            raise ServerError(result)
+        return result
+
+
+    def server_close(self):
+        socketserver.UnixStreamServer.server_close(self)
+        self._executor.shutdown()
+        try:
+            os.remove(self.server_address)
+        except OSError:
+            pass
+
+
+class Client:
+
+    def __init__(self, path=DEFAULT_SOCKET_PATH, timeout=None):
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            self._sock.settimeout(timeout)
+            self._sock.connect(path)
+        except:
+            self._sock.close()
+            raise
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+    def close(self):
+        self._sock.close()
+
+
+    # Sends document (bytes or str) and returns converted document (bytes)
+    def request(self, kind, data=b''):
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        send_message(self._sock, {'kind' : kind}, data)
+        message = recv_message(self._sock)
+        if message is None:
+            raise ProtocolError('server closed connection')
+        (header, body) = message
+        if not header.get('ok'):
+            raise ServerError(header.get('error', ''))
+        return bytes(body)
+
+
+    def transliterate(self, text):
+        return self.request('text', text).decode('utf-8')
+
+
+    def ping(self):
+        self.request(PING)
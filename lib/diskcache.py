@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+__doc__ = """
+Persistent cache of transliterated words, shared by processes and runs.
+
+Words are kept in SQLite database together with fingerprint of word
+lists and tables they were transliterated with (SerbCyr.fingerprint()),
+and with names of counters of decisions made about them, so that words
+found in the cache are counted the same as transliterated ones.
+Words transliterated with other lists are never returned, and are
+deleted when the cache is opened, so changed lists invalidate it.
+
+When the number of words goes over the limit, the least recently used
+ones are evicted, down to EVICT_TO of the limit.
+"""
+
+from   contextlib import contextmanager
+import sqlite3
+import threading
+import time
+
+
+DEFAULT_MAX_ENTRIES = 1000000
+EVICT_TO = 0.9
+# Words per statement, below SQLite's limit of variables
+BATCH_SIZE = 500
+BUSY_TIMEOUT = 10.0
+# Cache written with other version of the schema is emptied when opened
+SCHEMA_VERSION = 2
+# Separates names of counters in column decisions
+DECISIONS_SEPARATOR = ' '
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS fingerprints (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    fingerprint TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS words (
+    lists INTEGER NOT NULL,
+    word TEXT NOT NULL,
+    cyrillic TEXT NOT NULL,
+    decisions TEXT NOT NULL,
+    used INTEGER NOT NULL,
+    PRIMARY KEY (lists, word)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS words_used ON words (used);
+"""
+
+
+class DiskCache:
+
+    def __init__(self, path, fingerprint, max_entries=DEFAULT_MAX_ENTRIES):
+        if max_entries <= 0:
+            raise ValueError("Cache size must be positive, got %r" % (max_entries,))
+        self.path = path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        # Words found since the last put_many(), their time of use is updated then
+        self._touched = set()
+        # Autocommit mode, transactions are started explicitly
+        self._db = sqlite3.connect(path, timeout=BUSY_TIMEOUT, isolation_level=None, check_same_thread=False)
+        try:
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._create_schema()
+            self.set_fingerprint(fingerprint)
+        except:
+            self._db.close()
+            raise
+
+
+    # Tables of older version are dropped; other processes opening the
+    # cache at the same time wait for the transaction
+    def _create_schema(self):
+        with self._transaction():
+            (version,) = self._db.execute('PRAGMA user_version').fetchone()
+            if version != SCHEMA_VERSION:
+                self._db.execute('DROP TABLE IF EXISTS words')
+                self._db.execute('DROP TABLE IF EXISTS fingerprints')
+            for statement in SCHEMA.split(';'):
+                if statement.strip():
+                    self._db.execute(statement)
+            self._db.execute('PRAGMA user_version = %d' % (SCHEMA_VERSION))
+
+
+    # Switches to words transliterated with given lists, deleting all others
+    def set_fingerprint(self, fingerprint):
+        with self._lock:
+            with self._transaction():
+                self._db.execute('INSERT OR IGNORE INTO fingerprints (fingerprint) VALUES (?)', (fingerprint,))
+                (self._lists,) = self._db.execute('SELECT id FROM fingerprints WHERE fingerprint = ?',
+                    (fingerprint,)).fetchone()
+                self._db.execute('DELETE FROM words WHERE lists != ?', (self._lists,))
+                self._db.execute('DELETE FROM fingerprints WHERE id != ?', (self._lists,))
+                (self._count,) = self._db.execute('SELECT count(*) FROM words').fetchone()
+            self.fingerprint = fingerprint
+            self._touched.clear()
+
+
+    # Returns {word: (transliterated word, tuple of names of counters)} for
+    # words found in the cache. Cache is only an optimization: if database
+    # can not be read, nothing is found.
+    def get_many(self, words):
+        found = dict()
+        words = list(words)
+        with self._lock:
+            try:
+                for start in range(0, len(words), BATCH_SIZE):
+                    batch = words[start:start + BATCH_SIZE]
+                    rows = self._db.execute('SELECT word, cyrillic, decisions FROM words WHERE lists = ? AND word IN (%s)'
+                        % (','.join('?' * len(batch))), [self._lists] + batch)
+                    for (word, cyrillic, decisions) in rows:
+                        found[word] = (cyrillic, tuple(decisions.split(DECISIONS_SEPARATOR)) if decisions else ())
+            except sqlite3.Error:
+                return dict()
+            self._touched.update(found)
+        return found
+
+
+    # Stores (word, (transliterated word, names of counters)) pairs in one
+    # transaction, together with time of use of words found since the last
+    # call. Pairs which can not be written (e.g. database is locked for too
+    # long) are dropped.
+    def put_many(self, items):
+        items = list(items)
+        with self._lock:
+            if not items and not self._touched:
+                return
+            used = time.time_ns()
+            try:
+                with self._transaction():
+                    self._db.executemany('INSERT OR REPLACE INTO words (lists, word, cyrillic, decisions, used) '
+                        'VALUES (?, ?, ?, ?, ?)', [(self._lists, word, cyrillic, DECISIONS_SEPARATOR.join(decisions), used)
+                        for (word, (cyrillic, decisions)) in items])
+                    self._db.executemany('UPDATE words SET used = ? WHERE lists = ? AND word = ?',
+                        [(used, self._lists, word) for word in self._touched])
+                    self._count += len(items)
+                    if self._count > self.max_entries:
+                        self._evict()
+            except sqlite3.Error:
+                pass
+            self._touched.clear()
+
+
+    # Deletes words satisfying predicate and takes new fingerprint for the
+    # remaining ones, which are still valid. Returns number of deleted words.
+    def discard_if(self, predicate, fingerprint):
+        with self._lock:
+            self._db.create_function('discarded', 1, lambda word: 1 if predicate(word) else 0)
+            with self._transaction():
+                deleted = self._db.execute('DELETE FROM words WHERE lists = ? AND discarded(word)',
+                    (self._lists,)).rowcount
+                row = self._db.execute('SELECT id FROM fingerprints WHERE fingerprint = ?', (fingerprint,)).fetchone()
+                if row is None:
+                    self._db.execute('UPDATE fingerprints SET fingerprint = ? WHERE id = ?', (fingerprint, self._lists))
+                else:
+                    # Another process has already switched to the same lists
+                    self._lists = row[0]
+            self.fingerprint = fingerprint
+            self._count -= deleted
+            self._touched.clear()
+        return deleted
+
+
+    # Count is exact after eviction, otherwise it may include words
+    # replaced or stored by other processes
+    def _evict(self):
+        (self._count,) = self._db.execute('SELECT count(*) FROM words').fetchone()
+        excess = self._count - int(self.max_entries * EVICT_TO)
+        if self._count > self.max_entries and excess > 0:
+            self._db.execute('DELETE FROM words WHERE (lists, word) IN '
+                '(SELECT lists, word FROM words ORDER BY used LIMIT ?)', (excess,))
+            self._count -= excess
+
+
+    # Immediate transaction takes write lock at start, so that it does not
+    # fail half way when another process writes at the same time
+    @contextmanager
+    def _transaction(self):
+        self._db.execute('BEGIN IMMEDIATE')
+        try:
+            yield
+        except:
+            self._db.execute('ROLLBACK')
+            raise
+        self._db.execute('COMMIT')
+
+
+    def __len__(self):
+        with self._lock:
+            (count,) = self._db.execute('SELECT count(*) FROM words WHERE lists = ?', (self._lists,)).fetchone()
+        return count
+
+
+    # Deletes all words
+    def clear(self):
+        with self._lock:
+            with self._transaction():
+                self._db.execute('DELETE FROM words')
+            self._count = 0
+            self._touched.clear()
+
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+__doc__ = """
+Conversion of EPUB files without unpacking them.
+
+Entries are read from the source archive one at a time. Table of contents,
+package document and XHTML files are passed to converter functions, all
+other entries (images, fonts, CSS...) are copied as raw compressed bytes.
+"""
+
+import copy
+import posixpath
+import struct
+import zipfile
+from   urllib.parse import unquote
+from   xml.etree import ElementTree
+
+
+MIMETYPE_PATH = 'mimetype'
+CONTAINER_PATH = 'META-INF/container.xml'
+NCX_MEDIA_TYPE = 'application/x-dtbncx+xml'
+XHTML_MEDIA_TYPE = 'application/xhtml+xml'
+CONTAINER_NS = '{urn:oasis:names:tc:opendocument:xmlns:container}'
+OPF_NS = '{http://www.idpf.org/2007/opf}'
+# Local file header: signature, versions, flags, method, time, date,
+# CRC, sizes and lengths of file name and extra field
+LOCAL_HEADER_SIZE = 30
+LOCAL_HEADER_SIGNATURE = b'PK\x03\x04'
+DATA_DESCRIPTOR_FLAG = 0x08
+ENCRYPTED_FLAG = 0x01
+
+
+# Finds package document (OPF) and sorts its manifest by media type.
+# Returns (opf_path, ncx_paths, xhtml_paths).
+def read_manifest(zin):
+    container = ElementTree.fromstring(zin.read(CONTAINER_PATH))
+    rootfile = container.find('.//%srootfile' % (CONTAINER_NS))
+    opf_path = rootfile.get('full-path')
+    opf_dir = posixpath.dirname(opf_path)
+    package = ElementTree.fromstring(zin.read(opf_path))
+    ncx_paths = set()
+    xhtml_paths = set()
+    for item in package.iter('%sitem' % (OPF_NS)):
+        path = posixpath.normpath(posixpath.join(opf_dir, unquote(item.get('href', ''))))
+        if item.get('media-type') == NCX_MEDIA_TYPE:
+            ncx_paths.add(path)
+        elif item.get('media-type') == XHTML_MEDIA_TYPE:
+            xhtml_paths.add(path)
+    return opf_path, ncx_paths, xhtml_paths
+
+
+# Converts EPUB file src_path into dst_path. Converter functions take
+# document text (str) and return converted document (bytes).
+def convert_epub(src_path, dst_path, convert_html, convert_ncx, convert_opf, log=None):
+    with zipfile.ZipFile(src_path, 'r') as zin, \
+            open(src_path, 'rb') as raw, \
+            zipfile.ZipFile(dst_path, 'w', zipfile.ZIP_DEFLATED) as zout:
+        opf_path, ncx_paths, xhtml_paths = read_manifest(zin)
+        # EPUB requires uncompressed mimetype as the first entry
+        if MIMETYPE_PATH in zin.NameToInfo:
+            mimetype = zin.read(MIMETYPE_PATH)
+        else:
+            mimetype = b'application/epub+zip'
+        zout.writestr(zipfile.ZipInfo(MIMETYPE_PATH), mimetype, compress_type=zipfile.ZIP_STORED)
+
+        for info in zin.infolist():
+            if info.filename == MIMETYPE_PATH:
+                continue
+            if info.filename == opf_path:
+                convert = convert_opf
+            elif info.filename in ncx_paths:
+                convert = convert_ncx
+            elif info.filename in xhtml_paths:
+                convert = convert_html
+            else:
+                copy_raw_entry(raw, zin, zout, info)
+                continue
+            source = zin.read(info).decode('utf-8-sig')
+            target = zipfile.ZipInfo(info.filename, date_time=info.date_time)
+            target.external_attr = info.external_attr
+            zout.writestr(target, convert(source), compress_type=zipfile.ZIP_DEFLATED)
+            if log is not None:
+                log(info.filename)
+
+
+# Yields (kind, path, text) of documents of EPUB file, in the order of
+# entries in the archive; kind is 'opf', 'ncx' or 'xhtml'
+def read_documents(src_path):
+    with zipfile.ZipFile(src_path, 'r') as zin:
+        opf_path, ncx_paths, xhtml_paths = read_manifest(zin)
+        for info in zin.infolist():
+            if info.filename == opf_path:
+                kind = 'opf'
+            elif info.filename in ncx_paths:
+                kind = 'ncx'
+            elif info.filename in xhtml_paths:
+                kind = 'xhtml'
+            else:
+                continue
+            yield (kind, info.filename, zin.read(info).decode('utf-8-sig'))
+
+
+# Copies entry without decompressing and compressing it again.
+# ZipFile has no public interface for this, so local header is written
+# and bookkeeping of the output archive is updated the way ZipFile.write does.
+def copy_raw_entry(raw, zin, zout, info):
+    if info.flag_bits & ENCRYPTED_FLAG or info.file_size >= zipfile.ZIP64_LIMIT \
+            or info.compress_size >= zipfile.ZIP64_LIMIT or not zout._seekable:
+        zout.writestr(copy.copy(info), zin.read(info))
+        return
+    raw.seek(info.header_offset)
+    header = raw.read(LOCAL_HEADER_SIZE)
+    if len(header) != LOCAL_HEADER_SIZE or header[:4] != LOCAL_HEADER_SIGNATURE:
+        raise zipfile.BadZipFile("Bad local header of entry '%s'" % (info.filename))
+    name_length, extra_length = struct.unpack('<HH', header[26:30])
+    raw.seek(info.header_offset + LOCAL_HEADER_SIZE + name_length + extra_length)
+
+    zinfo = copy.copy(info)
+    # Sizes and CRC are known, so they go into the local header
+    zinfo.flag_bits &= ~DATA_DESCRIPTOR_FLAG
+    zout.fp.seek(zout.start_dir)
+    zinfo.header_offset = zout.fp.tell()
+    zout.fp.write(zinfo.FileHeader(False))
+    remaining = info.compress_size
+    while remaining > 0:
+        chunk = raw.read(min(remaining, 1024 * 64))
+        if not chunk:
+            raise zipfile.BadZipFile("Truncated entry '%s'" % (info.filename))
+        zout.fp.write(chunk)
+        remaining -= len(chunk)
+    zout.start_dir = zout.fp.tell()
+    zout.filelist.append(zinfo)
+    zout.NameToInfo[zinfo.filename] = zinfo
+    zout._didModify = True
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+__doc__ = """
+Timers and counters collected while a book is transliterated.
+"""
+
+from   collections import Counter, OrderedDict
+from   contextlib  import contextmanager
+import json
+import threading
+import time
+
+
+# Can be updated from several threads at once
+class Stats:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # Phase name -> [total seconds, number of calls]
+        self.timers = OrderedDict()
+        self.counters = Counter()
+        # Per-file dictionaries with 'file', 'bytes_in', 'bytes_out' and 'words'
+        self.files = []
+
+
+    @contextmanager
+    def timer(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+
+    def add_time(self, name, seconds, calls=1):
+        with self._lock:
+            timer = self.timers.setdefault(name, [0.0, 0])
+            timer[0] += seconds
+            timer[1] += calls
+
+
+    def count(self, name, n=1):
+        with self._lock:
+            self.counters[name] += n
+
+
+    def add_file(self, name, bytes_in, bytes_out, words):
+        with self._lock:
+            self.files.append({'file' : name, 'bytes_in' : bytes_in, 'bytes_out' : bytes_out, 'words' : words})
+
+
+    # Adds statistics collected elsewhere, e.g. in worker process
+    def merge(self, data):
+        for name, (seconds, calls) in data['timers'].items():
+            self.add_time(name, seconds, calls)
+        with self._lock:
+            self.counters.update(data['counters'])
+            self.files.extend(data['files'])
+
+
+    def as_dict(self):
+        return {
+            'timers' : OrderedDict((name, list(timer)) for name, timer in self.timers.items()),
+            'counters' : dict(self.counters),
+            'files' : list(self.files),
+        }
+
+
+    def save_json(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.as_dict(), f, ensure_ascii=False, indent=2)
+
+
+    # Returns lines of table with phases, counters and file totals
+    def summary(self):
+        lines = ['%-28s %10s %8s' % ('', 's', 'n')]
+        for name, (seconds, calls) in self.timers.items():
+            lines.append('%-28s %10.3f %8d' % (name, seconds, calls))
+        for name in sorted(self.counters):
+            lines.append('%-28s %10s %8d' % (name, '', self.counters[name]))
+        if self.files:
+            lines.append('%-28s %10s %8d' % ('files', '', len(self.files)))
+            for key in ('bytes_in', 'bytes_out', 'words'):
+                lines.append('%-28s %10s %8d' % ('files.' + key, '', sum(f[key] for f in self.files)))
+        return lines
@@ -0,0 +1,38 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+__doc__ = """
+Content hashes of files from the previous transliteration of a book.
+
+A file whose content equals the output written last time has already
+been transliterated and does not need to be parsed again.
+"""
+
+import hashlib
+
+
+def digest(data):
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    return hashlib.sha256(data).hexdigest()
+
+
+class HashManifest:
+
+    def __init__(self, entries=None):
+        # Manifest id -> {'source': digest, 'output': digest}
+        self.entries = dict(entries or {})
+
+
+    # True if data is exactly what was written for the file last time
+    def is_transliterated(self, id, data):
+        entry = self.entries.get(id)
+        return entry is not None and entry['output'] == digest(data)
+
+
+    def record(self, id, source, output):
+        self.entries[id] = {'source' : digest(source), 'output' : digest(output)}
+
+
+    def as_dict(self):
+        return dict(self.entries)
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+__doc__ = """
+User's word lists, layered on top of the lists shipped in lib/.
+
+One overlay file can add words to any of the lists. Words follow a line
+with the name of the list (name of its .txt file without extension):
+
+    # House exceptions
+    [whole_foreign_words]
+    facebook
+    [nj_digraph_exceptions]
+    konjugacij
+
+Lines starting with '#' and blank lines are skipped. Words from several
+files are merged in the order the files are given. Files are checked
+for changes at most every reload_interval seconds, so a running program
+picks up edited files without restarting.
+"""
+
+import os
+import re
+import time
+
+
+DEFAULT_RELOAD_INTERVAL = 2.0
+SECTION_REGEX = re.compile(r'^\[\s*([\w.-]+)\s*\]$')
+
+
+# Returns {list name: [words]} read from overlay file
+def read_overlay(path, list_names):
+    lists = dict()
+    words = None
+    with open(path, 'r', encoding='utf-8') as f:
+        for number, line in enumerate(f.read().splitlines(), 1):
+            line = line.strip()
+            if line.startswith('#') or line == '':
+                continue
+            match = SECTION_REGEX.match(line)
+            if match is not None:
+                if match.group(1) not in list_names:
+                    raise ValueError("'%s', line %d: unknown list '%s'" % (path, number, match.group(1)))
+                words = lists.setdefault(match.group(1), [])
+            elif words is None:
+                raise ValueError("'%s', line %d: word before name of the list" % (path, number))
+            else:
+                # Words are compared with lowercase words
+                words.append(line.replace(' ', '').lower())
+    return lists
+
+
+class OverlayFiles:
+
+    def __init__(self, paths, list_names, reload_interval=DEFAULT_RELOAD_INTERVAL):
+        self.paths = list(paths)
+        self.list_names = list(list_names)
+        self.reload_interval = reload_interval
+        self._stamps = None
+        self._next_check = 0.0
+
+
+    # Size and time of modification of each file, None for missing file
+    def _read_stamps(self):
+        stamps = []
+        for path in self.paths:
+            try:
+                st = os.stat(path)
+                stamps.append((st.st_size, st.st_mtime_ns))
+            except OSError:
+                stamps.append(None)
+        return stamps
+
+
+    # True if files have changed since they were loaded. Files are looked
+    # at only when reload_interval has passed since the last check.
+    def changed(self):
+        now = time.monotonic()
+        if now < self._next_check:
+            return False
+        self._next_check = now + self.reload_interval
+        return self._read_stamps() != self._stamps
+
+
+    # Returns {list name: [words]} merged from all files. Missing file adds
+    # no words; invalid file raises ValueError or OSError, and is not read
+    # again until it changes.
+    def load(self):
+        stamps = self._read_stamps()
+        self._stamps = stamps
+        self._next_check = time.monotonic() + self.reload_interval
+        lists = dict((name, []) for name in self.list_names)
+        for path, stamp in zip(self.paths, stamps):
+            if stamp is None:
+                continue
+            for name, words in read_overlay(path, self.list_names).items():
+                lists[name].extend(words)
+        return lists
@@ -7,8 +7,28 @@ Program for transliteration of texts written in Latin alphabet into Serbian Cyri
 Python implementation of great Javascript program: https://github.com/turanjanin/cirilizator .
 """
 
+from   collections import Counter
+import hashlib
 import re
 import os
+import sqlite3
+
+from .ahocorasick import AhoCorasick
+from .cache import LRUCache
+from .diskcache import DiskCache, DEFAULT_MAX_ENTRIES
+from .overlay import OverlayFiles, DEFAULT_RELOAD_INTERVAL
+from .wordindex import LayeredIndex, WordIndex
+
+
+# Directory with word lists (SerbCyr.C_WORD_LISTS)
+WORD_LISTS_DIR = os.path.abspath(os.path.dirname(__file__))
+# Characters read at once by transliterate_stream
+DEFAULT_CHUNK_SIZE = 1 << 20
+# Everything up to and including the last whitespace character
+LAST_SPACE_REGEX = re.compile(r'.*\s', re.S)
+# Separates letters of Latin digraph exceptions (e.g. 'nadživeti'); it is
+# only needed while converting and must not reach plain text output
+ZERO_WIDTH_NON_JOINER = '\u200C'
 
 
 class SerbCyr:
@@ -121,21 +141,6 @@ class SerbCyr:
     }
 
     _cyrillic_to_latin = {
-        'Ња' : 'Nja',
-        'Ње' : 'Nje',
-        'Њи' : 'Nji',
-        'Њо' : 'Njo',
-        'Њу' : 'Nju',
-        'Ља' : 'Lja',
-        'Ље' : 'Lje',
-        'Љи' : 'Lji',
-        'Љо' : 'Ljo',
-        'Љу' : 'Lju',
-        'Џа' : 'Dža',
-        'Џе' : 'Dže',
-        'Џи' : 'Dži',
-        'Џо' : 'Džo',
-        'Џу' : 'Džu',
         'А'  : 'A',
         'Б'  : 'B',
         'В'  : 'V',
@@ -299,143 +304,490 @@ class SerbCyr:
         }
     }
 
-    C_LINE_ENDINGS = ('\r\n', '\n',)
-
-
-    def __init__(self):
-        self.lat_regex = re.compile('|'.join(map(re.escape, self._cyrillic_to_latin)))
-        abspath = os.path.abspath(os.path.dirname(__file__))
-        self._serbian_words_with_foreign_character_combinations = \
-            self._read_list_from_file(os.path.join(abspath,
-            'serb_words_with_foreign_combs.txt'))
-        self._common_foreign_words = self._read_list_from_file(os.path.join(abspath,
-            'serb_common_foreign_words.txt'))
-        self._whole_foreign_words = self._read_list_from_file(os.path.join(abspath,
-            'whole_foreign_words.txt'))
+    # Uppercase Cyrillic letters (Ѐ-Џ and А-Я)
+    C_CYRILLIC_UPPERCASE = '[\u0400-\u042f]'
+    # Language of converted documents
+    LANG = 'sr'
+
+    # Splitting by it keeps whitespace at odd positions, words at even ones
+    C_SPACES_REGEX = re.compile('(\\s+)')
+
+    # Labels reported by the pattern matcher; digraphs are reported by themselves
+    C_FOREIGN_COMBINATION = 'foreign'
+    C_TRIPLE_COMBINATION = 'triple'
+
+    # Names of counters of classification decisions
+    C_COUNT_WORDS = 'words'
+    C_COUNT_FOREIGN = 'foreign_words'
+    C_COUNT_WHOLE_FOREIGN_PREFIX = 'whole_foreign_prefixes'
+    C_COUNT_MEASUREMENT_UNIT = 'measurement_units'
+    C_COUNT_DIGRAPH_SPLIT = 'digraph_splits'
+    C_COUNT_FAST_PATH = 'fast_path_nodes'
+    C_COUNT_DISK_CACHE_HITS = 'disk_cache_hits'
+    C_COUNT_DISK_CACHE_ERRORS = 'disk_cache_errors'
+    C_COUNT_OVERLAY_RELOADS = 'overlay_reloads'
+    C_COUNT_OVERLAY_ERRORS = 'overlay_errors'
+    C_COUNT_CACHE_INVALIDATED = 'cache_invalidated_words'
+    C_COUNT_LATIN_WORDS = 'latin_words'
+    # Counters reported by analyze_many, in the order they are shown
+    C_ANALYSIS_COUNTERS = (C_COUNT_WORDS, C_COUNT_LATIN_WORDS, C_COUNT_FOREIGN, C_COUNT_WHOLE_FOREIGN_PREFIX,
+        C_COUNT_MEASUREMENT_UNIT, C_COUNT_DIGRAPH_SPLIT)
+
+    # Word lists in lib/, as names of their .txt files
+    C_WORD_LISTS = ('serb_words_with_foreign_combs', 'serb_common_foreign_words', 'whole_foreign_words',
+        'nj_digraph_exceptions', 'dj_digraph_exceptions', 'dzh_digraph_exceptions')
+
+
+    # cache_size > 0 enables memoization of transliterated words, disk_cache
+    # is path of SQLite file keeping them between runs (lib/diskcache.py),
+    # overlays are user's files adding words to the lists (lib/overlay.py)
+    def __init__(self, cache_size=0, disk_cache=None, disk_cache_size=DEFAULT_MAX_ENTRIES,
+            overlays=(), reload_interval=DEFAULT_RELOAD_INTERVAL):
+        self._compile_cyrillic_engine()
+        self._compile_latin_engine()
+        # Word lists are compiled into indexes, loaded on first use
+        self._word_lists = dict()
+        for name in self.C_WORD_LISTS:
+            self._word_lists[name] = WordIndex(os.path.join(WORD_LISTS_DIR, name + '.txt'))
+        self._overlays = None
+        if overlays:
+            self._overlays = OverlayFiles(overlays, self.C_WORD_LISTS, reload_interval)
+            for name in self.C_WORD_LISTS:
+                self._word_lists[name] = LayeredIndex(self._word_lists[name])
+            for name, words in self._overlays.load().items():
+                self._word_lists[name].set_words(words)
+        self._serbian_words_with_foreign_character_combinations = self._word_lists['serb_words_with_foreign_combs']
+        self._common_foreign_words = self._word_lists['serb_common_foreign_words']
+        self._whole_foreign_words = self._word_lists['whole_foreign_words']
         self._digraph_exceptions = dict()
-        self._digraph_exceptions['nj'] = self._read_list_from_file(os.path.join(abspath,
-            'nj_digraph_exceptions.txt'))
-        self._digraph_exceptions['dj'] = self._read_list_from_file(os.path.join(abspath,
-            'dj_digraph_exceptions.txt'))
-        self._digraph_exceptions['dž'] = self._read_list_from_file(os.path.join(abspath,
-            'dzh_digraph_exceptions.txt'))
-
-
-    # Read files with word lists
-    def _read_list_from_file(self, filepath):
-        with open(filepath, 'r') as f:
-            tmplist = f.read().splitlines()
-            for elem in tmplist:
-                if elem.startswith('#') or elem.strip() == '':
-                    tmplist.remove(elem)
-            return [line.replace(' ', '') for line in tmplist]
-
-
-    def _join(self, stri):
-        s = ''
-        for word in stri:
-            if word not in self.C_LINE_ENDINGS:
-                s = s + word + " "
+        self._digraph_exceptions['nj'] = self._word_lists['nj_digraph_exceptions']
+        self._digraph_exceptions['dj'] = self._word_lists['dj_digraph_exceptions']
+        self._digraph_exceptions['dž'] = self._word_lists['dzh_digraph_exceptions']
+        self._compile_pattern_matcher()
+        self._cache = LRUCache(cache_size) if cache_size > 0 else None
+        self._disk_cache = DiskCache(disk_cache, self.fingerprint(), disk_cache_size) if disk_cache else None
+        # Words are counted as they are tokenized. Decisions are cached
+        # together with converted words and counted for every occurrence,
+        # so counters do not depend on size of the cache.
+        self.counters = Counter()
+
+
+    # Compiles _initial_map into a translate table for single characters and
+    # a longest-first alternation for digraphs, ligatures and decomposed forms,
+    # so that every word is transliterated in a single pass
+    def _compile_cyrillic_engine(self):
+        self._cyr_table = dict()
+        self._cyr_sequences = dict()
+        for key, value in self._initial_map.items():
+            if len(key) == 1:
+                self._cyr_table[ord(key)] = value
             else:
-                s = s.strip(' ')
-                s = s + word
-        return s.strip(' ')
-
-
-    # Main method that converts Latin text to Cyrillic
+                self._cyr_sequences[key] = value
+        sequences = sorted(self._cyr_sequences, key=len, reverse=True)
+        self._cyr_sequences_regex = re.compile('(' + '|'.join(map(re.escape, sequences)) + ')')
+        self.letters_class = letters_class(self._initial_map)
+        self._letters_regex = re.compile(self.letters_class)
+
+
+    # Cyrillic letters are converted by a translate table. Letters that become
+    # two Latin letters (Љ, Њ, Џ) are uppercase in it ('LJ'), which is right
+    # next to another uppercase letter; elsewhere they are written in title
+    # case ('Lj') by substitutions with constant replacement.
+    def _compile_latin_engine(self):
+        self._lat_table = dict()
+        self._lat_title_case = []
+        for key, value in self._cyrillic_to_latin.items():
+            self._lat_table[ord(key)] = value
+            if len(value) > 1 and value.isupper():
+                regex = re.compile('(?<!%s)%s(?!%s)' % (self.C_CYRILLIC_UPPERCASE, re.escape(key), self.C_CYRILLIC_UPPERCASE))
+                self._lat_title_case.append((key, regex, value[0] + value[1:].lower()))
+
+
+    # Builds single automaton answering all substring checks made per word
+    def _compile_pattern_matcher(self):
+        patterns = [(comb, self.C_FOREIGN_COMBINATION) for comb in self._foreign_character_combinations]
+        patterns += [(comb, self.C_TRIPLE_COMBINATION) for comb in self._triple_character_combinations]
+        patterns += [(digraph, digraph) for digraph in self._digraph_exceptions]
+        self._pattern_matcher = AhoCorasick(patterns)
+
+
+    # True if text contains any letter that would be converted. Text without
+    # one (Cyrillic, digits, punctuation, whitespace) is returned untouched.
+    def needs_transliteration(self, text):
+        return self._letters_regex.search(text) is not None
+
+
+    # Main method that converts Latin text to Cyrillic.
+    # Whitespace between words is kept exactly as it is.
     def text_to_cyrillic(self, text):
-        if len(text.strip()) == 0:
+        if self._overlays is not None and self._overlays.changed():
+            self.reload_overlays()
+        if self._disk_cache is not None:
+            # Words of the text are looked up on disk at once
+            return self.transliterate_many([text])[0]
+        if not self.needs_transliteration(text):
+            self.counters[self.C_COUNT_FAST_PATH] += 1
             return text
-        words = re.findall('\S+|\r\n|\n', text)
-
-        for i in range(len(words)):
-            if words[i] in self.C_LINE_ENDINGS:
+        pieces = self.C_SPACES_REGEX.split(text)
+        words = 0
+        for i in range(0, len(pieces), 2):
+            if pieces[i]:
+                (pieces[i], decisions) = self._cached_token_to_cyrillic(pieces[i])
+                for decision in decisions:
+                    self.counters[decision] += 1
+                words += 1
+        self.counters[self.C_COUNT_WORDS] += words
+        return ''.join(pieces)
+
+
+    # Converts sequence of texts, giving the same results as calling
+    # text_to_cyrillic on each of them. Texts are tokenized first, so that
+    # every distinct word is transliterated only once for the whole batch.
+    def transliterate_many(self, texts):
+        if self._overlays is not None and self._overlays.changed():
+            self.reload_overlays()
+        texts = list(texts)
+        tokenized = []
+        vocabulary = dict()
+        for text in texts:
+            if not self.needs_transliteration(text):
+                self.counters[self.C_COUNT_FAST_PATH] += 1
+                tokenized.append(None)
+                continue
+            pieces = self.C_SPACES_REGEX.split(text)
+            words = 0
+            for i in range(0, len(pieces), 2):
+                if pieces[i]:
+                    vocabulary[pieces[i]] = pieces[i]
+                    words += 1
+            self.counters[self.C_COUNT_WORDS] += words
+            tokenized.append(pieces)
+
+        self._transliterate_vocabulary(vocabulary)
+
+        results = []
+        for text, pieces in zip(texts, tokenized):
+            if pieces is None:
+                results.append(text)
                 continue
-            index = self._transliteration_index_of_word_starts_with(words[i], self._whole_foreign_words, "-")
-            if index >= 0:
-                words[i] = words[i][:index] + self._word_to_cyrillic(words[i][index:])
+            for i in range(0, len(pieces), 2):
+                if pieces[i]:
+                    (pieces[i], decisions) = vocabulary[pieces[i]]
+                    for decision in decisions:
+                        self.counters[decision] += 1
+            results.append(''.join(pieces))
+        return results
+
+
+    # Replaces every word in dictionary {word: word} by the result of
+    # _token_to_cyrillic, (transliteration, decisions).
+    # Words missing from memory cache are looked up in disk cache in one
+    # batch, and words missing from both are stored there in one batch.
+    def _transliterate_vocabulary(self, vocabulary):
+        if self._disk_cache is None:
+            for word in vocabulary:
+                vocabulary[word] = self._cached_token_to_cyrillic(word)
+            return
+        missing = []
+        for word in vocabulary:
+            converted = self._cache.get(word) if self._cache is not None else None
+            if converted is None:
+                missing.append(word)
             else:
-                if not self._looks_like_foreign_word(words[i]):
-                    words[i] = self._word_to_cyrillic(words[i])
-        
-        return self._join(words)
+                vocabulary[word] = converted
+        found = self._disk_cache.get_many(missing)
+        self.counters[self.C_COUNT_DISK_CACHE_HITS] += len(found)
+        new = []
+        for word in missing:
+            converted = found.get(word)
+            if converted is None:
+                converted = self._token_to_cyrillic(word)
+                new.append((word, converted))
+            vocabulary[word] = converted
+            if self._cache is not None:
+                self._cache.put(word, converted)
+        self._disk_cache.put_many(new)
+
+
+    def _cached_token_to_cyrillic(self, word):
+        if self._cache is None:
+            return self._token_to_cyrillic(word)
+        converted = self._cache.get(word)
+        if converted is None:
+            converted = self._token_to_cyrillic(word)
+            self._cache.put(word, converted)
+        return converted
+
+
+    # Converts single whitespace-free token. Returns (converted token,
+    # tuple of names of counters of decisions made about it); caller
+    # counts the decisions for every occurrence of the token.
+    def _token_to_cyrillic(self, word):
+        index = self._transliteration_index_of_word_starts_with(word, self._whole_foreign_words, "-")
+        if index >= 0:
+            (cyrillic, decisions) = self._word_to_cyrillic(word[index:])
+            return (word[:index] + cyrillic, (self.C_COUNT_WHOLE_FOREIGN_PREFIX,) + decisions)
+        reason = self._foreign_word_reason(word)
+        if reason is None:
+            return self._word_to_cyrillic(word)
+        if reason == self.C_COUNT_MEASUREMENT_UNIT:
+            return (word, (self.C_COUNT_FOREIGN, self.C_COUNT_MEASUREMENT_UNIT))
+        return (word, (self.C_COUNT_FOREIGN,))
+
+
+    # Classifies words of texts the way transliterate_many would convert
+    # them, without converting anything and without changing counters
+    # of transliteration or caches. Returns (Counter of C_ANALYSIS_COUNTERS, Counter of hits by
+    # (counter, word or list entry which made the decision)). memo is
+    # dictionary kept by caller between calls for texts of one analysis,
+    # so that each word is classified only once.
+    def analyze_many(self, texts, memo=None):
+        if memo is None:
+            memo = dict()
+        if self._overlays is not None and self._overlays.changed():
+            self.reload_overlays()
+            memo.clear()
+        # Decisions about tokens and, by word lists, about trimmed lowercase words
+        tokens = memo.setdefault('tokens', dict())
+        listed = memo.setdefault('listed', dict())
+        decisions = Counter()
+        hits = Counter()
+        vocabulary = Counter()
+        # As in transliterate_many, words of texts taking the fast path are not
+        # counted, and all tokens of other texts are, with or without Latin letters
+        for text in texts:
+            if self.needs_transliteration(text):
+                vocabulary.update(piece for piece in self.C_SPACES_REGEX.split(text)[0::2] if piece)
+        for word, n in vocabulary.items():
+            token_decisions = tokens.get(word)
+            if token_decisions is None:
+                token_decisions = self._token_decisions(word, listed)
+                tokens[word] = token_decisions
+            decisions[self.C_COUNT_WORDS] += n
+            if self.needs_transliteration(word):
+                decisions[self.C_COUNT_LATIN_WORDS] += n
+            for decision, entry in token_decisions:
+                decisions[decision] += n
+                hits[(decision, entry)] += n
+        return (decisions, hits)
+
+
+    # Returns [(counter, word or list entry)] for decisions which
+    # _token_to_cyrillic makes about the token. Word lists are consulted
+    # once per trimmed lowercase word, shared by its forms with different
+    # case and punctuation; only checks depending on them are made per token.
+    def _token_decisions(self, word, listed):
+        trimmed_word = self._trim_excessive_characters(word)
+        lowercase = trimmed_word.lower()
+        (foreign_word, reason) = listed.get(lowercase) or self._listed_decisions(lowercase, listed)
+        if foreign_word is not None:
+            return [(self.C_COUNT_WHOLE_FOREIGN_PREFIX, foreign_word)] + \
+                self._digraph_split_entries(word[len(foreign_word) + 1:])
+        if reason is None and self._word_contains_measurement_unit(trimmed_word):
+            return [(self.C_COUNT_FOREIGN, lowercase), (self.C_COUNT_MEASUREMENT_UNIT, trimmed_word)]
+        if reason:
+            return [(self.C_COUNT_FOREIGN, lowercase)]
+        return self._digraph_split_entries(word)
+
+
+    # Stores (whole foreign word the word starts with, _listed_word_reason)
+    # for trimmed lowercase word into listed and returns it
+    def _listed_decisions(self, lowercase, listed):
+        foreign_word = self._whole_foreign_words.first_prefix_of(lowercase, "-") if lowercase else None
+        decisions = (foreign_word, None if foreign_word is not None else self._listed_word_reason(lowercase))
+        listed[lowercase] = decisions
+        return decisions
+
+
+    # Returns [(C_COUNT_DIGRAPH_SPLIT, exception)] for digraphs which
+    # _split_latin_digraphs splits in the word
+    def _digraph_split_entries(self, word):
+        lowercase = word.strip().lower()
+        matches = self._pattern_matcher.scan(lowercase)
+        entries = []
+        for digraph in self._digraph_exceptions:
+            if digraph in matches:
+                exception = self._digraph_exceptions[digraph].first_prefix_of(lowercase)
+                if exception is not None:
+                    entries.append((self.C_COUNT_DIGRAPH_SPLIT, exception))
+        return entries
+
+
+    # Statistics of word cache, None when caching is disabled
+    def cache_info(self):
+        if self._cache is None:
+            return None
+        return self._cache.info()
+
+
+    # Must be called after word lists are changed
+    def cache_clear(self):
+        if self._cache is not None:
+            self._cache.clear()
+        if self._disk_cache is not None:
+            try:
+                self._disk_cache.set_fingerprint(self.fingerprint())
+            except sqlite3.Error:
+                self._disable_disk_cache()
+
+
+    # Disk cache which could not drop words of old lists (e.g. database is
+    # locked for too long) could return wrong words, so it is not used any more
+    def _disable_disk_cache(self):
+        self.counters[self.C_COUNT_DISK_CACHE_ERRORS] += 1
+        try:
+            self._disk_cache.close()
+        except sqlite3.Error:
+            pass
+        self._disk_cache = None
+
+
+    # Merges words of changed overlay files into the lists. Only cached
+    # words containing an added or removed word are dropped, since lists
+    # are only compared with (parts of) lowercase words. If a file can not
+    # be read, words loaded before are kept. Returns set of changed words.
+    def reload_overlays(self):
+        if self._overlays is None:
+            return set()
+        try:
+            lists = self._overlays.load()
+        except (OSError, ValueError):
+            self.counters[self.C_COUNT_OVERLAY_ERRORS] += 1
+            return set()
+        changed = set()
+        for name, words in lists.items():
+            changed |= self._word_lists[name].set_words(words)
+        self.counters[self.C_COUNT_OVERLAY_RELOADS] += 1
+        if changed:
+            regex = re.compile('|'.join(map(re.escape, sorted(changed))))
+            affected = lambda word: regex.search(word.lower()) is not None
+            if self._cache is not None:
+                self.counters[self.C_COUNT_CACHE_INVALIDATED] += self._cache.discard_if(affected)
+            if self._disk_cache is not None:
+                try:
+                    self.counters[self.C_COUNT_CACHE_INVALIDATED] += self._disk_cache.discard_if(affected, self.fingerprint())
+                except sqlite3.Error:
+                    self._disable_disk_cache()
+        return changed
+
+
+    def _word_indexes(self):
+        return [self._word_lists[name] for name in self.C_WORD_LISTS]
+
+
+    # Identifies everything that decides how a word is transliterated:
+    # this module, tables of the class, contents of word lists and words
+    # of overlay files
+    def fingerprint(self):
+        digest = hashlib.sha256()
+        with open(__file__, 'rb') as f:
+            digest.update(f.read())
+        for table in (self._initial_map, self._foreign_character_combinations,
+                self._triple_character_combinations, self._digraph_replacements):
+            digest.update(repr(table).encode('utf-8'))
+        for index in self._word_indexes():
+            with open(index.source_path, 'rb') as f:
+                digest.update(hashlib.sha256(f.read()).digest())
+            if self._overlays is not None:
+                digest.update('\n'.join(index.overlay_words()).encode('utf-8') + b'\0')
+        return digest.hexdigest()
+
+
+    # Transliterates text file of any size, reading and writing it in chunks
+    def transliterate_stream(self, infile, outfile, chunk_size=DEFAULT_CHUNK_SIZE):
+        convert_stream(self.text_to_plain_cyrillic, infile, outfile, chunk_size)
+
+
+    # Like text_to_cyrillic, without zero width non-joiners
+    def text_to_plain_cyrillic(self, text):
+        return self.text_to_cyrillic(text).replace(ZERO_WIDTH_NON_JOINER, '')
 
 
     def text_to_latin(self, text):
-        return self.lat_regex.sub(lambda match: self._cyrillic_to_latin[match.group(0)], text)
+        for (letter, regex, title_case) in self._lat_title_case:
+            if letter in text:
+                text = regex.sub(title_case, text)
+        return text.translate(self._lat_table)
 
 
-    def _looks_like_foreign_word(self, word):
+    # Returns counter of the reason why word stays in Latin script
+    # (C_COUNT_FOREIGN or C_COUNT_MEASUREMENT_UNIT), None if it is converted
+    def _foreign_word_reason(self, word):
         trimmed_word = self._trim_excessive_characters(word)
-        word = trimmed_word.lower()
+        listed = self._listed_word_reason(trimmed_word.lower())
+        if listed is not None:
+            return listed or None
+
+        if self._word_contains_measurement_unit(trimmed_word):
+            return self.C_COUNT_MEASUREMENT_UNIT
+
+        return None
 
+
+    # Decision which word lists and letter combinations make about trimmed
+    # lowercase word: C_COUNT_FOREIGN, '' for Serbian word, None if undecided
+    def _listed_word_reason(self, word):
         if word == "":
-            return False
+            return ''
 
         if self._word_starts_with(word, self._serbian_words_with_foreign_character_combinations):
-            return False
+            return ''
+
+        matches = self._pattern_matcher.scan(word)
 
-        if self._word_contains_string(word, self._triple_character_combinations):
-            return False
+        if self.C_TRIPLE_COMBINATION in matches:
+            return ''
 
-        if self._word_contains_string(word, self._foreign_character_combinations):
-            return True
+        if self.C_FOREIGN_COMBINATION in matches:
+            return self.C_COUNT_FOREIGN
 
         if self._word_starts_with(word, self._common_foreign_words):
-            return True
+            return self.C_COUNT_FOREIGN
 
         if self._word_is_equal_to(word, self._whole_foreign_words):
-            return True
+            return self.C_COUNT_FOREIGN
 
-        if self._word_contains_measurement_unit(trimmed_word):
-            return True
-
-        return False
+        return None
 
 
+    # Returns (transliterated word, decisions) like _token_to_cyrillic
     def _word_to_cyrillic(self, word):
-        word = self._split_latin_digraphs(word)
-        for key, value in self._initial_map.items():
-            word = word.replace(key, value)
-        return word
+        (word, decisions) = self._split_latin_digraphs(word)
+        # Split keeps matched sequences at odd positions
+        parts = self._cyr_sequences_regex.split(word)
+        if len(parts) == 1:
+            return (word.translate(self._cyr_table), decisions)
+        for i in range(len(parts)):
+            if i % 2:
+                parts[i] = self._cyr_sequences[parts[i]]
+            else:
+                parts[i] = parts[i].translate(self._cyr_table)
+        return (''.join(parts), decisions)
 
 
+    # Returns (word with split digraphs, C_COUNT_DIGRAPH_SPLIT for each split digraph)
     def _split_latin_digraphs(self, str1):
         lowercaseStr = str1.strip().lower()
+        matches = self._pattern_matcher.scan(lowercaseStr)
+        decisions = ()
 
         for digraph in self._digraph_exceptions:
-            if not digraph in lowercaseStr:
+            if not digraph in matches:
                 continue
 
-            for word in self._digraph_exceptions[digraph]:
-                if not lowercaseStr.startswith(word):
-                    continue
-
+            if self._digraph_exceptions[digraph].has_prefix_of(lowercaseStr):
                 # Split all possible occurrences, regardless of case
                 for key in self._digraph_replacements[digraph]:
                     str1 = str1.replace(key, self._digraph_replacements[digraph][key])
-
-                break
-        return str1
+                decisions += (self.C_COUNT_DIGRAPH_SPLIT,)
+        return (str1, decisions)
 
 
-    def _word_contains_string(self, word, array):
-        for array_word in array:
-            if array_word in word:
-                return True
-        return False
+    def _word_is_equal_to(self, word, index):
+        return word in index
 
-    def _word_is_equal_to(self, word, array):
-        for array_word in array:
-            if word == array_word:
-                return True
-        return False
-
-    def _word_starts_with(self, word, array):
-        for array_word in array:
-            if word.startswith(array_word):
-                return True
-        return False
+    def _word_starts_with(self, word, index):
+        return index.has_prefix_of(word)
 
     def _word_contains_measurement_unit(self, word):
         unit_adjacent_to_sth = "([zafpnμmcdhKMGTPEY]?([BVWJFSHCΩATNhlmg]|m[²³]?|s[²]?|cd|Pa|Wb|Hz))"
@@ -456,18 +808,16 @@ class SerbCyr:
     some separator character and remainder of the word which is in Serbian.
     Example: dj-evi should be transliterated as dj-еви so the function retrieves 3.
     """
-    def _transliteration_index_of_word_starts_with(self, word, array, char_separator):
+    def _transliteration_index_of_word_starts_with(self, word, index, char_separator):
         word = self._trim_excessive_characters(word).lower()
         if word == "":
             return -1
 
-        appended_foreign_words = list(map(lambda el: el + char_separator, array))
-
-        for array_word in appended_foreign_words:
-            if word.startswith(array_word):
-                return len(array_word)
+        foreign_word = index.first_prefix_of(word, char_separator)
+        if foreign_word is None:
+            return -1
 
-        return -1
+        return len(foreign_word) + len(char_separator)
 
 
     # Trims white spaces and punctuation marks from the start and the end of the word.
@@ -476,3 +826,99 @@ class SerbCyr:
         regexp = "^(" + excessive_chars + ")+|(" + excessive_chars + ")+$"
 
         return re.sub(regexp, '', word)
+
+
+# Splits text into complete words with following whitespace and the last
+# word, which may continue in the next chunk. Carriage return at the end
+# stays with the last word, so that '\r\n' is not split either.
+def split_chunk(text):
+    match = LAST_SPACE_REGEX.match(text)
+    if match is None:
+        return ('', text)
+    end = match.end()
+    if end == len(text) and text.endswith('\r'):
+        end -= 1
+    return (text[:end], text[end:])
+
+
+# Reads infile in chunks of chunk_size characters, writing text converted
+# by convert(text) to outfile as soon as it is ready. Chunks are split
+# between words, so the output is the same as for the whole text, while
+# memory use is bounded by chunk size and the longest word.
+def convert_stream(convert, infile, outfile, chunk_size=DEFAULT_CHUNK_SIZE):
+    # Reading 0 characters would look like the end of file
+    if chunk_size <= 0:
+        raise ValueError('chunk size must be positive: %d' % (chunk_size))
+    carry = ''
+    while True:
+        chunk = infile.read(chunk_size)
+        if not chunk:
+            break
+        (text, carry) = split_chunk(carry + chunk)
+        if text:
+            outfile.write(convert(text))
+    if carry:
+        outfile.write(convert(carry))
+
+
+# Regex character class with characters that keys of given mapping start
+# with; text without any of them is not changed by the mapping
+def letters_class(mapping):
+    return '[' + ''.join(map(re.escape, sorted(set(key[0] for key in mapping)))) + ']'
+
+
+# Converts Serbian Cyrillic to Latin script. Offers the part of SerbCyr's
+# interface used for documents, so they can be converted in either direction.
+class SerbLat:
+
+    C_COUNT_WORDS = SerbCyr.C_COUNT_WORDS
+    C_COUNT_FAST_PATH = SerbCyr.C_COUNT_FAST_PATH
+    C_COUNT_CYRILLIC_WORDS = 'cyrillic_words'
+    C_ANALYSIS_COUNTERS = (C_COUNT_WORDS, C_COUNT_CYRILLIC_WORDS)
+    LANG = 'sr-Latn'
+
+    def __init__(self, cyr=None):
+        self._cyr = cyr if cyr is not None else SerbCyr()
+        self.counters = Counter()
+        self.letters_class = letters_class(SerbCyr._cyrillic_to_latin)
+        self._letters_regex = re.compile(self.letters_class)
+
+
+    def needs_transliteration(self, text):
+        return self._letters_regex.search(text) is not None
+
+
+    # Like SerbCyr.text_to_cyrillic, returns text without Cyrillic letters unchanged
+    def text_to_latin(self, text):
+        if not self.needs_transliteration(text):
+            self.counters[self.C_COUNT_FAST_PATH] += 1
+            return text
+        self.counters[self.C_COUNT_WORDS] += len(text.split())
+        return self._cyr.text_to_latin(text)
+
+
+    def transliterate_many(self, texts):
+        return [self.text_to_latin(text) for text in texts]
+
+
+    def transliterate_stream(self, infile, outfile, chunk_size=DEFAULT_CHUNK_SIZE):
+        convert_stream(self.text_to_latin, infile, outfile, chunk_size)
+
+
+    # Like SerbCyr.analyze_many; every Cyrillic word is converted, so there are no hits
+    def analyze_many(self, texts, memo=None):
+        decisions = Counter()
+        for text in texts:
+            words = text.split()
+            decisions[self.C_COUNT_WORDS] += len(words)
+            if self.needs_transliteration(text):
+                decisions[self.C_COUNT_CYRILLIC_WORDS] += sum(1 for word in words if self.needs_transliteration(word))
+        return (decisions, Counter())
+
+
+    def cache_info(self):
+        return None
+
+
+    def cache_clear(self):
+        pass
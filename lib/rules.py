@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+__doc__ = """
+Rules saying which HTML elements are transliterated and how their
+attributes are cleaned up, compiled once and applied in one pass.
+
+Default tables can be changed by JSON file like this one:
+
+    {
+        "text_tags" : ["p", "span"],
+        "extra_text_tags" : ["blockquote", "cite"],
+        "allowed_attributes" : {"td" : ["class", "colspan"], "table" : null},
+        "add_if_missing" : {"img" : {"alt" : ""}}
+    }
+
+"text_tags" replaces the list of elements whose text is transliterated,
+"extra_text_tags" adds to it. Entries of the other two tables replace
+entries for the same tag; null removes the entry. Unknown keys and
+values of other types raise ValueError.
+"""
+
+import json
+import re
+
+
+TAG_NAME_REGEX = re.compile(r'^[A-Za-z_][\w.:-]*$')
+
+
+CONFIG_KEYS = ('text_tags', 'extra_text_tags', 'allowed_attributes', 'add_if_missing')
+
+
+# Returns tables with changes from JSON file applied to them. Raises
+# ValueError naming the key whose value has wrong type.
+def load_rules_config(path, text_tags, allowed_attributes, add_if_missing):
+    with open(path, 'r', encoding='utf-8') as f:
+        config = json.load(f)
+    if not isinstance(config, dict):
+        raise ValueError("'%s': expected JSON object" % (path))
+    for key in config:
+        if key not in CONFIG_KEYS:
+            raise ValueError("'%s': unknown key '%s'" % (path, key))
+    try:
+        if 'text_tags' in config:
+            text_tags = check_strings(config['text_tags'], 'text_tags')
+        text_tags = list(text_tags) + check_strings(config.get('extra_text_tags', []), 'extra_text_tags')
+        changes = check_table(config.get('allowed_attributes', {}), 'allowed_attributes', check_strings)
+        allowed_attributes = merge_table(allowed_attributes, changes)
+        changes = check_table(config.get('add_if_missing', {}), 'add_if_missing', check_attribute_values)
+        add_if_missing = merge_table(add_if_missing, changes)
+    except ValueError as e:
+        raise ValueError("'%s': %s" % (path, e))
+    return (text_tags, allowed_attributes, add_if_missing)
+
+
+def check_strings(value, key):
+    if not isinstance(value, list) or not all(isinstance(item, str) for item in value):
+        raise ValueError("'%s' must be list of strings" % (key))
+    return value
+
+
+def check_attribute_values(value, key):
+    if not isinstance(value, dict) or not all(isinstance(item, str) for item in value.values()):
+        raise ValueError("'%s' must be object with string values" % (key))
+    return value
+
+
+# Checks JSON object {tag: entry or null}, entries with check(entry, key)
+def check_table(value, key, check):
+    if not isinstance(value, dict):
+        raise ValueError("'%s' must be object" % (key))
+    for tag, entry in value.items():
+        if entry is not None:
+            check(entry, '%s.%s' % (key, tag))
+    return value
+
+
+def merge_table(table, changes):
+    table = dict(table)
+    for tag, value in changes.items():
+        if value is None:
+            table.pop(tag, None)
+        else:
+            table[tag] = value
+    return table
+
+
+class HtmlRules:
+
+    # add_if_missing maps tag to {attribute: value} or to (attribute, value) pairs
+    def __init__(self, text_tags, allowed_attributes, add_if_missing, lang_tags=('html',)):
+        self.text_tags = frozenset(text_tags)
+        self.lang_tags = frozenset(lang_tags)
+        allowed_attributes = dict((tag, frozenset(attrs)) for tag, attrs in allowed_attributes.items())
+        add_if_missing = dict((tag, tuple(dict(attrs).items())) for tag, attrs in add_if_missing.items())
+
+        # Tag -> (collect text, allowed attributes or None, attributes to add, set lang)
+        self._actions = dict()
+        tags = self.text_tags | self.lang_tags | frozenset(allowed_attributes) | frozenset(add_if_missing)
+        for tag in tags:
+            if not TAG_NAME_REGEX.match(tag):
+                raise ValueError("invalid tag name '%s'" % (tag))
+            self._actions[tag] = (tag in self.text_tags, allowed_attributes.get(tag),
+                add_if_missing.get(tag, ()), tag in self.lang_tags)
+        # Only elements having some rule are visited, in document order. Tag
+        # filter of iter() runs in C; XPath with the same union was slower.
+        self._tags = tuple(sorted(tags))
+
+
+    # Cleans up attributes of elements and sets language, returning
+    # lists of elements whose text and whose tail need transliteration
+    def apply(self, tree, lang):
+        text_elems = []
+        tail_elems = []
+        actions = self._actions
+        for elem in tree.iter(*self._tags):
+            (collect_text, allowed, add, set_lang) = actions[elem.tag]
+            if collect_text:
+                if elem.text is not None:
+                    text_elems.append(elem)
+                if elem.tail is not None:
+                    tail_elems.append(elem)
+            attrib = elem.attrib
+            if allowed is not None:
+                for attr in attrib.keys():
+                    if attr not in allowed:
+                        del attrib[attr]
+            for (attr, value) in add:
+                if attr not in attrib:
+                    attrib[attr] = value
+            if set_lang:
+                # Replace existing 'lang' and 'xml:lang' attributes
+                attrib['lang'] = lang
+                attrib['xml:lang'] = lang
+        return (text_elems, tail_elems)
@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+__doc__ = """
+Queue of books in a spool directory, drained by workers on any number
+of hosts sharing the filesystem, without a central service.
+
+    queue/    jobs waiting for a worker, taken in the order of names
+    active/   jobs taken by workers (leases)
+    done/     records of converted books
+    failed/   records of books which could not be converted
+    tmp/      files being written, renamed into other directories when complete
+
+Job is a JSON file {"id", "input", "output", "attempts", "enqueued"}.
+Worker takes a job by renaming queue/<id>.json to active/<id>@<worker>.json;
+rename succeeds for one worker only. While the book is converted, the
+worker touches its lease every heartbeat interval. Lease not touched for
+lease_timeout seconds belongs to a dead worker: any worker puts the job
+back into the queue, or into failed/ after max_attempts expired leases.
+Clocks of the hosts must agree to well within lease_timeout. File which
+is not a valid job is moved to failed/ as it is.
+
+Output and record (the journal record of lib/batch.py, with id, worker,
+attempts and times of the job) are written to temporary files and
+renamed, so others never see them half written. A worker which lost
+its lease does not publish the record; the job may then be converted
+twice, which writes the same output.
+"""
+
+from   .batch import Job, STATUS_DONE, STATUS_FAILED, run_job
+from   .daemon import init_pool_worker
+from   datetime import datetime
+import json
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+import uuid
+
+
+QUEUE_DIR = 'queue'
+ACTIVE_DIR = 'active'
+DONE_DIR = 'done'
+FAILED_DIR = 'failed'
+TMP_DIR = 'tmp'
+SPOOL_DIRS = (QUEUE_DIR, ACTIVE_DIR, DONE_DIR, FAILED_DIR, TMP_DIR)
+JOB_EXTENSION = '.json'
+# Separates job id from worker id in names of leases
+LEASE_SEPARATOR = '@'
+# Extension of jobs taken from expired leases, before they are queued again
+REAP_EXTENSION = '.reap'
+
+DEFAULT_LEASE_TIMEOUT = 60.0
+DEFAULT_POLL_INTERVAL = 1.0
+DEFAULT_MAX_ATTEMPTS = 3
+
+
+def now_iso():
+    return datetime.now().isoformat(timespec='seconds')
+
+
+def default_worker_id():
+    return '%s-%d' % (socket.gethostname(), os.getpid())
+
+
+def create_spool(root):
+    for name in SPOOL_DIRS:
+        os.makedirs(os.path.join(root, name), exist_ok=True)
+
+
+# Writes JSON file through tmp/, so that it appears complete in directory
+def publish_json(root, directory, name, data):
+    temporary = os.path.join(root, TMP_DIR, '%s.%s.tmp' % (name, uuid.uuid4().hex))
+    with open(temporary, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporary, os.path.join(root, directory, name))
+
+
+def read_json(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+# Returns job read from file, raises ValueError if it is not a job
+def read_job(path):
+    job = read_json(path)
+    if not isinstance(job, dict) or not all(isinstance(job.get(key), str) for key in ('id', 'input', 'output')):
+        raise ValueError("'%s' is not a job" % (path))
+    return job
+
+
+# Adds jobs (lib/batch.py Job) to the queue in the given order, returns their ids
+def enqueue(root, jobs):
+    create_spool(root)
+    ids = []
+    for job in jobs:
+        # Names sort in the order jobs were added
+        id = '%020d-%s' % (time.time_ns(), uuid.uuid4().hex[:12])
+        publish_json(root, QUEUE_DIR, id + JOB_EXTENSION, {'id' : id, 'input' : os.path.abspath(job.input),
+            'output' : os.path.abspath(job.output), 'attempts' : 0, 'enqueued' : now_iso()})
+        ids.append(id)
+    return ids
+
+
+# Returns {directory: number of files} of the spool
+def spool_status(root):
+    return dict((name, len(os.listdir(os.path.join(root, name)))) for name in SPOOL_DIRS if name != TMP_DIR)
+
+
+# Touches lease every interval seconds while the job is converted.
+# lost is set when the lease is gone, i.e. it was taken as expired.
+class Heartbeat(threading.Thread):
+
+    def __init__(self, path, interval):
+        threading.Thread.__init__(self, daemon=True)
+        self.path = path
+        self.interval = interval
+        self.lost = False
+        self._stopped = threading.Event()
+
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            if not self.beat():
+                return
+
+
+    def beat(self):
+        try:
+            os.utime(self.path)
+            return True
+        except FileNotFoundError:
+            self.lost = True
+            return False
+
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+
+
+class SpoolWorker:
+
+    # convert(input, output) converts one book, after initializer(*initargs)
+    # has prepared this process (plugin.worker_convert_epub and plugin.init_worker)
+    def __init__(self, root, convert, initializer=None, initargs=(), worker_id=None,
+            lease_timeout=DEFAULT_LEASE_TIMEOUT, heartbeat_interval=None, poll_interval=DEFAULT_POLL_INTERVAL,
+            max_attempts=DEFAULT_MAX_ATTEMPTS, log=None):
+        if LEASE_SEPARATOR in (worker_id or '') or os.sep in (worker_id or ''):
+            raise ValueError("invalid worker id '%s'" % (worker_id))
+        self.root = root
+        self.convert = convert
+        self.worker_id = worker_id or default_worker_id()
+        self.lease_timeout = lease_timeout
+        self.heartbeat_interval = heartbeat_interval or lease_timeout / 4.0
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.log = log
+        self.converted = 0
+        create_spool(root)
+        if initializer is not None:
+            initializer(*initargs)
+
+
+    def _path(self, directory, name=''):
+        return os.path.join(self.root, directory, name)
+
+
+    # Takes the first waiting job, returns (job, lease path) or None
+    def claim(self):
+        for name in sorted(os.listdir(self._path(QUEUE_DIR))):
+            if not name.endswith(JOB_EXTENSION):
+                continue
+            id = name[:-len(JOB_EXTENSION)]
+            lease = self._path(ACTIVE_DIR, '%s%s%s%s' % (id, LEASE_SEPARATOR, self.worker_id, JOB_EXTENSION))
+            try:
+                os.rename(self._path(QUEUE_DIR, name), lease)
+            except FileNotFoundError:
+                # Taken by another worker
+                continue
+            # Lease starts now, not when the job was queued
+            os.utime(lease)
+            try:
+                return (read_job(lease), lease)
+            except ValueError as e:
+                self._reject(lease, id, e)
+        return None
+
+
+    # Moves file which is not a valid job to failed/ as it is, so that it
+    # is neither taken again nor lost
+    def _reject(self, path, id, error):
+        os.replace(path, self._path(FAILED_DIR, id + JOB_EXTENSION))
+        if self.log is not None:
+            self.log({'id' : id, 'input' : path, 'status' : STATUS_FAILED, 'worker' : self.worker_id,
+                'finished' : now_iso(), 'error' : '%s: %s' % (type(error).__name__, error)})
+
+
+    # Puts jobs of expired leases back into the queue, returns their number.
+    # Jobs are first renamed into tmp/, so that only one worker handles each;
+    # those left there by a worker which died meanwhile are handled too.
+    def reap_expired(self):
+        deadline = time.time() - self.lease_timeout
+        reaped = 0
+        candidates = [(ACTIVE_DIR, name) for name in os.listdir(self._path(ACTIVE_DIR))] + \
+            [(TMP_DIR, name) for name in os.listdir(self._path(TMP_DIR)) if name.endswith(REAP_EXTENSION)]
+        for (directory, name) in candidates:
+            path = self._path(directory, name)
+            try:
+                # Rename changes ctime, so lease taken a moment ago is
+                # not expired even before the worker touches it
+                st = os.stat(path)
+                if max(st.st_mtime, st.st_ctime) > deadline:
+                    continue
+                id = name.split(LEASE_SEPARATOR, 1)[0]
+                taken = self._path(TMP_DIR, '%s%s%s%s' % (id, LEASE_SEPARATOR, self.worker_id, REAP_EXTENSION))
+                os.rename(path, taken)
+                os.utime(taken)
+            except FileNotFoundError:
+                continue
+            try:
+                job = read_job(taken)
+            except ValueError as e:
+                self._reject(taken, id, e)
+                continue
+            job['attempts'] = job.get('attempts', 0) + 1
+            if job['attempts'] >= self.max_attempts:
+                record = dict(job, status='failed', worker=self.worker_id, finished=now_iso(),
+                    error='lease expired %d times' % (job['attempts']))
+                publish_json(self.root, FAILED_DIR, id + JOB_EXTENSION, record)
+            else:
+                publish_json(self.root, QUEUE_DIR, id + JOB_EXTENSION, job)
+            os.remove(taken)
+            reaped += 1
+        return reaped
+
+
+    # Converts book of the job while keeping its lease, then publishes the record
+    def process(self, job, lease):
+        heartbeat = Heartbeat(lease, self.heartbeat_interval)
+        heartbeat.start()
+        started = now_iso()
+        try:
+            record = run_job(self.convert, Job(job['input'], job['output'], None))
+        except BaseException:
+            # Stopped by signal or Ctrl+C: job goes back to the queue at once
+            heartbeat.stop()
+            try:
+                os.rename(lease, self._path(QUEUE_DIR, job['id'] + JOB_EXTENSION))
+            except OSError:
+                pass
+            raise
+        heartbeat.stop()
+        if heartbeat.lost or not heartbeat.beat():
+            if self.log is not None:
+                self.log(dict(job, status='lost', worker=self.worker_id))
+            return None
+        record.update(id=job['id'], worker=self.worker_id, attempts=job.get('attempts', 0),
+            enqueued=job.get('enqueued'), started=started)
+        directory = DONE_DIR if record['status'] == STATUS_DONE else FAILED_DIR
+        publish_json(self.root, directory, job['id'] + JOB_EXTENSION, record)
+        os.remove(lease)
+        self.converted += 1
+        if self.log is not None:
+            self.log(record)
+        return record
+
+
+    # Takes and converts jobs until max_jobs are converted or, with drain,
+    # until no job is waiting or taken by any worker
+    def run(self, max_jobs=None, drain=False):
+        while max_jobs is None or self.converted < max_jobs:
+            self.reap_expired()
+            claimed = self.claim()
+            if claimed is not None:
+                self.process(*claimed)
+                continue
+            if drain and not os.listdir(self._path(ACTIVE_DIR)):
+                break
+            time.sleep(self.poll_interval)
+        return self.converted
+
+
+# Runs worker in a process of its own (for multiprocessing.Process).
+# Ctrl+C is left to the parent, which stops workers by SIGTERM; job
+# being converted then goes back to the queue.
+def run_worker(root, convert, initializer, initargs, options, max_jobs=None, drain=False):
+    init_pool_worker(None, ())
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    worker = SpoolWorker(root, convert, initializer, initargs, **options)
+    worker.run(max_jobs, drain)
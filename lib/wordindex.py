@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+__doc__ = """
+Compiled index of a word list, answering equality and prefix queries.
+
+Words from a .txt list are sorted by their UTF-8 bytes and saved next to
+it as .idx file, which is memory mapped, so all processes using the same
+list share one copy of it. Index is rebuilt when the .txt file is newer.
+
+Layout (native byte order, checked by BYTE_ORDER_MARK):
+    header: magic, byte order mark, number of words, size of word data
+    offsets of words in word data (number of words + 1)
+    position of each word in the .txt list (number of words)
+    word data
+
+Run as 'python3 -m lib.wordindex' to build indexes of all lists.
+"""
+
+from   array import array
+import mmap
+import os
+import struct
+import sys
+
+
+MAGIC = b'L2CWIDX1'
+BYTE_ORDER_MARK = 0x01020304
+HEADER = struct.Struct('8sIIII')
+
+
+# Reads list of words, skipping comments and blank lines
+def read_words(filepath):
+    words = []
+    with open(filepath, 'r', encoding='utf-8') as f:
+        for line in f.read().splitlines():
+            if line.startswith('#') or line.strip() == '':
+                continue
+            words.append(line.replace(' ', ''))
+    return words
+
+
+# Returns contents of index file for given list of words
+def compile_words(words):
+    ranks = dict()
+    for rank, word in enumerate(words):
+        ranks.setdefault(word.encode('utf-8'), rank)
+    keys = sorted(ranks)
+    offsets = array('I', [0])
+    for key in keys:
+        offsets.append(offsets[-1] + len(key))
+    blob = b''.join(keys)
+    header = HEADER.pack(MAGIC, BYTE_ORDER_MARK, len(keys), len(blob), 0)
+    return header + offsets.tobytes() + array('I', [ranks[key] for key in keys]).tobytes() + blob
+
+
+def is_stale(source_path, index_path):
+    try:
+        return os.path.getmtime(index_path) < os.path.getmtime(source_path)
+    except OSError:
+        return True
+
+
+# Writes index through temporary file, so that processes
+# building the same index at once do not see partial file
+def build_index(source_path, index_path):
+    data = compile_words(read_words(source_path))
+    tmp_path = '%s.%d.tmp' % (index_path, os.getpid())
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, index_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return data
+
+
+class WordIndex:
+
+    # Index is opened (and rebuilt if needed) on the first query
+    def __init__(self, source_path, index_path=None):
+        self.source_path = source_path
+        self.index_path = index_path or os.path.splitext(source_path)[0] + '.idx'
+        self._data = None
+
+
+    def _load(self):
+        data = None
+        if not is_stale(self.source_path, self.index_path):
+            data = self._map_file()
+        if data is None:
+            try:
+                build_index(self.source_path, self.index_path)
+                data = self._map_file()
+            except OSError:
+                data = None
+            if data is None:
+                # Plugin directory may be read only
+                data = compile_words(read_words(self.source_path))
+        (magic, mark, count, blob_size, _) = HEADER.unpack_from(data)
+        view = memoryview(data)
+        start = HEADER.size
+        self._offsets = view[start:start + 4 * (count + 1)].cast('I')
+        start += 4 * (count + 1)
+        self._ranks = view[start:start + 4 * count].cast('I')
+        self._blob_start = start + 4 * count
+        self._count = count
+        self._data = data
+
+
+    # Returns mapped index file, None if it is missing or invalid
+    def _map_file(self):
+        try:
+            with open(self.index_path, 'rb') as f:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return None
+        if len(data) < HEADER.size:
+            return None
+        (magic, mark, count, blob_size, _) = HEADER.unpack_from(data)
+        if magic != MAGIC or mark != BYTE_ORDER_MARK or \
+                len(data) != HEADER.size + 8 * count + 4 + blob_size:
+            return None
+        return data
+
+
+    def _ensure_loaded(self):
+        if self._data is None:
+            self._load()
+
+
+    def _key(self, i):
+        start = self._blob_start
+        return self._data[start + self._offsets[i]:start + self._offsets[i + 1]]
+
+
+    # Position of the last word not greater than key among the first hi words, -1 if none
+    def _floor(self, key, hi):
+        lo = 0
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._key(mid) <= key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo - 1
+
+
+    # Yields positions of words which are prefixes of key, longest first.
+    # Every prefix of key is not greater than the last word w <= key;
+    # if w is not a prefix itself, all prefixes are prefixes of the
+    # part that key and w have in common.
+    def _prefixes(self, key):
+        hi = self._count
+        while True:
+            i = self._floor(key, hi)
+            if i < 0:
+                return
+            word = self._key(i)
+            if key.startswith(word):
+                yield i
+                if not word:
+                    return
+                key = key[:len(word) - 1]
+            else:
+                key = key[:len(os.path.commonprefix((key, word)))]
+            hi = i
+
+
+    def __len__(self):
+        self._ensure_loaded()
+        return self._count
+
+
+    def __contains__(self, word):
+        self._ensure_loaded()
+        key = word.encode('utf-8')
+        i = self._floor(key, self._count)
+        return i >= 0 and self._key(i) == key
+
+
+    # True if word starts with any of the words from the list
+    def has_prefix_of(self, word):
+        self._ensure_loaded()
+        for _ in self._prefixes(word.encode('utf-8')):
+            return True
+        return False
+
+
+    # Returns the word from the list, earliest in the .txt file, which
+    # word starts with and which is followed by separator; None if none
+    def first_prefix_of(self, word, separator=''):
+        self._ensure_loaded()
+        key = word.encode('utf-8')
+        separator = separator.encode('utf-8')
+        found = None
+        for i in self._prefixes(key):
+            prefix = self._key(i)
+            if key.startswith(separator, len(prefix)) and (found is None or self._ranks[i] < self._ranks[found]):
+                found = i
+        if found is None:
+            return None
+        return self._key(found).decode('utf-8')
+
+
+# Index with words from user's overlay files (lib/overlay.py) on top of
+# it. Overlay words are kept in memory and can be replaced at any time;
+# they come after all words of the index in the order of the list.
+class LayeredIndex:
+
+    def __init__(self, base):
+        self.base = base
+        self.source_path = base.source_path
+        # Word -> position among overlay words
+        self._words = dict()
+        self._lengths = ()
+
+
+    # Replaces overlay words, returning set of words added or removed
+    def set_words(self, words):
+        new_words = dict()
+        for word in words:
+            new_words.setdefault(word, len(new_words))
+        changed = set(new_words).symmetric_difference(self._words)
+        self._words = new_words
+        self._lengths = sorted(set(len(word) for word in new_words))
+        return changed
+
+
+    def overlay_words(self):
+        return list(self._words)
+
+
+    def __len__(self):
+        return len(self.base) + sum(1 for word in self._words if word not in self.base)
+
+
+    def __contains__(self, word):
+        return word in self._words or word in self.base
+
+
+    # Overlay words which word starts with, checked by their lengths
+    def _overlay_prefixes(self, word):
+        for length in self._lengths:
+            if length > len(word):
+                break
+            if word[:length] in self._words:
+                yield word[:length]
+
+
+    def has_prefix_of(self, word):
+        for _ in self._overlay_prefixes(word):
+            return True
+        return self.base.has_prefix_of(word)
+
+
+    def first_prefix_of(self, word, separator=''):
+        found = self.base.first_prefix_of(word, separator)
+        if found is not None:
+            return found
+        for prefix in self._overlay_prefixes(word):
+            if word.startswith(separator, len(prefix)) and \
+                    (found is None or self._words[prefix] < self._words[found]):
+                found = prefix
+        return found
+
+
+def main(argv=None):
+    directory = os.path.abspath(os.path.dirname(__file__))
+    paths = argv or [os.path.join(directory, name) for name in sorted(os.listdir(directory)) if name.endswith('.txt')]
+    for path in paths:
+        index = WordIndex(path)
+        build_index(index.source_path, index.index_path)
+        print("%s: %d" % (index.index_path, len(index)))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
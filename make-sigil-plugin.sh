@@ -11,6 +11,8 @@ rm -rf ${DEST}/.git* ${DEST}*.zip
 sed -i -e "s/#VERSIONPLACEHOLDER#/${RELEASE}/g" ${DEST}/plugin.xml
 zip ${DEST}.zip -r ${DEST} \
     -x ${DEST}/README.md -x ${DEST}/test_plugin.py -x ${DEST}/lib/__pycache__/ -x ${DEST}/lib/__pycache__/* \
+    -x ${DEST}/benchmarks/ -x ${DEST}/benchmarks/* -x ${DEST}/lib/*.idx \
+    -x ${DEST}/tests/ -x ${DEST}/tests/* \
     ${DEST}/LICENSE ${DEST}/*sh
 unzip -t ${DEST}.zip
 rm -rf ${TMPDESTDIR}
@@ -2,14 +2,67 @@
 # -*- coding: utf-8 -*-
 # vim:ts=4:sw=4:softtabstop=4:smarttab:expandtab
 
+from   collections import Counter, deque
+from   concurrent.futures import ProcessPoolExecutor
+from   concurrent.futures.process import BrokenProcessPool
 from   datetime  import datetime
+from   lib.analysis import Analysis
+from   lib.instrument import Stats
+from   lib.manifest import HashManifest, digest
+from   lib.rules import HtmlRules, load_rules_config
 from   lxml      import etree
+import lib.epub as epub
 import lib.py2srbcyr as pycir
+import html
+import io
+import os
 import platform
+import queue
+import re
+import threading
 
 
 # Global variables
 MODNAME = 'Lat2Cyr'
+# Number of distinct words whose transliteration is kept for the whole book
+WORD_CACHE_SIZE = 50000
+# Plugin preferences, can be changed in Sigil's JSON file for this plugin
+DEFAULT_PREFS = {
+    # Number of processes transliterating XHTML files; 0 means one per CPU core.
+    # Parallel conversion is opt-in, it has not been verified inside Sigil yet.
+    'workers' : 1,
+    # 'tree' parses and reserializes XHTML files with lxml,
+    # 'stream' rewrites only text between tags and leaves markup untouched
+    'html_mode' : 'tree',
+    # Path of JSON file with timings and counters; empty means no report
+    'report_json' : '',
+    # Skip files which have not changed since they were transliterated last time
+    'incremental' : True,
+    # 'lat2cyr' converts Latin script to Cyrillic, 'cyr2lat' Cyrillic to Latin
+    'direction' : 'lat2cyr',
+    # Number of XHTML files read ahead of transliteration and waiting to be
+    # written; 0 reads, converts and writes files one after another. Reading
+    # ahead calls bk.readfile and bk.writefile from another thread, which is
+    # opt-in, it has not been verified inside Sigil yet.
+    'queue_depth' : 0,
+    # JSON file changing which HTML elements are transliterated and which
+    # attributes are kept or added (see lib/rules.py); empty means defaults
+    'rules_file' : '',
+    # SQLite file keeping transliterated words between runs and books
+    # (see lib/diskcache.py); empty means words are kept only in memory
+    'disk_cache' : '',
+    # User's files adding words to the lists in lib/ (see lib/overlay.py);
+    # changes are picked up while the plugin runs
+    'overlays' : [],
+    # Only report which files contain text to convert and how their words
+    # would be classified; nothing is converted or written
+    'analyze_only' : False,
+    # Number of the most frequent foreign words and list entries in the report
+    'top_hits' : 20,
+}
+# Preference holding content hashes of files of recently transliterated books
+MANIFESTS_PREF = 'manifests'
+MAX_MANIFESTS = 50
 # HTML tags that can contain text requireing transliteration
 HTML_TAGS = ('a', 'div', 'font', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'img', 'p', 'br', 'b', 'i', 'em', 'span', 'sub', 'sup', 'title', 'th', 'td', 'li', 'strong', 'u')
 GLOBAL_HTML4_ATTRS = ('accesskey', 'class', 'dir', 'id', 'lang', 'style', 'tabindex', 'title',)
@@ -26,7 +79,8 @@ ALLOWED_ATTRIBS = {
 }
 # Dictionary that says what attribute can be added to what tag, if missing
 ADD_IF_MISSING_ATTRS = {
-	'img' : ( ('alt', 'img'), )
+	'img' : ( ('alt', 'img'), ),
+	'svg' : ( ('xmlns:xlink', 'http://www.w3.org/1999/xlink'), ),
 }
 # Special tags for eBook files
 EBOOK_TAGS = ( 'text', 'creator', 'contributor', 'description', 'meta', 'publisher', 'subject', 'title' )
@@ -37,147 +91,747 @@ HTML_DOCTYPE = """<!DOCTYPE html PUBLIC "-//W3C//DTD XHTML 1.1//EN"
 NCX_DOCTYPE = """<!DOCTYPE ncx PUBLIC "-//NISO//DTD ncx 2005-1//EN"
    "http://www.daisy.org/z3986/2005/ncx-2005-1.dtd">
 """
-
-
-# Removes unnecessery HTML characters
-def remove_special_html_chars(stri):
-    return stri.replace('&#173;', '').replace('&shy;', '').replace('&', '&amp;')
-
-
-# Remove 0-width non-joiner character
-def remove_0width_non_joiner(tree, doctype):
-    retstr = etree.tostring(tree, xml_declaration=True, encoding='utf-8', doctype=doctype)
-    return retstr.decode('utf-8').replace(u'\u200c', '').replace('&amp;', '&').encode('utf-8')
-
-
-# Handles spaces surrounding string properly.
-# They are important in HTML text
-def text_to_cyr(cyr, stri):
-    ret = ''
-    if stri[0] == ' ':
-        ret = ' '
-    ret = ret + cyr.text_to_cyrillic(stri)
-    if stri[-1] == ' ':
-        ret = ret + ' '
-    return ret
+META_XPATH = etree.XPath("//meta[@charset or @content]")
+COMMENTS_XPATH = etree.XPath('//comment()')
+# Markup recognized by streaming rewriter. Content of script and style
+# elements is not markup, so whole elements are matched as one piece.
+MARKUP_REGEX = re.compile(r'<(?:script|style)\b(?:[^>"\']|"[^"]*"|\'[^\']*\')*(?<!/)>.*?</(?:script|style)\s*>'
+    r'|<!--.*?-->|<!\[CDATA\[.*?\]\]>|<![^>]*>|<\?.*?\?>'
+    r'|</?[A-Za-z](?:[^>"\']|"[^"]*"|\'[^\']*\')*>', re.S | re.I)
+TAG_NAME_REGEX = re.compile(r'</?([A-Za-z][^\s/>]*)')
+LANG_ATTR_REGEX = re.compile(r'\s(?:xml:)?lang\s*=\s*(?:"[^"]*"|\'[^\']*\'|[^\s>]+)')
+META_CONTENT_REGEX = re.compile(r'<meta\b[^>]*\s(?:charset|content)\s*=', re.I)
+IDENTIFIER_REGEX = re.compile(r'<dc:identifier\b[^>]*>([^<]*)</dc:identifier>')
+SOFT_HYPHEN = '\u00ad'
+ZERO_WIDTH_NON_JOINER = '\u200c'
+# Characters of text transliterated at once by streaming rewriter
+STREAM_BATCH_SIZE = 64 * 1024
+META_CHARSET = '<meta http-equiv="content-type" content="text/html; charset=utf-8"/>'
+
+
+# Soft hyphens would split words (and digraphs) while transliterating,
+# zero-width non-joiners are left by transliteration between split digraphs
+def remove_soft_hyphens(text):
+    return text.replace(SOFT_HYPHEN, '')
+
+
+def remove_0width_non_joiner(text):
+    return text.replace(ZERO_WIDTH_NON_JOINER, '')
 
 
 # Core function that converts text in HTML elements
 # from Croatian Latin into Serbian Cyrillic script
-def html_lat2cyr(source, cyr, doctype, html_parser):
+def html_lat2cyr(source, cyr, doctype, html_parser, stats=None, rules=None):
     ts = datetime.now().strftime("%Y-%m-%d %H:%M")
-    ret = remove_special_html_chars(source)
-    tree = etree.HTML(ret.encode('utf-8'), html_parser)
-
-    # Add META tag with correct encoding
-    meta_el = tree.xpath("//meta[@charset or @content]")
-    if not meta_el:
-        # Add META tags that define content
-        head_elem = tree.find('head')
-        if head_elem is not None:
-            metachr = etree.SubElement(head_elem, 'meta')
-            metachr.set(u'http-equiv', u"content-type")
-            metachr.set(u'content', u"text/html; charset=utf-8")
-            metachr.text = ''
-
-    # Walk over tree, changing text nodes
-    for elem in tree.getiterator():
-        if elem.tag in HTML_TAGS:
-            if elem.text is not None:
-                elem.text = text_to_cyr(cyr, elem.text)
-            if elem.tail is not None:
-                elem.tail = text_to_cyr(cyr, elem.tail)
-        if elem.tag in ADD_IF_MISSING_ATTRS:
-            for (attr, values) in ADD_IF_MISSING_ATTRS.items():
-                for val in values:
-                    if val[0] not in elem.attrib.keys():
-                        # print(f"Element '{elem.tag}' is missing attribute {attr}")
-                        elem.attrib[val[0]] = val[1]
-        # Check if all attributes are in list of allowed/supported
-        if elem.tag in ALLOWED_ATTRIBS.keys():
-            for attr in elem.attrib.keys():
-                if attr not in ALLOWED_ATTRIBS[elem.tag]:
-                    del elem.attrib[attr]
-        if elem.tag == 'html':
-            # Replace existing 'lang' and 'xml:lang' attributes
-            elem.attrib['lang'] = 'sr'
-            elem.attrib['xml:lang'] = 'sr'
-        elif elem.tag == 'svg' and 'xmlns:xlink' not in elem.attrib.keys():
-            elem.attrib['xmlns:xlink'] = 'http://www.w3.org/1999/xlink'
-    if not has_translit_comment(tree):
-        tree.append(etree.Comment(" Пресловљено програмом-додатком '%s'; време %s " % (MODNAME, ts)))
-    # Remove transliteration leftovers
-    return remove_0width_non_joiner(tree, doctype)
+    if stats is None:
+        stats = Stats()
+    if rules is None:
+        rules = default_html_rules()
+    with stats.timer('html.parse'):
+        # Parser resolves entities, so text nodes contain plain characters.
+        # Encoded copy of source is not kept referenced after parsing.
+        tree = etree.HTML(source.encode('utf-8') if isinstance(source, str) else source, html_parser)
+
+    with stats.timer('html.walk'):
+        # Add META tag with correct encoding
+        meta_el = META_XPATH(tree)
+        if not meta_el:
+            # Add META tags that define content
+            head_elem = tree.find('head')
+            if head_elem is not None:
+                metachr = etree.SubElement(head_elem, 'meta')
+                metachr.set(u'http-equiv', u"content-type")
+                metachr.set(u'content', u"text/html; charset=utf-8")
+                metachr.text = ''
+
+        # Clean up attributes, collecting text nodes
+        (text_elems, tail_elems) = rules.apply(tree, cyr.LANG)
+
+    with stats.timer('html.transliterate'):
+        # Transliterate all text nodes of the document in one batch
+        texts = [remove_soft_hyphens(elem.text) for elem in text_elems] + \
+            [remove_soft_hyphens(elem.tail) for elem in tail_elems]
+        converted = cyr.transliterate_many(texts)
+        for elem, cyrillic in zip(text_elems, converted):
+            elem.text = remove_0width_non_joiner(cyrillic)
+        for elem, cyrillic in zip(tail_elems, converted[len(text_elems):]):
+            elem.tail = remove_0width_non_joiner(cyrillic)
+
+    with stats.timer('html.serialize'):
+        if not has_translit_comment(tree):
+            tree.append(etree.Comment(" Пресловљено програмом-додатком '%s'; време %s " % (MODNAME, ts)))
+        return etree.tostring(tree, xml_declaration=True, encoding='utf-8', doctype=doctype)
 
 
 def has_translit_comment(tree):
-    comments = tree.xpath('//comment()')
+    comments = COMMENTS_XPATH(tree)
     for c in comments:
         if c.text.find(MODNAME) > -1:
             return True
     return False
 
 
-# Core function that converts text in XML elements
-# from Croatian Latin into Serbian Cyrillic script
-def xml_lat2cyr(source, cyr, doctype=None, xml_parser=None):
+# Fast alternative to html_lat2cyr, which does not build element tree.
+# Only text directly inside (or directly following) elements listed in
+# HTML_TAGS is transliterated, in the same way lxml assigns text and tail
+# to elements. Tags, attributes, comments and doctype are left untouched,
+# except for language of the <html> element and added META and comment.
+# Markup is matched one piece after another and text is converted in
+# batches of STREAM_BATCH_SIZE characters, so besides source and output
+# only the current batch is kept in memory.
+def html_lat2cyr_stream(source, cyr, stats=None, rules=None):
     ts = datetime.now().strftime("%Y-%m-%d %H:%M")
-    ret = remove_special_html_chars(source)
-    tree = etree.XML(ret.encode('utf-8'), xml_parser)
-
-    # Walk over tree, changing text nodes
+    if stats is None:
+        stats = Stats()
+    text_tags = (rules or default_html_rules()).text_tags
+    if isinstance(source, bytes):
+        source = source.decode('utf-8')
+    output = io.BytesIO()
+    # Pieces waiting for transliteration of their batch: markup as str,
+    # text segments as their index in texts
+    pending = []
+    texts = []
+    batch_size = 0
+    # Output from the last </html> tag on, comment is added before it
+    html_end = None
+
+    def flush():
+        with stats.timer('html.transliterate'):
+            converted = cyr.transliterate_many([stream_text(text) for text in texts])
+        for i, piece in enumerate(pending):
+            if isinstance(piece, int):
+                pending[i] = stream_output(texts[piece], converted[piece])
+        output.write(''.join(pending).encode('utf-8'))
+        pending.clear()
+        texts.clear()
+
+    with stats.timer('html.rewrite'):
+        need_meta = META_CONTENT_REGEX.search(source) is None
+        has_comment = False
+        html_start = True
+        tag = None
+        position = 0
+        for match in MARKUP_REGEX.finditer(source):
+            text = source[position:match.start()]
+            if tag in text_tags and text.strip() != '':
+                # Text belongs to preceding tag, either as its text or its tail
+                pending.append(len(texts))
+                texts.append(text)
+                batch_size += len(text)
+            elif text:
+                pending.append(text)
+            markup = match.group(0)
+            position = match.end()
+            name = TAG_NAME_REGEX.match(markup)
+            tag = name.group(1).lower() if name is not None else None
+            if html_start and tag == 'html' and markup[1] != '/':
+                markup = LANG_ATTR_REGEX.sub('', markup)[:-1] + ' lang="%s" xml:lang="%s">' % (cyr.LANG, cyr.LANG)
+                html_start = False
+            elif markup[1] == '/' and tag == 'head' and need_meta:
+                pending.append(META_CHARSET)
+                need_meta = False
+            elif markup.startswith('<!--') and markup.find(MODNAME) > -1:
+                has_comment = True
+            if markup[1] == '/' and tag == 'html':
+                flush()
+                html_end = output.tell()
+                batch_size = 0
+            pending.append(markup)
+            if batch_size >= STREAM_BATCH_SIZE:
+                flush()
+                batch_size = 0
+        text = source[position:]
+        if tag in text_tags and text.strip() != '':
+            pending.append(len(texts))
+            texts.append(text)
+        elif text:
+            pending.append(text)
+        flush()
+
+        if not has_comment:
+            comment = ("<!-- Пресловљено програмом-додатком '%s'; време %s -->" % (MODNAME, ts)).encode('utf-8')
+            if html_end is None:
+                output.write(comment)
+            else:
+                output.seek(html_end)
+                rest = output.read()
+                output.seek(html_end)
+                output.write(comment)
+                output.write(rest)
+        return output.getvalue()
+
+
+# Text segment as converter gets it: entity references are resolved,
+# as lxml resolves them for html_lat2cyr, and soft hyphens removed
+def stream_text(text):
+    if '&' in text:
+        text = html.unescape(text)
+    return remove_soft_hyphens(text)
+
+
+# Transliterated text segment as written between tags
+def stream_output(text, converted):
+    converted = remove_0width_non_joiner(converted)
+    if '&' in text:
+        # Resolved &lt; and &amp; must not become markup
+        converted = html.escape(converted, quote=False)
+    return converted
+
+
+# Returns tag without namespace
+def local_name(tag):
+    leftbr = tag.find('{')
+    rightbr = tag.find('}')
+    if leftbr > -1 and rightbr > -1 and rightbr > leftbr:
+        return tag[rightbr+1:]
+    return tag
+
+
+# Returns (targets, texts) to convert and sets language; target (element, None) is text, (element, '') tail
+def collect_xml_texts(tree, cyr):
+    targets = []
+    texts = []
     for elem in tree.getiterator():
-        # Remove namespace
+        # Text following entity reference is its tail
+        if elem.tag is etree.Entity:
+            if elem.tail is not None and local_name(elem.getparent().tag) in EBOOK_TAGS:
+                targets.append((elem, ''))
+                texts.append(remove_soft_hyphens(elem.tail))
+            continue
         if not isinstance(elem.tag, str):
             continue
-        leftbr = elem.tag.find('{')
-        rightbr = elem.tag.find('}')
-        if leftbr > -1 and rightbr > -1 and rightbr > leftbr:
-            tag = elem.tag[rightbr+1:]
-        else:
-            tag = elem.tag
-
+        tag = local_name(elem.tag)
         if tag in EBOOK_TAGS:
             if elem.text is not None:
-                elem.text = cyr.text_to_cyrillic(elem.text)
+                targets.append((elem, None))
+                texts.append(remove_soft_hyphens(elem.text))
             # Convert some attributes
             if tag == 'meta' and 'name' in elem.attrib.keys():
                 condList = EBOOK_TAGS_ATTRIBUTES['meta']['name']
                 if elem.attrib['name'] in condList:
-                    elem.attrib['content'] = cyr.text_to_cyrillic(elem.attrib['content'])
+                    targets.append((elem, 'content'))
+                    texts.append(remove_soft_hyphens(elem.attrib['content']))
         elif tag == 'language':
-            elem.text = 'sr'
-    if not has_translit_comment(tree):
-        tree.append(etree.Comment(" Пресловљено програмом-додатком '%s'; време %s " % (MODNAME, ts)))
+            elem.text = cyr.LANG
+    return (targets, texts)
+
+
+# Parses XML document, returns (tree, escaped). Documents which use
+# entities not declared in them (e.g. &nbsp; in toc.ncx written by hand)
+# are not well-formed; they are parsed with every '&' escaped, as the
+# plugin always did, so that references stay in text as they were.
+# Output of escaped document is passed through unescape_xml_output.
+def parse_xml(source, xml_parser):
+    data = source.encode('utf-8') if isinstance(source, str) else source
+    try:
+        return (etree.XML(data, xml_parser), False)
+    except etree.XMLSyntaxError:
+        if b'&' not in data:
+            raise
+    data = data.replace(b'&#173;', b'').replace(b'&shy;', b'').replace(b'&', b'&amp;')
+    return (etree.XML(data, xml_parser), True)
+
+
+def unescape_xml_output(output, escaped):
+    return output.replace(b'&amp;', b'&') if escaped else output
+
+
+# Core function that converts text in XML elements
+# from Croatian Latin into Serbian Cyrillic script
+def xml_lat2cyr(source, cyr, doctype=None, xml_parser=None, stats=None):
+    ts = datetime.now().strftime("%Y-%m-%d %H:%M")
+    if stats is None:
+        stats = Stats()
+    with stats.timer('xml.parse'):
+        # Character references are resolved by parser, references to
+        # entities declared in DTD are kept as nodes (resolve_entities=False).
+        # Encoded copy of source is not kept referenced after parsing.
+        (tree, escaped) = parse_xml(source, xml_parser)
+
+    with stats.timer('xml.walk'):
+        (targets, texts) = collect_xml_texts(tree, cyr)
+
+    with stats.timer('xml.transliterate'):
+        for (elem, attr), cyrillic in zip(targets, cyr.transliterate_many(texts)):
+            cyrillic = remove_0width_non_joiner(cyrillic)
+            if attr is None:
+                elem.text = cyrillic
+            elif attr == '':
+                elem.tail = cyrillic
+            else:
+                elem.attrib[attr] = cyrillic
+
+    with stats.timer('xml.serialize'):
+        if not has_translit_comment(tree):
+            tree.append(etree.Comment(" Пресловљено програмом-додатком '%s'; време %s " % (MODNAME, ts)))
+        try:
+            etree.indent(tree, space='  ')
+        except:
+           pass
+        return unescape_xml_output(etree.tostring(tree, xml_declaration=True, encoding='utf-8', doctype=doctype), escaped)
+
+
+# Converts whole package document (content.opf) the same way Sigil
+# plugin converts it: only <metadata> element goes through xml_lat2cyr
+def opf_lat2cyr(source, cyr, xml_parser=None):
+    (tree, escaped) = parse_xml(source, xml_parser)
+    metadata = tree.find('{http://www.idpf.org/2007/opf}metadata')
+    if metadata is None:
+        return unescape_xml_output(etree.tostring(tree, xml_declaration=True, encoding='utf-8'), escaped)
+    transliterated = xml_lat2cyr(etree.tostring(metadata, encoding='unicode'), cyr, xml_parser=xml_parser)
+    new_metadata = etree.XML(transliterated, xml_parser)
+    tree.replace(metadata, new_metadata)
     try:
         etree.indent(tree, space='  ')
     except:
        pass
-    return remove_0width_non_joiner(tree, doctype)
+    return unescape_xml_output(etree.tostring(tree, xml_declaration=True, encoding='utf-8'), escaped)
 
 
-def translit_toc(bk, xml_parser, cyr):
+def translit_toc(bk, xml_parser, cyr, stats, manifest=None):
     # Transliterate ToC
     ncx_id = bk.gettocid()
-    source = bk.readfile(ncx_id)
-    transliterated = xml_lat2cyr(source, cyr, doctype=NCX_DOCTYPE, xml_parser=xml_parser)
-    bk.writefile(ncx_id, transliterated)
+    source = read_file(bk, ncx_id, stats)
+    if is_transliterated(manifest, ncx_id, source, stats):
+        print("Садржај књиге (toc.ncx) је већ пресловљен")
+        return
+    transliterated = xml_lat2cyr(source, cyr, doctype=NCX_DOCTYPE, xml_parser=xml_parser, stats=stats)
+    save_file(bk, ncx_id, source, transliterated, manifest, stats)
     print("Пресловљен садржај књиге (toc.ncx)")
 
 
-def translit_metadata(bk, xml_parser, cyr):
-    source = bk.getmetadataxml()
-    transliterated = xml_lat2cyr(source, cyr, xml_parser=xml_parser)
-    bk.setmetadataxml(transliterated)
+def translit_metadata(bk, xml_parser, cyr, stats, manifest=None):
+    with stats.timer('bk.getmetadataxml'):
+        source = bk.getmetadataxml()
+    if is_transliterated(manifest, 'metadata', source, stats):
+        print("Метаподаци садржаја (content.opf) су већ пресловљени")
+        return
+    transliterated = xml_lat2cyr(source, cyr, xml_parser=xml_parser, stats=stats)
+    if manifest is not None:
+        manifest.record('metadata', source, transliterated)
+    if same_content(source, transliterated):
+        stats.count('unchanged_files')
+    else:
+        with stats.timer('bk.setmetadataxml'):
+            bk.setmetadataxml(transliterated)
     print("Пресловљени метаподаци садржаја (content.opf)")
 
 
-def translit_pages(bk, html_parser, cyr):
-    for (id, href,) in bk.text_iter():
-        source = bk.readfile(id)
-        transliterated = html_lat2cyr(source, cyr, HTML_DOCTYPE, html_parser)
-        bk.writefile(id, transliterated)
-        print("Пресловљена датотека '%s'" % (href))
+def translit_pages(bk, html_parser, cyr, stats, workers=1, html_mode='tree', manifest=None, direction='lat2cyr',
+        queue_depth=0, rules=None, rules_file='', disk_cache='', overlays=()):
+    files = list(bk.text_iter())
+    errors = []
+    workers = count_workers(workers, len(files))
+    if workers > 1:
+        try:
+            translit_pages_parallel(bk, files, workers, html_mode, stats, errors, manifest, direction, queue_depth,
+                rules_file, disk_cache, overlays)
+            files = []
+        except Exception as e:
+            print("ПАЖЊА: Паралелно пресловљавање није успело (%s), наставља се у једном процесу" % (e))
+    if queue_depth > 0:
+        translit_pages_pipelined(bk, files, html_parser, cyr, stats, errors, html_mode, manifest, queue_depth, rules)
+    else:
+        for (id, href, source) in pending_pages(bk, files, stats, errors, manifest):
+            transliterated = transform_page(source, href, cyr, html_parser, html_mode, stats, errors, rules)
+            if transliterated is not None:
+                commit_page(bk, id, href, source, transliterated, stats, errors, manifest)
+    if errors:
+        print("ПАЖЊА: Број непресловљених датотека: %d" % (len(errors)))
+        for (href, message) in errors:
+            print("  '%s': %s" % (href, message))
+
+
+# Reading and writing of files runs in its own thread, overlapping with
+# transliteration in this thread. Files are written in the order they
+# were read; each queue holds at most queue_depth files.
+def translit_pages_pipelined(bk, files, html_parser, cyr, stats, errors, html_mode, manifest, queue_depth, rules=None):
+    read_queue = queue.Queue(maxsize=queue_depth)
+    write_queue = queue.Queue(maxsize=queue_depth)
+
+    def read_pages():
+        try:
+            for page in pending_pages(bk, files, stats, errors, manifest):
+                read_queue.put(page)
+        finally:
+            read_queue.put(None)
+
+    def write_pages():
+        while True:
+            item = write_queue.get()
+            if item is None:
+                return
+            commit_page(bk, *item, stats=stats, errors=errors, manifest=manifest)
+
+    # Reader is not joined, so it can not block exit if transliteration fails
+    reader = threading.Thread(target=read_pages, daemon=True)
+    writer = threading.Thread(target=write_pages)
+    reader.start()
+    writer.start()
+    try:
+        while True:
+            page = read_queue.get()
+            if page is None:
+                break
+            (id, href, source) = page
+            transliterated = transform_page(source, href, cyr, html_parser, html_mode, stats, errors, rules)
+            if transliterated is not None:
+                write_queue.put((id, href, source, transliterated))
+    finally:
+        # Files transliterated so far are written even if this thread fails
+        write_queue.put(None)
+        writer.join()
+
+
+# Files are read and written in this process, only transliteration
+# runs in worker processes. At most workers + queue_depth files are
+# in flight. If pool breaks down, caller starts over and the manifest
+# skips files already written.
+def translit_pages_parallel(bk, files, workers, html_mode, stats, errors, manifest=None, direction='lat2cyr',
+        queue_depth=4, rules_file='', disk_cache='', overlays=()):
+    in_flight = deque()
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+            initargs=(html_mode, direction, rules_file, disk_cache, overlays)) as executor:
+        for (id, href, source) in pending_pages(bk, files, stats, errors, manifest):
+            in_flight.append((id, href, source, executor.submit(worker_html_lat2cyr, (source, href))))
+            if len(in_flight) >= workers + queue_depth:
+                collect_page(bk, in_flight.popleft(), stats, errors, manifest)
+        while in_flight:
+            collect_page(bk, in_flight.popleft(), stats, errors, manifest)
+
+
+def collect_page(bk, item, stats, errors, manifest):
+    (id, href, source, future) = item
+    try:
+        (transliterated, worker_stats) = future.result()
+    except BrokenProcessPool:
+        raise
+    except Exception as e:
+        report_error(errors, href, e, stats)
+        return
+    stats.merge(worker_stats)
+    commit_page(bk, id, href, source, transliterated, stats, errors, manifest)
+
+
+# Yields (id, href, source) of files which need transliteration
+def pending_pages(bk, files, stats, errors, manifest=None):
+    for (id, href,) in files:
+        try:
+            source = read_file(bk, id, stats)
+        except Exception as e:
+            report_error(errors, href, e, stats)
+            continue
+        if is_transliterated(manifest, id, source, stats):
+            print("Датотека '%s' је већ пресловљена" % (href))
+            continue
+        yield (id, href, source)
+
+
+# Returns transliterated file, None if it failed
+def transform_page(source, href, cyr, html_parser, html_mode, stats, errors, rules=None):
+    try:
+        return translit_page(source, href, cyr, html_parser, html_mode, stats, rules)
+    except Exception as e:
+        report_error(errors, href, e, stats)
+        return None
+
+
+def commit_page(bk, id, href, source, transliterated, stats, errors, manifest=None):
+    try:
+        save_file(bk, id, source, transliterated, manifest, stats)
+    except Exception as e:
+        report_error(errors, href, e, stats)
+        return
+    print("Пресловљена датотека '%s'" % (href))
+
+
+# Failed file is reported and skipped, the rest of the book is still converted
+def report_error(errors, href, e, stats):
+    message = '%s: %s' % (type(e).__name__, e)
+    errors.append((href, message))
+    stats.count('failed_files')
+    print("ГРЕШКА: Датотека '%s' није пресловљена (%s)" % (href, message))
+
+
+# True if file is the same as written by the previous run of the plugin
+def is_transliterated(manifest, id, source, stats):
+    if manifest is None:
+        return False
+    with stats.timer('manifest.check'):
+        if manifest.is_transliterated(id, source):
+            stats.count('skipped_files')
+            return True
+    return False
+
+
+# Writes transliterated file, unless it is the same as the source
+def save_file(bk, id, source, transliterated, manifest, stats):
+    if manifest is not None:
+        manifest.record(id, source, transliterated)
+    if same_content(source, transliterated):
+        stats.count('unchanged_files')
+        return
+    write_file(bk, id, transliterated, stats)
+
+
+def same_content(source, transliterated):
+    if isinstance(source, str):
+        source = source.encode('utf-8')
+    if isinstance(transliterated, str):
+        transliterated = transliterated.encode('utf-8')
+    return source == transliterated
+
+
+# Number of worker processes that makes sense for given number of files
+def count_workers(workers, files_count):
+    if workers <= 0:
+        workers = os.cpu_count() or 1
+    return min(workers, files_count)
+
+
+def read_file(bk, id, stats):
+    with stats.timer('bk.readfile'):
+        return bk.readfile(id)
+
+
+def write_file(bk, id, data, stats):
+    with stats.timer('bk.writefile'):
+        bk.writefile(id, data)
+
+
+# Converts XHTML file in selected mode ('tree' or 'stream')
+# Files with nothing to transliterate between tags are not parsed with lxml,
+# only their markup is updated by the stream rewriter
+def translit_html(source, cyr, html_parser, html_mode, stats=None, rules=None):
+    if stats is None:
+        stats = Stats()
+    with stats.timer('html.precheck'):
+        fast_path = not has_text_to_convert(source, cyr)
+    if fast_path:
+        stats.count('fast_path_files')
+    if html_mode == 'stream' or fast_path:
+        return html_lat2cyr_stream(source, cyr, stats, rules)
+    return html_lat2cyr(source, cyr, HTML_DOCTYPE, html_parser, stats, rules)
+
+
+# Regexes finding a letter to convert in text between tags, by converter's letters
+_text_letter_regexes = dict()
+
+# True if text between tags contains a letter which converter changes.
+# Entity references are skipped; script, style and comments may give
+# false positives, which only cost the regular conversion. Character,
+# reference and lone '&' can be matched in one way only, and text stops
+# at '>' where the next search starts, so time is linear in the source.
+def has_text_to_convert(source, cyr):
+    if isinstance(source, bytes):
+        source = source.decode('utf-8')
+    regex = _text_letter_regexes.get(cyr.letters_class)
+    if regex is None:
+        others = '[^<>&' + cyr.letters_class[1:]
+        regex = re.compile('>(?:%s|&#?\\w+;|&(?!#?\\w+;))*%s' % (others, cyr.letters_class))
+        _text_letter_regexes[cyr.letters_class] = regex
+    return regex.search(source) is not None
+
+
+# Converts XHTML file, recording its sizes and number of words
+def translit_page(source, href, cyr, html_parser, html_mode, stats, rules=None):
+    words = cyr.counters[cyr.C_COUNT_WORDS]
+    transliterated = translit_html(source, cyr, html_parser, html_mode, stats, rules)
+    stats.add_file(href, len(source.encode('utf-8')), len(transliterated),
+        cyr.counters[cyr.C_COUNT_WORDS] - words)
+    return transliterated
+
+
+# Parses XHTML file and classifies words that would be transliterated,
+# without converting or serializing anything. Elements are chosen by the
+# same rules in either html_mode. Returns result of cyr.analyze_many().
+def analyze_html(source, cyr, html_parser, stats=None, rules=None, memo=None):
+    if stats is None:
+        stats = Stats()
+    if rules is None:
+        rules = default_html_rules()
+    with stats.timer('html.parse'):
+        tree = etree.HTML(source.encode('utf-8') if isinstance(source, str) else source, html_parser)
+    with stats.timer('html.walk'):
+        (text_elems, tail_elems) = rules.apply(tree, cyr.LANG)
+    with stats.timer('html.analyze'):
+        texts = [remove_soft_hyphens(elem.text) for elem in text_elems] + \
+            [remove_soft_hyphens(elem.tail) for elem in tail_elems]
+        return cyr.analyze_many(texts, memo)
+
+
+# Like analyze_html, for table of contents and metadata
+def analyze_xml(source, cyr, xml_parser, stats=None, memo=None):
+    if stats is None:
+        stats = Stats()
+    with stats.timer('xml.parse'):
+        (tree, _) = parse_xml(source, xml_parser)
+    with stats.timer('xml.walk'):
+        (targets, texts) = collect_xml_texts(tree, cyr)
+    with stats.timer('xml.analyze'):
+        return cyr.analyze_many(texts, memo)
+
+
+# Classifies words of all files of the book, returning Analysis.
+# Files are only read; book is left as it is.
+def analyze_book(bk, html_parser, xml_parser, cyr, stats, rules=None):
+    analysis = Analysis(cyr.C_ANALYSIS_COUNTERS, cyr.C_ANALYSIS_COUNTERS[1])
+    # Words are classified once for the whole book
+    memo = dict()
+    analysis.add_file('toc.ncx', *analyze_xml(read_file(bk, bk.gettocid(), stats), cyr, xml_parser, stats, memo))
+    with stats.timer('bk.getmetadataxml'):
+        metadata = bk.getmetadataxml()
+    analysis.add_file('content.opf', *analyze_xml(metadata, cyr, xml_parser, stats, memo))
+    for (id, href) in bk.text_iter():
+        try:
+            analysis.add_file(href, *analyze_html(read_file(bk, id, stats), cyr, html_parser, stats, rules, memo))
+        except Exception as e:
+            stats.count('failed_files')
+            print("ГРЕШКА: Датотека '%s' није анализирана (%s: %s)" % (href, type(e).__name__, e))
+    return analysis
+
+
+# Transliterator and parsers are created once per worker process, or
+# per thread when workers are threads (lib/aio.py); lxml parsers must
+# not be shared between threads
+_worker = threading.local()
+
+def init_worker(html_mode, direction='lat2cyr', rules_file='', disk_cache='', overlays=()):
+    _worker.cyr = create_converter(direction, disk_cache, overlays)
+    _worker.html_parser = create_html_parser()
+    _worker.xml_parser = create_xml_parser()
+    _worker.html_mode = html_mode
+    _worker.rules = create_html_rules(rules_file)
+
+
+# Returns transliterated file and statistics collected while converting it
+def worker_html_lat2cyr(item):
+    (source, href) = item
+    stats = Stats()
+    counters = Counter(_worker.cyr.counters)
+    transliterated = translit_page(source, href, _worker.cyr, _worker.html_parser, _worker.html_mode, stats, _worker.rules)
+    stats.counters.update(_worker.cyr.counters - counters)
+    return (transliterated, stats.as_dict())
+
+
+# Converts document of given kind ('text', 'xhtml', 'ncx' or 'opf').
+# Text is returned as str, other documents as bytes.
+def worker_convert_document(kind, source):
+    if kind == 'text':
+        return remove_0width_non_joiner(_worker.cyr.transliterate_many([source])[0])
+    if kind == 'xhtml':
+        return translit_html(source, _worker.cyr, _worker.html_parser, _worker.html_mode, rules=_worker.rules)
+    if kind == 'ncx':
+        return xml_lat2cyr(source, _worker.cyr, doctype=NCX_DOCTYPE, xml_parser=_worker.xml_parser)
+    if kind == 'opf':
+        return opf_lat2cyr(source, _worker.cyr, xml_parser=_worker.xml_parser)
+    raise ValueError("unknown kind of document '%s'" % (kind))
+
+
+# Converts document sent to the server (lib/daemon.py); takes and returns bytes
+def worker_convert(kind, data):
+    result = worker_convert_document(kind, data.decode('utf-8'))
+    if kind == 'text':
+        return result.encode('utf-8')
+    return result
+
+
+# Converts EPUB file src_path into dst_path with converters of this worker (lib/batch.py)
+def worker_convert_epub(src_path, dst_path):
+    convert_epub_file(src_path, dst_path, _worker.cyr, _worker.html_parser, _worker.xml_parser, _worker.html_mode,
+        _worker.rules)
+
+
+# Converts EPUB file without unpacking it (lib/epub.py); log(path) is
+# called for every converted file of the book
+def convert_epub_file(src_path, dst_path, cyr, html_parser, xml_parser, html_mode='tree', rules=None, log=None):
+    epub.convert_epub(src_path, dst_path,
+        convert_html=lambda source: translit_html(source, cyr, html_parser, html_mode, rules=rules),
+        convert_ncx=lambda source: xml_lat2cyr(source, cyr, doctype=NCX_DOCTYPE, xml_parser=xml_parser),
+        convert_opf=lambda source: opf_lat2cyr(source, cyr, xml_parser=xml_parser),
+        log=log)
+
+
+# Returns SerbCyr or SerbLat, both can be passed to the functions above.
+# Disk cache and overlays are used only by SerbCyr, SerbLat does not
+# classify words.
+def create_converter(direction='lat2cyr', disk_cache='', overlays=()):
+    if direction == 'cyr2lat':
+        return pycir.SerbLat()
+    return pycir.SerbCyr(cache_size=WORD_CACHE_SIZE, disk_cache=disk_cache or None, overlays=overlays)
+
+
+# Compiles HTML rules from tables above, changed by JSON file if given
+def create_html_rules(rules_file=''):
+    tables = (HTML_TAGS, ALLOWED_ATTRIBS, ADD_IF_MISSING_ATTRS)
+    if rules_file:
+        tables = load_rules_config(rules_file, *tables)
+    return HtmlRules(*tables)
+
+
+_default_html_rules = None
+
+def default_html_rules():
+    global _default_html_rules
+    if _default_html_rules is None:
+        _default_html_rules = create_html_rules()
+    return _default_html_rules
+
+
+def create_html_parser():
+    return etree.HTMLParser(remove_blank_text=True, remove_comments=False, encoding='utf-8')
+
+
+def create_xml_parser():
+    return etree.XMLParser(remove_blank_text=True, remove_comments=False, resolve_entities=False, encoding='utf-8')
+
+
+# Reads plugin preferences, falling back to defaults
+def get_prefs(bk):
+    prefs = dict(DEFAULT_PREFS)
+    try:
+        stored = bk.getPrefs()
+    except:
+        return prefs
+    for key in DEFAULT_PREFS:
+        if key in stored:
+            prefs[key] = stored[key]
+    return prefs
+
+
+# Book is recognized by its identifiers from content.opf; returns None
+# if there are none, since then books can not be told apart. Each
+# direction of conversion has its own manifest.
+def book_key(bk, direction='lat2cyr'):
+    identifiers = IDENTIFIER_REGEX.findall(bk.getmetadataxml())
+    if not identifiers:
+        return None
+    return digest('\n'.join([direction] + [identifier.strip() for identifier in identifiers]))
+
+
+def load_manifest(bk, key):
+    try:
+        stored = bk.getPrefs()
+        entry = stored.get(MANIFESTS_PREF, {}).get(key)
+    except:
+        entry = None
+    if entry is None:
+        return HashManifest()
+    return HashManifest(entry['files'])
+
+
+# Keeps manifests of MAX_MANIFESTS most recently transliterated books
+def save_manifest(bk, key, manifest):
+    try:
+        stored = bk.getPrefs()
+        manifests = dict(stored.get(MANIFESTS_PREF, {}))
+        manifests[key] = {'time' : datetime.now().isoformat(timespec='seconds'), 'files' : manifest.as_dict()}
+        for old_key in sorted(manifests, key=lambda k: manifests[k]['time'])[:-MAX_MANIFESTS]:
+            del manifests[old_key]
+        stored[MANIFESTS_PREF] = manifests
+        bk.savePrefs(stored)
+    except Exception as e:
+        print("ПАЖЊА: Списак пресловљених датотека није сачуван (%s)" % (e))
 
 
 def show_system_info(launcher_version, epub_version):
@@ -190,9 +844,18 @@ def show_system_info(launcher_version, epub_version):
     print("*******")
 
 def run(bk):
-    cyr = pycir.SerbCyr()
-    html_parser = etree.HTMLParser(remove_blank_text=True, remove_comments=False, encoding='utf-8')
-    xml_parser = etree.XMLParser(remove_blank_text=True, remove_comments=False, resolve_entities=False, encoding='utf-8')
+    prefs = get_prefs(bk)
+    disk_cache = prefs['disk_cache']
+    overlays = list(prefs['overlays'])
+    try:
+        cyr = create_converter(prefs['direction'], disk_cache, overlays)
+    except Exception as e:
+        print("ПАЖЊА: Кеш речи или спискови речи корисника нису учитани (%s), наставља се без њих" % (e))
+        disk_cache = ''
+        overlays = []
+        cyr = create_converter(prefs['direction'])
+    html_parser = create_html_parser()
+    xml_parser = create_xml_parser()
 
     try:
         epub_version = bk.epub_version()
@@ -200,16 +863,72 @@ def run(bk):
         print("ПАЖЊА: Непостојећа функција 'epub_version()' у овој верзији Сигил-а")
         epub_version = "Непозната верзија"
     show_system_info(bk.launcher_version(), epub_version)
-    print("Пресловљавање ЕПУБ-а на српску ћирилицу...")
+    if prefs['analyze_only']:
+        print("Анализа ЕПУБ-а, без пресловљавања...")
+    elif prefs['direction'] == 'cyr2lat':
+        print("Пресловљавање ЕПУБ-а на српску латиницу...")
+    else:
+        print("Пресловљавање ЕПУБ-а на српску ћирилицу...")
+    rules_file = prefs['rules_file']
+    try:
+        rules = create_html_rules(rules_file)
+    except Exception as e:
+        print("ПАЖЊА: Правила из датотеке '%s' нису учитана (%s), користе се подразумевана" % (rules_file, e))
+        rules_file = ''
+        rules = default_html_rules()
     start = datetime.now()
-    translit_toc(bk, xml_parser, cyr)
-    translit_metadata(bk, xml_parser, cyr)
-    translit_pages(bk, html_parser, cyr)
+    stats = Stats()
+    if prefs['analyze_only']:
+        analysis = analyze_book(bk, html_parser, xml_parser, cyr, stats, rules)
+        end = datetime.now()
+        print("Трајање анализе: %f секунди" % (end - start).total_seconds())
+        report_analysis(analysis, prefs['top_hits'], prefs['report_json'])
+        return 0
+    key = book_key(bk, prefs['direction']) if prefs['incremental'] else None
+    manifest = load_manifest(bk, key) if key is not None else None
+    translit_toc(bk, xml_parser, cyr, stats, manifest)
+    translit_metadata(bk, xml_parser, cyr, stats, manifest)
+    translit_pages(bk, html_parser, cyr, stats, prefs['workers'], prefs['html_mode'], manifest,
+        prefs['direction'], prefs['queue_depth'], rules, rules_file, disk_cache, overlays)
+    if manifest is not None:
+        save_manifest(bk, key, manifest)
     end = datetime.now()
     print("Трајање пресловљавања: %f секунди" % (end - start).total_seconds())
+    report_stats(stats, cyr, prefs['report_json'])
     return 0
 
 
+# Prints table of timings and counters, optionally saving it as JSON
+def report_stats(stats, cyr, report_json):
+    stats.counters.update(cyr.counters)
+    cache_info = cyr.cache_info()
+    if cache_info is not None:
+        stats.count('cache_hits', cache_info.hits)
+        stats.count('cache_misses', cache_info.misses)
+    print("*** Статистика пресловљавања ***")
+    for line in stats.summary():
+        print(line)
+    if report_json:
+        try:
+            stats.save_json(report_json)
+            print("Статистика је сачувана у датотеци '%s'" % (report_json))
+        except OSError as e:
+            print("ПАЖЊА: Статистика није сачувана у датотеци '%s' (%s)" % (report_json, e))
+
+
+# Prints tables of analysis, optionally saving them as JSON
+def report_analysis(analysis, top_n, report_json):
+    print("*** Анализа садржаја (ништа није пресловљено) ***")
+    for line in analysis.summary(top_n):
+        print(line)
+    if report_json:
+        try:
+            analysis.save_json(report_json, top_n)
+            print("Анализа је сачувана у датотеци '%s'" % (report_json))
+        except OSError as e:
+            print("ПАЖЊА: Анализа није сачувана у датотеци '%s' (%s)" % (report_json, e))
+
+
 def main():
     print("Долазак у ову функцију није требало да се деси.\n")
     return -1
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+__doc__ = """
+Tests of asyncio interface in lib/aio.py, converting in its own pool of
+workers or through a server of lib/daemon.py running in a thread. Run
+from the plugin directory:
+
+    python3 -m unittest discover tests
+"""
+
+from   concurrent.futures import ThreadPoolExecutor
+from   lib.aio import AsyncTransliterator
+import asyncio
+import lib.daemon as daemon
+import os
+import plugin
+import tempfile
+import tests.wordlists as wordlists
+import threading
+import unittest
+
+
+def setUpModule():
+    wordlists.install()
+
+
+def tearDownModule():
+    wordlists.uninstall()
+
+
+TEXT = 'Dobar dan, odjek injekcija.\r\nLjubav i mržnja — Đorđe, džep, njiva.\n'
+CYRILLIC_TEXT = 'Добар дан, одјек инјекција.\r\nЉубав и мржња — Ђорђе, џеп, њива.\n'
+XHTML = '<?xml version="1.0" encoding="utf-8"?>\n<html xmlns="http://www.w3.org/1999/xhtml">' \
+    '<head><title>Naslov</title></head><body><p>Dobar dan, odjek.</p></body></html>'
+# Text whose conversion takes much longer than ticks of the event loop
+LONG_TEXT = ''.join('reč%d odjek Đurđevdan džezist konjunkcija\n' % (n) for n in range(20000))
+TICK = 0.01
+# Loop iterations run while converter is blocked
+TICKS = 100
+BLOCK_TIMEOUT = 10.0
+
+
+# Yields bytes of text in chunks which split words and UTF-8 sequences
+def byte_chunks(text, size):
+    data = text.encode('utf-8')
+    for start in range(0, len(data), size):
+        yield data[start:start + size]
+
+
+class AsyncTransliteratorTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.TemporaryDirectory()
+        cls.path = os.path.join(cls.directory.name, 'lat2cyr.sock')
+        cls.server = daemon.TransliterationServer(cls.path, plugin.worker_convert, 1, plugin.init_worker, ('tree',))
+        cls.thread = threading.Thread(target=cls.server.serve_forever)
+        cls.thread.start()
+
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        cls.thread.join()
+        cls.directory.cleanup()
+
+
+    # Requests of all tasks go over one connection, from one thread
+    def setUp(self):
+        self.client = daemon.Client(self.path)
+        self.executor = ThreadPoolExecutor(1)
+
+
+    def tearDown(self):
+        self.executor.shutdown()
+        self.client.close()
+
+
+    def convert(self, kind, source):
+        result = self.client.request(kind, source)
+        return result.decode('utf-8') if kind == 'text' else result
+
+
+    def run_with_transliterator(self, test):
+        async def main():
+            async with AsyncTransliterator(self.convert, executor=self.executor) as translit:
+                return await test(translit)
+        return asyncio.run(main())
+
+
+    def test_chunks_equal_whole_text(self):
+        async def test(translit):
+            whole = await translit.transliterate(TEXT * 10)
+            pieces = [piece async for piece in translit.transliterate_chunks(byte_chunks(TEXT * 10, 7))]
+            return (whole, pieces)
+        (whole, pieces) = self.run_with_transliterator(test)
+        self.assertGreater(len(pieces), 1)
+        self.assertEqual(''.join(pieces), whole)
+        self.assertTrue(whole.startswith(CYRILLIC_TEXT))
+
+
+    # Converter is blocked until the event loop has ticked; if the loop
+    # were blocked by it, waiting would time out
+    def test_event_loop_is_not_blocked(self):
+        release = threading.Event()
+
+        def blocked_convert(kind, source):
+            return source if release.wait(BLOCK_TIMEOUT) else None
+
+        async def main():
+            async with AsyncTransliterator(blocked_convert, executor=self.executor) as translit:
+                task = asyncio.create_task(translit.transliterate('dan'))
+                for tick in range(TICKS):
+                    await asyncio.sleep(0)
+                self.assertFalse(task.done())
+                release.set()
+                return await task
+        self.assertEqual(asyncio.run(main()), 'dan')
+
+
+    # Default path: converters prepared by plugin.init_worker in threads or processes
+    def test_own_executor(self):
+        async def main(processes):
+            async with AsyncTransliterator(plugin.worker_convert_document, plugin.init_worker, ('tree',),
+                    workers=2, processes=processes) as translit:
+                pieces = [piece async for piece in translit.transliterate_chunks(byte_chunks(TEXT, 5))]
+                return (await translit.transliterate(TEXT), ''.join(pieces), await translit.convert('xhtml', XHTML))
+        for processes in (False, True):
+            with self.subTest(processes=processes):
+                (text, chunked, xhtml) = asyncio.run(main(processes))
+                self.assertEqual(text, CYRILLIC_TEXT)
+                self.assertEqual(chunked, CYRILLIC_TEXT)
+                self.assertIn('<p>Добар дан, одјек.</p>', xhtml.decode('utf-8'))
+
+
+    def test_connection_survives_cancellation(self):
+        async def test(translit):
+            task = asyncio.create_task(translit.transliterate(LONG_TEXT))
+            await asyncio.sleep(TICK)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+            chunks = translit.transliterate_chunks(byte_chunks(LONG_TEXT, 65536))
+            await chunks.__anext__()
+            await chunks.aclose()
+            return await translit.transliterate(TEXT)
+        self.assertEqual(self.run_with_transliterator(test).split('\r\n')[0], 'Добар дан, одјек инјекција.')
+
+
+if __name__ == '__main__':
+    unittest.main()
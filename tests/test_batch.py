@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+__doc__ = """
+Tests of batch conversion in lib/batch.py. Run from the plugin directory:
+
+    python3 -m unittest discover tests
+"""
+
+import lib.batch as batch
+import os
+import shutil
+import tempfile
+import unittest
+
+
+# Runs in worker process; kills it for books named 'crash'
+def copy_or_crash(input, output):
+    if os.path.basename(input).startswith('crash'):
+        os._exit(1)
+    shutil.copyfile(input, output)
+
+
+class BrokenPoolTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.source = os.path.join(self.directory.name, 'books')
+        os.mkdir(self.source)
+        # Largest book goes first, so that the others wait for the worker when it dies
+        for (name, size) in (('crash.epub', 400), ('a.epub', 300), ('b.epub', 200), ('c.epub', 100)):
+            with open(os.path.join(self.source, name), 'wb') as f:
+                f.write(b'x' * size)
+
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+
+    def test_only_started_book_fails(self):
+        output_dir = os.path.join(self.directory.name, 'output')
+        jobs = batch.load_books(self.source, output_dir)
+        journal = batch.Journal(os.path.join(self.directory.name, batch.DEFAULT_JOURNAL_NAME))
+        records = []
+        summary = batch.run_batch(jobs, copy_or_crash, journal, workers=1, log=records.append)
+        journal.close()
+        statuses = dict((os.path.basename(record['input']), record['status']) for record in records)
+        self.assertEqual(len(records), 4)
+        self.assertEqual(statuses, {'crash.epub' : batch.STATUS_FAILED, 'a.epub' : batch.STATUS_DONE,
+            'b.epub' : batch.STATUS_DONE, 'c.epub' : batch.STATUS_DONE})
+        self.assertEqual((summary.done, summary.failed), (3, 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+__doc__ = """
+Tests of the transliteration server, lib/daemon.py. Run from the plugin directory:
+
+    python3 -m unittest discover tests
+"""
+
+import lib.daemon as daemon
+import os
+import stat
+import tempfile
+import threading
+import unittest
+
+
+CRASH = b'crash'
+
+
+# Runs in worker process: returns document as it is, dies on CRASH
+def echo_or_crash(kind, data):
+    if data == CRASH:
+        os._exit(1)
+    return data
+
+
+class TransliterationServerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'lat2cyr.sock')
+        self.server = daemon.TransliterationServer(self.path, echo_or_crash, 2)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+        self.directory.cleanup()
+
+
+    def test_socket_is_private(self):
+        self.assertEqual(stat.S_IMODE(os.stat(self.path).st_mode), 0o600)
+
+
+    def test_server_recovers_from_dead_worker(self):
+        with daemon.Client(self.path) as client:
+            self.assertEqual(client.request('text', 'dan'), b'dan')
+            with self.assertRaises(daemon.ServerError):
+                client.request('text', CRASH)
+            self.assertEqual(client.request('text', 'dan'), b'dan')
+        with daemon.Client(self.path) as client:
+            self.assertEqual(client.request('xhtml', '<p>dan</p>'), b'<p>dan</p>')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+__doc__ = """
+Tests of conversion and analysis of documents in plugin.py and lat2cyr.py.
+Run from the plugin directory:
+
+    python3 -m unittest discover tests
+"""
+
+from   benchmarks.corpus import CorpusGenerator
+from   benchmarks.fakebook import FakeBook
+from   lib.instrument import Stats
+import contextlib
+import io
+import json
+import lat2cyr
+import lib.py2srbcyr as pycir
+import os
+import plugin
+import tempfile
+import tests.wordlists as wordlists
+import time
+import unittest
+import zipfile
+
+
+def setUpModule():
+    wordlists.install()
+
+
+def tearDownModule():
+    wordlists.uninstall()
+
+
+class HasTextToConvertTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.cyr = pycir.SerbCyr()
+
+
+    def test_latin_text(self):
+        self.assertTrue(plugin.has_text_to_convert('<p>Dobar dan</p>', self.cyr))
+        self.assertTrue(plugin.has_text_to_convert('<p>&nbsp;dan</p>', self.cyr))
+        self.assertTrue(plugin.has_text_to_convert('<p>AT&T</p>', self.cyr))
+        self.assertTrue(plugin.has_text_to_convert('<p>1 &gt; 0 &gt; dan</p>', self.cyr))
+
+
+    def test_references_are_skipped(self):
+        self.assertFalse(plugin.has_text_to_convert('<p>Ћирилица&nbsp;текст</p>', self.cyr))
+        self.assertFalse(plugin.has_text_to_convert('<p>5 &lt; 6 &amp; 7&#8220;</p><p>Дан</p>', self.cyr))
+
+
+    # Every reference could also be matched as lone '&' followed by
+    # other characters, which once took exponential time
+    def test_many_references_take_linear_time(self):
+        source = '<p>' + '&#1234;' * 5000 + '</p>' + '<p>' + '&#8220;&nbsp;' * 5000 + '</p>'
+        start = time.perf_counter()
+        self.assertFalse(plugin.has_text_to_convert(source, self.cyr))
+        self.assertTrue(plugin.has_text_to_convert(source + '<p>dan</p>', self.cyr))
+        self.assertLess(time.perf_counter() - start, 1.0)
+
+
+class XmlLat2CyrTest(unittest.TestCase):
+
+    NCX = '<?xml version="1.0" encoding="utf-8"?>\n' \
+        '<ncx xmlns="http://www.daisy.org/z3986/2005/ncx/" version="2005-1">' \
+        '<docTitle><text>Dobar&nbsp;dan</text></docTitle>' \
+        '<navMap><navPoint id="p1"><navLabel><text>Glava &amp; rep</text></navLabel>' \
+        '<content src="a.xhtml"/></navPoint></navMap></ncx>'
+
+    @classmethod
+    def setUpClass(cls):
+        cls.cyr = pycir.SerbCyr()
+
+
+    # HTML entities are not declared in NCX, but are found in books
+    def test_undeclared_entities_are_kept(self):
+        output = plugin.xml_lat2cyr(self.NCX, self.cyr, xml_parser=plugin.create_xml_parser()).decode('utf-8')
+        self.assertIn('&nbsp;', output)
+        self.assertIn('Глава &amp; реп', output)
+
+
+    def test_well_formed_document(self):
+        output = plugin.xml_lat2cyr(self.NCX.replace('&nbsp;', ' '), self.cyr, xml_parser=plugin.create_xml_parser())
+        self.assertIn('Добар дан', output.decode('utf-8'))
+
+
+# Chapter with tokens which have no Latin letters or are not words
+ODD_PAGE = ('neobicno', 'Text/neobicno.xhtml', '<?xml version="1.0" encoding="utf-8"?>\n'
+    '<html xmlns="http://www.w3.org/1999/xhtml"><head><title>Razno</title></head><body>'
+    '<p>© 2024. 5Ω — Добар&nbsp;дан</p><p>Ćao, DJ-a injekcija 5kg! „the“ 10 km/h</p>'
+    '<p>Само ћирилица © 12</p></body></html>')
+
+
+def make_book():
+    book = CorpusGenerator(seed=7).book(3, paragraphs_per_chapter=10)
+    book['pages'].append(ODD_PAGE)
+    return book
+
+
+# Writes EPUB file with documents of the book
+def write_epub(path, book):
+    items = ''.join('<item id="%s" href="%s" media-type="application/xhtml+xml"/>' % (id, href)
+        for (id, href, _) in book['pages'])
+    with zipfile.ZipFile(path, 'w') as zout:
+        zout.writestr('mimetype', 'application/epub+zip')
+        zout.writestr('META-INF/container.xml', '<?xml version="1.0"?><container version="1.0" '
+            'xmlns="urn:oasis:names:tc:opendocument:xmlns:container"><rootfiles>'
+            '<rootfile full-path="OEBPS/content.opf" media-type="application/oebps-package+xml"/>'
+            '</rootfiles></container>')
+        zout.writestr('OEBPS/content.opf', '<?xml version="1.0" encoding="utf-8"?>'
+            '<package xmlns="http://www.idpf.org/2007/opf" version="2.0">%s<manifest>'
+            '<item id="ncx" href="toc.ncx" media-type="application/x-dtbncx+xml"/>%s</manifest></package>'
+            % (book['metadata'], items))
+        zout.writestr('OEBPS/toc.ncx', book['ncx'])
+        for (id, href, xhtml) in book['pages']:
+            zout.writestr('OEBPS/' + href, xhtml)
+
+
+class AnalyzeBookTest(unittest.TestCase):
+
+    # Counters of transliteration which analysis predicts
+    PREDICTED = tuple(name for name in pycir.SerbCyr.C_ANALYSIS_COUNTERS if name != pycir.SerbCyr.C_COUNT_LATIN_WORDS)
+
+    def setUp(self):
+        self.book = make_book()
+
+
+    def analyze(self):
+        return plugin.analyze_book(FakeBook(self.book), plugin.create_html_parser(), plugin.create_xml_parser(),
+            pycir.SerbCyr(), Stats())
+
+
+    def test_analysis_predicts_counters_of_conversion(self):
+        with contextlib.redirect_stdout(io.StringIO()):
+            analysis = self.analyze()
+            cyr = pycir.SerbCyr()
+            (bk, html_parser, xml_parser, stats) = (FakeBook(self.book), plugin.create_html_parser(),
+                plugin.create_xml_parser(), Stats())
+            plugin.translit_toc(bk, xml_parser, cyr, stats)
+            plugin.translit_metadata(bk, xml_parser, cyr, stats)
+            plugin.translit_pages(bk, html_parser, cyr, stats)
+        for name in self.PREDICTED:
+            self.assertEqual(analysis.totals[name], cyr.counters[name], name)
+        self.assertGreater(analysis.totals[pycir.SerbCyr.C_COUNT_MEASUREMENT_UNIT], 0)
+        self.assertGreater(analysis.totals[pycir.SerbCyr.C_COUNT_DIGRAPH_SPLIT], 0)
+
+
+    # Only the book is read, nothing is written
+    def test_analysis_does_not_change_book(self):
+        bk = FakeBook(self.book)
+        plugin.analyze_book(bk, plugin.create_html_parser(), plugin.create_xml_parser(), pycir.SerbCyr(), Stats())
+        self.assertEqual(bk.written, dict())
+
+
+    def test_analyze_command(self):
+        with tempfile.TemporaryDirectory() as directory:
+            (path, report) = (os.path.join(directory, 'knjiga.epub'), os.path.join(directory, 'analiza.json'))
+            write_epub(path, self.book)
+            output = io.StringIO()
+            with contextlib.redirect_stdout(output):
+                self.assertEqual(lat2cyr.main(['analyze', path, '--top', '5', '--json', report]), 0)
+            with open(report, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        totals = self.analyze().totals
+        for name in pycir.SerbCyr.C_ANALYSIS_COUNTERS:
+            self.assertEqual(data['totals'][name], totals[name], name)
+        self.assertEqual(len(data['files']), len(self.book['pages']) + 2)
+        self.assertIn('OEBPS/Text/neobicno.xhtml', output.getvalue())
+
+
+if __name__ == '__main__':
+    unittest.main()
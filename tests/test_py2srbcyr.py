@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+__doc__ = """
+Tests of text conversion in lib/py2srbcyr.py. Run from the plugin directory:
+
+    python3 -m unittest discover tests
+"""
+
+import io
+import lib.py2srbcyr as pycir
+import os
+import tempfile
+import tests.wordlists as wordlists
+import unittest
+
+
+def setUpModule():
+    wordlists.install()
+
+
+def tearDownModule():
+    wordlists.uninstall()
+
+
+class TransliterateStreamTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.cyr = pycir.SerbCyr()
+
+
+    def transliterate(self, text, chunk_size=pycir.DEFAULT_CHUNK_SIZE):
+        outfile = io.StringIO()
+        self.cyr.transliterate_stream(io.StringIO(text), outfile, chunk_size)
+        return outfile.getvalue()
+
+
+    def test_no_zero_width_non_joiners(self):
+        output = self.transliterate('odjek injekcija\n')
+        self.assertNotIn(pycir.ZERO_WIDTH_NON_JOINER, output)
+        self.assertEqual(output, 'одјек инјекција\n')
+
+
+    def test_chunks_split_between_words(self):
+        text = 'Dobar dan, odjek injekcija.\r\nLjubav i mržnja\n' * 20
+        self.assertEqual(self.transliterate(text, 7), self.transliterate(text))
+
+
+    def test_chunk_size_must_be_positive(self):
+        with self.assertRaises(ValueError):
+            self.transliterate('dan', 0)
+
+
+class DiskCacheErrorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.cyr = pycir.SerbCyr(disk_cache=os.path.join(self.directory.name, 'cache.db'))
+        self.cyr.text_to_cyrillic('Dobar dan')
+
+
+    def tearDown(self):
+        if self.cyr._disk_cache is not None:
+            self.cyr._disk_cache.close()
+        self.directory.cleanup()
+
+
+    # Connection closed under the cache fails every statement
+    def test_cache_is_disabled_on_error(self):
+        self.cyr._disk_cache._db.close()
+        self.cyr.cache_clear()
+        self.assertIsNone(self.cyr._disk_cache)
+        self.assertEqual(self.cyr.counters[pycir.SerbCyr.C_COUNT_DISK_CACHE_ERRORS], 1)
+        self.assertEqual(self.cyr.text_to_cyrillic('Dobar dan'), 'Добар дан')
+
+
+if __name__ == '__main__':
+    unittest.main()
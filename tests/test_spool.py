@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+__doc__ = """
+Tests of the queue in spool directory, lib/spool.py. Run from the plugin directory:
+
+    python3 -m unittest discover tests
+"""
+
+import lib.batch as batch
+import lib.spool as spool
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+
+BOOKS = 12
+# Leases expire quickly; tests wait several times longer
+LEASE_TIMEOUT = 0.05
+EXPIRY_WAIT = 0.2
+LOG_NAME = 'converted.log'
+
+
+# Runs in worker process: copies the book and appends its name to the
+# log next to it, so that every conversion can be counted
+def copy_and_log(input, output):
+    shutil.copyfile(input, output)
+    with open(os.path.join(os.path.dirname(input), LOG_NAME), 'a', encoding='utf-8') as f:
+        f.write(os.path.basename(input) + '\n')
+
+
+class SpoolTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.root = os.path.join(self.directory.name, 'spool')
+        self.books = os.path.join(self.directory.name, 'books')
+        self.output = os.path.join(self.directory.name, 'output')
+        os.mkdir(self.books)
+        os.mkdir(self.output)
+
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+
+    def enqueue(self, count):
+        jobs = []
+        for n in range(count):
+            input = os.path.join(self.books, 'book%02d.epub' % (n))
+            with open(input, 'wb') as f:
+                f.write(b'x' * (n + 1))
+            jobs.append(batch.make_job(input, os.path.join(self.output, os.path.basename(input))))
+        return spool.enqueue(self.root, jobs)
+
+
+    def worker(self, name, **options):
+        return spool.SpoolWorker(self.root, copy_and_log, worker_id=name, **options)
+
+
+    def files(self, directory):
+        return sorted(os.listdir(os.path.join(self.root, directory)))
+
+
+    def test_only_one_worker_claims_job(self):
+        self.enqueue(1)
+        (first, second) = (self.worker('a'), self.worker('b'))
+        self.assertIsNotNone(first.claim())
+        self.assertIsNone(second.claim())
+
+
+    def test_processes_convert_every_book_once(self):
+        ids = self.enqueue(BOOKS)
+        options = {'poll_interval' : 0.01}
+        processes = [multiprocessing.Process(target=spool.run_worker,
+            args=(self.root, copy_and_log, None, (), dict(options, worker_id='w%d' % (n)), None, True))
+            for n in range(3)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+        self.assertEqual(self.files(spool.DONE_DIR), sorted(id + spool.JOB_EXTENSION for id in ids))
+        self.assertEqual(self.files(spool.QUEUE_DIR) + self.files(spool.ACTIVE_DIR) + self.files(spool.FAILED_DIR), [])
+        with open(os.path.join(self.books, LOG_NAME), 'r', encoding='utf-8') as f:
+            converted = f.read().split()
+        self.assertEqual(sorted(converted), sorted(os.listdir(self.output)))
+        self.assertEqual(len(converted), BOOKS)
+
+
+    def test_expired_lease_is_queued_again(self):
+        (id,) = self.enqueue(1)
+        dead = self.worker('dead', lease_timeout=LEASE_TIMEOUT)
+        (job, lease) = dead.claim()
+        time.sleep(EXPIRY_WAIT)
+        reaper = self.worker('reaper', lease_timeout=LEASE_TIMEOUT)
+        self.assertEqual(reaper.reap_expired(), 1)
+        self.assertEqual(self.files(spool.QUEUE_DIR), [id + spool.JOB_EXTENSION])
+        self.assertEqual(self.files(spool.ACTIVE_DIR) + self.files(spool.TMP_DIR), [])
+        # Worker which lost its lease does not publish the record
+        self.assertIsNone(dead.process(job, lease))
+        self.assertEqual(self.files(spool.DONE_DIR), [])
+        (job, lease) = reaper.claim()
+        self.assertEqual(job['attempts'], 1)
+        self.assertEqual(reaper.process(job, lease)['status'], batch.STATUS_DONE)
+
+
+    def test_job_fails_after_max_attempts(self):
+        (id,) = self.enqueue(1)
+        worker = self.worker('w', lease_timeout=LEASE_TIMEOUT, max_attempts=2)
+        for attempt in range(2):
+            self.assertIsNotNone(worker.claim())
+            time.sleep(EXPIRY_WAIT)
+            self.assertEqual(worker.reap_expired(), 1)
+        self.assertEqual(self.files(spool.QUEUE_DIR), [])
+        record = spool.read_json(os.path.join(self.root, spool.FAILED_DIR, id + spool.JOB_EXTENSION))
+        self.assertEqual((record['status'], record['attempts']), (batch.STATUS_FAILED, 2))
+
+
+    def test_invalid_job_is_moved_to_failed(self):
+        spool.create_spool(self.root)
+        with open(os.path.join(self.root, spool.QUEUE_DIR, 'broken' + spool.JOB_EXTENSION), 'w') as f:
+            f.write('{"id" : ')
+        with open(os.path.join(self.root, spool.TMP_DIR, 'stale@gone' + spool.REAP_EXTENSION), 'w') as f:
+            f.write('[]')
+        time.sleep(EXPIRY_WAIT)
+        worker = self.worker('w', lease_timeout=LEASE_TIMEOUT)
+        self.assertEqual(worker.reap_expired(), 0)
+        self.assertIsNone(worker.claim())
+        self.assertEqual(self.files(spool.FAILED_DIR), ['broken' + spool.JOB_EXTENSION, 'stale' + spool.JOB_EXTENSION])
+        self.assertEqual(self.files(spool.QUEUE_DIR) + self.files(spool.ACTIVE_DIR) + self.files(spool.TMP_DIR), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
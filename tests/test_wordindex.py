@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+__doc__ = """
+Tests of compiled word lists, lib/wordindex.py, against linear scans of
+the lists. Run from the plugin directory:
+
+    python3 -m unittest discover tests
+"""
+
+from   lib.wordindex import LayeredIndex, WordIndex
+import lib.wordindex as wordindex
+import os
+import random
+import tempfile
+import time
+import unittest
+
+
+LETTERS = 'adjnoštžčćđ-жђ'
+SEPARATORS = ('', '-')
+
+
+# Linear scans of list of words, in the order of the .txt file
+def linear_has_prefix_of(words, word):
+    return any(word.startswith(prefix) for prefix in words)
+
+
+def linear_first_prefix_of(words, word, separator):
+    for prefix in words:
+        if word.startswith(prefix) and word.startswith(separator, len(prefix)):
+            return prefix
+    return None
+
+
+# Returns words which are prefixes of each other and repeat, and words to look up
+def random_words(seed):
+    generator = random.Random(seed)
+    word = lambda: ''.join(generator.choice(LETTERS) for _ in range(generator.randint(1, 6)))
+    words = [word() for _ in range(300)]
+    words += [w[:generator.randint(1, len(w))] for w in generator.sample(words, 100)]
+    words += generator.sample(words, 20)
+    generator.shuffle(words)
+    queries = words + [w + word() for w in words] + [w + '-' + word() for w in words] + [word() for _ in range(500)]
+    return (words, queries)
+
+
+class WordIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.source = os.path.join(self.directory.name, 'words.txt')
+
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+
+    def write_list(self, words):
+        with open(self.source, 'w', encoding='utf-8') as f:
+            f.write('# comment\n\n' + '\n'.join(words) + '\n')
+
+
+    def assertMatchesLinearScan(self, index, words, queries):
+        self.assertEqual(len(index), len(set(words)))
+        for query in queries:
+            self.assertEqual(query in index, query in words, query)
+            self.assertEqual(index.has_prefix_of(query), linear_has_prefix_of(words, query), query)
+            for separator in SEPARATORS:
+                self.assertEqual(index.first_prefix_of(query, separator),
+                    linear_first_prefix_of(words, query, separator), (query, separator))
+
+
+    def test_lookups_match_linear_scan(self):
+        for seed in range(5):
+            with self.subTest(seed=seed):
+                (words, queries) = random_words(seed)
+                self.write_list(words)
+                self.assertMatchesLinearScan(WordIndex(self.source), words, queries)
+
+
+    # Earlier word of the list wins, also when it is shorter
+    def test_first_prefix_follows_order_of_list(self):
+        self.write_list(['ab', 'a', 'abc', 'đa', 'đ'])
+        index = WordIndex(self.source)
+        self.assertEqual(index.first_prefix_of('abcd'), 'ab')
+        self.assertEqual(index.first_prefix_of('a-b', '-'), 'a')
+        self.assertEqual(index.first_prefix_of('đak'), 'đa')
+        self.assertIsNone(index.first_prefix_of('ab', '-'))
+
+
+    def test_layered_index_matches_linear_scan(self):
+        (words, queries) = random_words(10)
+        (base, overlay) = (words[:300], words[300:])
+        self.write_list(base)
+        index = LayeredIndex(WordIndex(self.source))
+        self.assertEqual(index.set_words(overlay), set(overlay))
+        self.assertMatchesLinearScan(index, base + overlay, queries)
+        self.assertEqual(index.set_words([]), set(overlay))
+        self.assertMatchesLinearScan(index, base, queries)
+
+
+    def test_stale_index_is_rebuilt(self):
+        self.write_list(['prvi'])
+        self.assertIn('prvi', WordIndex(self.source))
+        self.write_list(['drugi'])
+        # Make the list newer than the index, whatever the resolution of file times
+        future = time.time() + 10
+        os.utime(self.source, (future, future))
+        index = WordIndex(self.source)
+        self.assertIn('drugi', index)
+        self.assertNotIn('prvi', index)
+
+
+    def test_corrupt_index_is_rebuilt(self):
+        self.write_list(['reč', 'rečnik'])
+        index_path = WordIndex(self.source).index_path
+        for data in (b'', b'garbage', wordindex.compile_words(['reč', 'rečnik'])[:-1]):
+            with self.subTest(data=data[:8]):
+                with open(index_path, 'wb') as f:
+                    f.write(data)
+                index = WordIndex(self.source)
+                self.assertEqual(index.first_prefix_of('rečnikom'), 'reč')
+                self.assertEqual(os.path.getsize(index_path), len(wordindex.compile_words(['reč', 'rečnik'])))
+
+
+    # Index which can not be written (e.g. plugin directory is read
+    # only) is compiled in memory
+    def test_unwritable_index_is_compiled_in_memory(self):
+        self.write_list(['reč', 'rečnik'])
+        index_path = os.path.join(self.directory.name, 'missing', 'words.idx')
+        index = WordIndex(self.source, index_path)
+        self.assertIn('rečnik', index)
+        self.assertEqual(index.first_prefix_of('rečnikom'), 'reč')
+        self.assertFalse(os.path.exists(index_path))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+__doc__ = """
+Small word lists used by tests instead of lists in lib/, which are not
+part of the repository. Test modules converting text call install() in
+setUpModule() and uninstall() in tearDownModule().
+"""
+
+import lib.py2srbcyr as pycir
+import os
+import tempfile
+
+
+WORD_LISTS = {
+    'serb_words_with_foreign_combs' : ['# Srpske reci sa stranim kombinacijama', 'naddruštv', 'poddirektor',
+        'preddiplom', 'ekstra', 'iznenađ'],
+    'serb_common_foreign_words' : ['# Strane reci', 'facebook', 'google', 'twitter', 'windows', 'iphone'],
+    'whole_foreign_words' : ['# Cele strane reci', 'dj', 'of', 'the', 'and', 'pc', 'cd', 'dvd'],
+    'nj_digraph_exceptions' : ['# nj', 'injekc', 'konjug', 'konjunk', 'vanjezik'],
+    'dj_digraph_exceptions' : ['# dj', 'adjektiv', 'odjek', 'odjav', 'nadjač', 'podjednak'],
+    'dzh_digraph_exceptions' : ['# dž', 'nadžive', 'odžal', 'podžanr'],
+}
+
+_directory = None
+_saved = None
+
+
+# Writes lists to a temporary directory and makes converters use them
+def install():
+    global _directory, _saved
+    if _directory is None:
+        _directory = tempfile.TemporaryDirectory()
+        for name, words in WORD_LISTS.items():
+            with open(os.path.join(_directory.name, name + '.txt'), 'w', encoding='utf-8') as f:
+                f.write('\n'.join(words) + '\n')
+        _saved = pycir.WORD_LISTS_DIR
+    pycir.WORD_LISTS_DIR = _directory.name
+    return _directory.name
+
+
+def uninstall():
+    if _saved is not None:
+        pycir.WORD_LISTS_DIR = _saved